@@ -1,10 +1,37 @@
+import struct
+import sys
+from binascii import crc32
+
 from machine import ADC, Pin
-from time import sleep
+from time import sleep_ms, ticks_add, ticks_diff, ticks_ms
 
 uv_pin = 12
 light_pin = 13
 soil_pin = 14
 
+# Output rate (after decimation) and number of samples sent per frame
+# (at most MAX_FRAME_SAMPLES of serialprotocol.py on the Pi)
+SAMPLE_HZ = 10
+SAMPLES_PER_FRAME = 10
+# Each output sample filters DECIMATION bursts of MEDIAN_TAPS reads per
+# channel: the median of a burst rejects spikes, an IIR low-pass
+# (alpha = 1 / 2**IIR_SHIFT) smooths the medians before decimation
+DECIMATION = 8
+MEDIAN_TAPS = 5
+IIR_SHIFT = 2
+IIR_FRAC = 4
+
+# Frame layout, see serialprotocol.py on the Pi
+SYNC = b'\xaa\x55'
+PROTOCOL_VERSION = 1
+FRAME_WINDOW = 2
+CHANNELS = 3
+# per channel: filtered value, min, max, variance of the window medians
+CHANNEL_FMT = 'HHHI'
+CHANNEL_SIZE = struct.calcsize('<' + CHANNEL_FMT)
+HEADER_FMT = '<2sBBHIHBB'
+HEADER_SIZE = struct.calcsize(HEADER_FMT)
+
 
 # Declare All The Fuction for Initialization
 def uv_init():
@@ -35,8 +62,72 @@ def read_all_sensor():
 uv_init()
 light_init()
 soil_init()
+
+adcs = [uv, light, soil]
+taps = [[0] * MEDIAN_TAPS for _ in range(CHANNELS)]
+iir = [-1] * CHANNELS
+mins = [0] * CHANNELS
+maxs = [0] * CHANNELS
+sums = [0] * CHANNELS
+squares = [0] * CHANNELS
+
+burst_period = max(1, 1000 // (SAMPLE_HZ * DECIMATION))
+period = burst_period * DECIMATION
+frame = bytearray(HEADER_SIZE + CHANNEL_SIZE * CHANNELS * SAMPLES_PER_FRAME + 4)
+body = memoryview(frame)[len(SYNC):-4]
+out = sys.stdout.buffer
+seq = 0
+next_t = ticks_ms()
+
+
+# Filter one decimation window and pack it as sample i of the frame.
+# Integer math only, so that the loop does not allocate floats.
+def window_sample(i):
+    global next_t
+    for c in range(CHANNELS):
+        mins[c] = 0xFFFF
+        maxs[c] = 0
+        sums[c] = 0
+        squares[c] = 0
+    for _ in range(DECIMATION):
+        wait = ticks_diff(next_t, ticks_ms())
+        if wait > 0:
+            sleep_ms(wait)
+        next_t = ticks_add(next_t, burst_period)
+        for c in range(CHANNELS):
+            burst = taps[c]
+            adc = adcs[c]
+            for k in range(MEDIAN_TAPS):
+                burst[k] = adc.read()
+            burst.sort()
+            x = burst[MEDIAN_TAPS // 2]
+            if iir[c] < 0:
+                iir[c] = x << IIR_FRAC
+            else:
+                iir[c] += ((x << IIR_FRAC) - iir[c]) >> IIR_SHIFT
+            if x < mins[c]:
+                mins[c] = x
+            if x > maxs[c]:
+                maxs[c] = x
+            sums[c] += x
+            squares[c] += x * x
+    offset = HEADER_SIZE + CHANNEL_SIZE * CHANNELS * i
+    for c in range(CHANNELS):
+        variance = (DECIMATION * squares[c] - sums[c] * sums[c]) // (DECIMATION * DECIMATION)
+        struct.pack_into('<' + CHANNEL_FMT, frame, offset + CHANNEL_SIZE * c,
+                         (iir[c] + (1 << (IIR_FRAC - 1))) >> IIR_FRAC, mins[c], maxs[c], variance)
+
+
 # Main loop
 while True:
-    print(uv.read(), light.read(), soil.read())
-    sleep(1)
-
+    # start over if we fell more than a frame behind
+    if ticks_diff(ticks_ms(), next_t) > period * SAMPLES_PER_FRAME:
+        next_t = ticks_ms()
+    t0 = next_t
+    for i in range(SAMPLES_PER_FRAME):
+        window_sample(i)
+    struct.pack_into(HEADER_FMT, frame, 0, SYNC, PROTOCOL_VERSION, FRAME_WINDOW, seq, t0, period,
+                     SAMPLES_PER_FRAME, CHANNELS)
+    struct.pack_into('<I', frame, len(frame) - 4, crc32(body))
+    out.write(frame)
+    seq = (seq + 1) & 0xFFFF
@@ -1,4 +1,5 @@
 import time,board,adafruit_dht
+import livestate
 stop = False
 sensor = adafruit_dht.DHT11(board.D4)
 temperature_c = None
@@ -10,6 +11,9 @@ def dht11reader():
             try:
                 temperature_c = sensor.temperature
                 humidity = sensor.humidity
+                now = time.time()
+                livestate.record('temp', temperature_c, now)
+                livestate.record('air_humidity', humidity, now)
                 # print(f"Temp: {temperature_c} C    Humidity: {humidity}")
             except RuntimeError as error:
                 print(error.args[0])
@@ -1,39 +1,107 @@
-import json
+from datetime import datetime, timedelta
+from typing import List, Literal, Optional
 from pydantic import BaseModel
-from model.DataManager import DataManager
-from fastapi import FastAPI
+import statestore
+from model.DataManager import DataManager, DataBucket
+from model.DataRollup import bucket_start
+from orchard.asyncdatabase import AsyncDbManager, create_async_db_engine
+from orchard.cache import row_cache
+from orchard.database import PoolBusyError, db_engine, replica_router, statement_cache
+from orchard.metrics import pool_status, query_metrics
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 
 app = FastAPI()
 
+@app.exception_handler(PoolBusyError)
+async def pool_busy(request: Request, e: PoolBusyError):
+    # all database connections are in use: ask the client to retry
+    return JSONResponse(status_code=503, headers={"Retry-After": "1"},
+                        content={"detail": "Database busy, retry later"})
+
 @app.get("/api")
-async def api():
-    man = DataManager()
-    lst=man.search('1', page_size=50, order_by='data_time DESC')
+async def api(response: Response, after: Optional[str] = None, page_size: int = 50):
+    # keyset pagination from the first page (no after), the token of the
+    # next page is sent in X-Next-Cursor
+    man = AsyncDbManager(DataManager())
+    try:
+        lst, next_cursor = await man.search_keyset('1', page_size=page_size, order_by='data_time DESC', after=after,
+                                             row_format='construct')
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
     return lst
 
+def naive_local(dt: Optional[datetime]) -> Optional[datetime]:
+    # data_time is stored as naive local time (datetime.now()), convert
+    # times with a UTC offset to it
+    if dt is None or dt.tzinfo is None:
+        return dt
+    return dt.astimezone().replace(tzinfo=None)
+
+@app.get("/api/history", response_model=List[DataBucket])
+async def history(start: Optional[datetime] = None, end: Optional[datetime] = None, bucket: int = 3600):
+    """
+    Per-bucket min/max/avg/count of the readings in [start, end).
+    Defaults to the last 7 days in 1 hour buckets, ending with the
+    current bucket. start and end with a UTC offset are converted to
+    the server's local time, like the stored readings.
+    """
+    start = naive_local(start)
+    end = naive_local(end)
+    if end is None:
+        end = datetime.now()
+        if bucket > 0:
+            end = bucket_start(end, bucket) + timedelta(seconds=bucket)
+    if start is None:
+        start = end - timedelta(days=7)
+    man = AsyncDbManager(DataManager())
+    try:
+        return await man.run_read(man.manager.aggregate, start, end, bucket)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/metrics")
+async def metrics(reset: bool = False):
+    """
+    Query latency histograms, row counts, pool checkout waits and the
+    recent slow queries (see orchard.metrics), plus the use of the sync
+    and async pools and the row and statement cache statistics. reset=true starts a new
+    measurement period.
+    """
+    dat = query_metrics.snapshot()
+    dat["pool"] = pool_status(db_engine)
+    async_engine = create_async_db_engine()
+    if async_engine is not None:
+        dat["async_pool"] = pool_status(async_engine.sync_engine)
+    dat["replicas"] = replica_router.stats()
+    dat["row_cache"] = row_cache.stats()
+    dat["statement_cache"] = statement_cache.stats()
+    if reset:
+        query_metrics.reset()
+    return dat
+
 @app.get("/hi")
 async def hi():
     return "hello"
 
 @app.get("/api/getstate")
 async def get_state():
-    with open('state.json', 'r') as f:
-        state = json.load(f)
-    return state
+    state = statestore.store.read()
+    return {"pump": state['pump_state'], "uvlamp": state['uvlamp_state']}
 
 class StateIn(BaseModel):
-    pump: str
-    uvlamp: str
+    pump: Literal["auto", "on", "off"]
+    uvlamp: Literal["auto", "on", "off"]
 
 @app.post("/api/state")
 async def update_state(state_in: StateIn):
     pump = state_in.pump
     uvlamp = state_in.uvlamp
     print("API State",pump, uvlamp)
-    state = {"pump": pump, "uvlamp": uvlamp}
-    with open('userstate.json', 'w') as f:
-        json.dump(state, f)
-    return state
+    statestore.store.update(pump=pump, uvlamp=uvlamp)
+    return {"pump": pump, "uvlamp": uvlamp}
 
 app.mount("/", StaticFiles(directory="./react" , html=True), name="ReactPage")
@@ -1,9 +1,9 @@
-import json
 import os
 from datetime import datetime
 from time import sleep
 
 stop = False
+import livestate
 from LCD import LCD
 
 lcd = LCD(2, 0x27, True)  # params available for rPi revision, I2C Address, and backlight on/off
@@ -27,25 +27,25 @@ def ourip():
     lcd.message(ip, 1)
 
 
+def reading(name, as_int=True):
+    # latest value of a channel, '--' while it has no recent reading
+    value = livestate.latest(name)
+    if value is None:
+        return "--"
+    return int(value) if as_int else value
+
+
 def displayloop():
     global stop
     sleep(3)
     while True:
         try:
             timenow()
-            # Open Current.json
-            try:
-                with open("current.json", "r") as current_json:
-                    current = json.load(current_json)
-                timenow()
-            except:
-                print("JSON Read Fail")
-                lcd.message("JSON Read Fail", 2)
-                sleep(2)
+            # Latest readings, read when shown
             try:
                 timenow()
                 # Show UV Value
-                lcd.message(f"UV Index: {int(current['UV'])} %", 2)
+                lcd.message(f"UV Index: {reading('UV')} %", 2)
                 sleep(1)
                 timenow()
                 sleep(1)
@@ -55,7 +55,7 @@ def displayloop():
                 sleep(1)
                 timenow()
                 # Show Light Value
-                lcd.message(f"Light: {int(current['light'])} %", 2)
+                lcd.message(f"Light: {reading('light')} %", 2)
                 sleep(1)
                 timenow()
                 sleep(1)
@@ -64,11 +64,11 @@ def displayloop():
                 timenow()
                 sleep(1)
                 # Show Temperature
-                lcd.message(f"Temp: {current['temp']} C", 2)
+                lcd.message(f"Temp: {reading('temp', as_int=False)} C", 2)
                 ourip()
                 sleep(4)
                 # Show Humidity
-                lcd.message(f"Humidity: {current['air_humidity']} %", 2)
+                lcd.message(f"Humidity: {reading('air_humidity', as_int=False)} %", 2)
                 timenow()
                 sleep(1)
                 timenow()
@@ -79,7 +79,7 @@ def displayloop():
                 sleep(1)
                 timenow()
                 # Show Soil Humidity
-                lcd.message(f"Soil Humid: {int(current['soil_humidity'])} %", 2)
+                lcd.message(f"Soil Humid: {reading('soil_humidity')} %", 2)
                 sleep(1)
                 timenow()
                 sleep(1)
@@ -89,8 +89,8 @@ def displayloop():
                 sleep(1)
                 timenow()
             except:
-                print("Decoding failed")
-                lcd.message("Err Decoding JSON", 2)
+                print("Display failed")
+                lcd.message("Display Failed", 2)
                 sleep(2)
         except KeyboardInterrupt or stop or SystemExit:
             lcd.clear()
@@ -0,0 +1,142 @@
+# livestate.py
+#
+# The live sensor readings, shared by the reader threads (serialreader,
+# dht11reader) and their consumers (main, relaycontroller, i2cdisplay).
+# Every channel keeps its last BUFFER_SIZE samples, timestamped with the
+# host time.time(), in a fixed-size ring buffer.
+import threading
+import time
+from array import array
+
+# Samples kept per channel (6 minutes at the 10 Hz of the ESP32)
+BUFFER_SIZE = 3600
+# Readings older than this (seconds) are not current anymore
+MAX_AGE = 30
+
+# The channels, named like the DataIn fields
+CHANNELS = ('UV', 'light', 'temp', 'air_humidity', 'soil_humidity')
+
+
+class RingBuffer:
+    """
+    Thread-safe ring buffer of the last size (time, value) samples,
+    stored in two arrays of doubles. append() is O(1) and never
+    allocates.
+    """
+
+    def __init__(self, size=BUFFER_SIZE):
+        self.size = size
+        self.times = array('d', bytes(8 * size))
+        self.values = array('d', bytes(8 * size))
+        # number of samples appended so far, the next slot is count % size
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, value, t=None):
+        if t is None:
+            t = time.time()
+        with self.lock:
+            i = self.count % self.size
+            self.times[i] = t
+            self.values[i] = value
+            self.count += 1
+
+    def latest(self):
+        """
+        Return the last (time, value), or None if empty.
+        """
+        with self.lock:
+            if self.count == 0:
+                return None
+            i = (self.count - 1) % self.size
+            return self.times[i], self.values[i]
+
+    def snapshot(self, seconds=None, now=None):
+        """
+        Return the (time, value) samples of the last seconds (all if
+        None), oldest first.
+        """
+        cutoff = None if seconds is None else (time.time() if now is None else now) - seconds
+        samples = []
+        with self.lock:
+            for k in range(1, min(self.count, self.size) + 1):
+                i = (self.count - k) % self.size
+                if cutoff is not None and self.times[i] < cutoff:
+                    break
+                samples.append((self.times[i], self.values[i]))
+        samples.reverse()
+        return samples
+
+    def stats(self, seconds, now=None):
+        """
+        Return the count, min, max, mean and variance of the samples of
+        the last seconds and the time of the first and last one, or
+        None if there is none.
+        """
+        cutoff = (time.time() if now is None else now) - seconds
+        n = 0
+        mean = m2 = 0.0
+        low = high = first = last = None
+        with self.lock:
+            for k in range(1, min(self.count, self.size) + 1):
+                i = (self.count - k) % self.size
+                t = self.times[i]
+                if t < cutoff:
+                    break
+                v = self.values[i]
+                if n == 0:
+                    low = high = v
+                    last = t
+                low = min(low, v)
+                high = max(high, v)
+                first = t
+                # Welford's update
+                n += 1
+                delta = v - mean
+                mean += delta / n
+                m2 += delta * (v - mean)
+        if n == 0:
+            return None
+        return {'count': n, 'min': low, 'max': high, 'mean': mean, 'variance': m2 / n,
+                'first': first, 'last': last}
+
+
+buffers = {name: RingBuffer() for name in CHANNELS}
+
+# Callbacks called with the channel name after each new sample, in the
+# thread of the reader (keep them short)
+listeners = []
+
+
+def record(name, value, t=None):
+    # add a sample to a channel, None (no reading) is ignored
+    if value is not None:
+        buffers[name].append(value, t)
+        for listener in listeners:
+            listener(name)
+
+
+def latest(name, max_age=MAX_AGE):
+    """
+    Return the last value of a channel, or None if there is none newer
+    than max_age seconds (None for any age).
+    """
+    sample = buffers[name].latest()
+    if sample is None or (max_age is not None and time.time() - sample[0] > max_age):
+        return None
+    return sample[1]
+
+
+def current(max_age=MAX_AGE):
+    """
+    Return the last value of every channel (None if stale), by name.
+    """
+    return {name: latest(name, max_age) for name in CHANNELS}
+
+
+def snapshot(name, seconds=None):
+    return buffers[name].snapshot(seconds)
+
+
+def stats(name, seconds):
+    return buffers[name].stats(seconds)
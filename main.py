@@ -2,21 +2,26 @@ import threading
 from datetime import datetime
 import uvicorn
 import serialreader
+import livestate
+import statestore
 import dht11reader
 from time import sleep
 import i2cdisplay
 # from gpiozero import LED
-import json
 print("Importing finished")
 import relaycontroller
 print("Relay controller imported")
 from model.DataManager import DataManager, Data, DataIn
+from orchard.writebuffer import WriteBuffer
+import model.DataRetention
 print("Import finished")
-class DateTimeEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        return super(DateTimeEncoder, self).default(obj)
+
+# Seconds between two stored readings
+SAMPLE_INTERVAL = 30
+# Sensor rows are buffered and written in batches, at least every
+# minute: /api and /api/history lag (and a power cut loses) at most that
+WRITE_BUFFER_ROWS = 2
+WRITE_BUFFER_INTERVAL = 60
 
 threading.Thread(target=serialreader.readloop).start()
 # print("Serial reader started")
@@ -27,31 +32,34 @@ threading.Thread(target=lambda: uvicorn.run("fastapihandler:app", host="0.0.0.0"
 threading.Thread(target=relaycontroller.relaycontroller).start()
 # print("Relay controller started")
 threading.Thread(target=i2cdisplay.displayloop).start()
+if model.DataRetention.DATA_RETENTION_DAYS > 0:
+    threading.Thread(target=model.DataRetention.retention_loop, daemon=True).start()
+threading.Thread(target=model.DataRetention.partition_loop, daemon=True).start()
+if statestore.CHECKPOINT_INTERVAL > 0:
+    threading.Thread(target=statestore.store.checkpoint_loop, daemon=True).start()
 sleep(2)
 data_man = DataManager()
+data_buffer = WriteBuffer(data_man, max_rows=WRITE_BUFFER_ROWS, flush_interval=WRITE_BUFFER_INTERVAL)
 while True :
     try :
-        currentjson = open("current.json", "w")
-        print(f"Dirt: {serialreader.dirt} UV: {serialreader.uv} Light: {serialreader.light}")
-        print(f"Temp: {dht11reader.temperature_c} C    Humidity: {dht11reader.humidity}")
+        current = livestate.current()
+        print(f"Dirt: {current['soil_humidity']} UV: {current['UV']} Light: {current['light']}")
+        print(f"Temp: {current['temp']} C    Humidity: {current['air_humidity']}")
         data = DataIn(
             data_time=datetime.now() ,
-            UV=serialreader.uv if serialreader.uv is not None else -1.0,
-            light=serialreader.light if serialreader.light is not None else -1.0,
-            temp=dht11reader.temperature_c if dht11reader.temperature_c is not None else -1.0,
-            air_humidity=dht11reader.humidity if dht11reader.humidity is not None else -1.0,
-            soil_humidity=serialreader.dirt if serialreader.dirt is not None else -1.0
+            **{name: value if value is not None else -1.0 for (name, value) in current.items()}
         )
-        data_man.insert(data)
+        data_buffer.add(data)
+        statestore.store.update(data_time=data.data_time.timestamp(), **current)
         print(data.__dict__)
-        currentjson.write(json.dumps(data.__dict__, cls=DateTimeEncoder))
-        currentjson.close()
-        sleep(30)
+        sleep(SAMPLE_INTERVAL)
     except KeyboardInterrupt or SystemExit or serialreader.stop or dht11reader.stop:
         # Stop all active thread
         serialreader.stop = True
         # i2cdisplay.stop = True
         dht11reader.stop = True
+        data_buffer.close()
+        statestore.store.checkpoint()
         # i2cdisplay.stopdisplay()
         print("Quitting !")
         break
\ No newline at end of file
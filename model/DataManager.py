@@ -1,8 +1,18 @@
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import List, Optional
 
 from pydantic import BaseModel
+from sqlalchemy import func, select
 
 from orchard.database import DbManager
+from orchard.metrics import operation
+
+#: the sensor columns of the data table
+SENSOR_COLUMNS = ('UV', 'light', 'temp', 'air_humidity', 'soil_humidity')
+
+EPOCH = datetime(1970, 1, 1)
+
+
 class DataIn(BaseModel):
     data_time: datetime
     UV: float
@@ -13,6 +23,40 @@ class DataIn(BaseModel):
 class Data(DataIn):
     data_id: int
 
+
+class Stat(BaseModel):
+    min: Optional[float]
+    max: Optional[float]
+    avg: Optional[float]
+
+
+class DataBucket(BaseModel):
+    bucket_time: datetime
+    count: int
+    UV: Stat
+    light: Stat
+    temp: Stat
+    air_humidity: Stat
+    soil_humidity: Stat
+
+
+def merge_buckets(a: DataBucket, b: DataBucket) -> DataBucket:
+    """
+    Merge two aggregates of the same bucket (averages weighted by the
+    counts).
+    """
+    def pick(f, x, y):
+        return y if x is None else x if y is None else f(x, y)
+
+    count = a.count + b.count
+    dat = {}
+    for c in SENSOR_COLUMNS:
+        sa, sb = getattr(a, c), getattr(b, c)
+        avg = pick(lambda x, y: (x * a.count + y * b.count) / count, sa.avg, sb.avg)
+        dat[c] = Stat(min=pick(min, sa.min, sb.min), max=pick(max, sa.max, sb.max), avg=avg)
+    return DataBucket(bucket_time=a.bucket_time, count=count, **dat)
+
+
 class DataManager(DbManager):
 
     sql_create_table = """
@@ -24,9 +68,111 @@ CREATE TABLE `data` (
   `temp` float DEFAULT NULL,
   `air_humidity` float DEFAULT NULL,
   `soil_humidity` float DEFAULT NULL,
-  PRIMARY KEY (`data_id`)
+  PRIMARY KEY (`data_id`),
+  KEY `data_time` (`data_time`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
     """
 
+    indexes = {
+        'data_time': ['data_time'],
+    }
+
+    #: monthly partitions, see DbManager.partition_table()
+    partition_column = 'data_time'
+
+    #: the maximum number of buckets returned by aggregate()
+    max_buckets = 5000
+
+    #: maintain the rollup tables (see model.DataRollup) on insert and
+    #: answer aggregate() from them
+    use_rollups = True
+
     def __init__(self):
-        super().__init__("data", DataIn)
\ No newline at end of file
+        super().__init__("data", DataIn)
+        self.rollups = []
+        if self.use_rollups:
+            # created up front: a rollup table must not be created from
+            # within an insert transaction (SQLite has a single writer)
+            from model.DataRollup import ROLLUP_LEVELS, DataRollupManager
+            self.rollups = [DataRollupManager(width) for width in ROLLUP_LEVELS]
+
+    def after_insert(self, rows, connector=None) -> None:
+        for rollup in self.rollups:
+            rollup.rollup_rows(rows, connector=connector)
+
+    @operation
+    def aggregate(self,
+                  start: datetime,
+                  end: datetime,
+                  bucket_seconds: int,
+                  connector=None) -> List[DataBucket]:
+        """
+        Return per-bucket count, min, max and avg of the sensor columns
+        for readings in [start, end), computed by the database.
+
+        The query is routed to the coarsest rollup table that can
+        answer it exactly (bucket width and range aligned to the
+        rollup width), otherwise the raw readings are used. The
+        readings before the rollup's coverage (see
+        DataRollupManager.covered_from(), e.g. the ones from before the
+        rollup was created and backfilled) are read from the raw table
+        as well, and a bucket spanning both is merged.
+
+        :param start: the start of the range (inclusive)
+        :param end: the end of the range (exclusive)
+        :param bucket_seconds: the width of a bucket in seconds
+        :return: the non-empty buckets ordered by time
+        :raise ValueError: if the bucket width is not positive or the
+            range has more than max_buckets buckets
+        """
+        if bucket_seconds <= 0:
+            raise ValueError("bucket width must be positive")
+        if (end - start).total_seconds() / bucket_seconds > self.max_buckets:
+            raise ValueError(f"too many buckets (max {self.max_buckets})")
+        if self.use_rollups:
+            from model.DataRollup import DataRollupManager, rollup_level
+            width = rollup_level(start, end, bucket_seconds)
+            if width is not None:
+                rollup = DataRollupManager(width)
+                split = rollup.covered_from(connector=connector)
+                if split is not None and split < end:
+                    result = []
+                    if start < split:
+                        result = self.aggregate_raw(start, split, bucket_seconds, connector=connector)
+                    rolled = rollup.aggregate(max(start, split), end, bucket_seconds, connector=connector)
+                    if len(result) > 0 and len(rolled) > 0 and result[-1].bucket_time == rolled[0].bucket_time:
+                        result[-1] = merge_buckets(result[-1], rolled.pop(0))
+                    return result + rolled
+        return self.aggregate_raw(start, end, bucket_seconds, connector=connector)
+
+    def aggregate_raw(self,
+                      start: datetime,
+                      end: datetime,
+                      bucket_seconds: int,
+                      connector=None) -> List[DataBucket]:
+        """
+        Same as aggregate(), always computed from the raw readings.
+        """
+        table = self.table
+        bucket = self.time_bucket(table.c.data_time, bucket_seconds).label('bucket')
+        fields = [bucket, func.count().label('count')]
+        for c in SENSOR_COLUMNS:
+            fields += [func.min(table.c[c]).label(c + '_min'),
+                       func.max(table.c[c]).label(c + '_max'),
+                       func.avg(table.c[c]).label(c + '_avg')]
+        sql = select(*fields) \
+            .where(table.c.data_time >= start) \
+            .where(table.c.data_time < end) \
+            .group_by(bucket) \
+            .order_by(bucket)
+        connector = self.read_connector(connector)
+        with connector() as conn:
+            rows = conn.execute(sql).fetchall()
+        result = []
+        for r in rows:
+            m = r._mapping
+            dat = {c: Stat(min=m[c + '_min'], max=m[c + '_max'], avg=m[c + '_avg']) for c in SENSOR_COLUMNS}
+            result.append(DataBucket(bucket_time=EPOCH + timedelta(seconds=int(m['bucket'])),
+                                     count=m['count'],
+                                     **dat))
+        return result
@@ -0,0 +1,170 @@
+"""
+Retention and compaction of the sensor readings.
+
+Raw readings older than DATA_RETENTION_DAYS are first summarized into
+the rollup tables (see model.DataRollup) and then deleted: whole monthly
+partitions are dropped when the data table is partitioned, the rest is
+deleted in small batches. Fine-grained rollups have their own retention.
+
+    python -m model.DataRetention [compact] [--days 90] [--dry-run]
+    python -m model.DataRetention partition --start 2024-01-01
+"""
+
+import argparse
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, select
+
+from model.DataManager import DataManager
+from model.DataRollup import ROLLUP_LEVELS, DataRollupManager, backfill, bucket_start
+from orchard import settings
+from orchard.database import connectivity
+
+DATA_RETENTION_DAYS = settings.config.DATA_RETENTION_DAYS
+DATA_RETENTION_BATCH = settings.config.DATA_RETENTION_BATCH
+
+#: seconds between two checks for missing monthly partitions
+PARTITION_CHECK_INTERVAL = 86400
+
+#: retention of each rollup level in days (0 to keep forever)
+ROLLUP_RETENTION_DAYS: Dict[int, int] = {60: 400, 3600: 0, 86400: 0}
+
+# logging
+logger = logging.getLogger(__name__)
+
+stop = False
+
+
+def retention_cutoff(days: int, now: Optional[datetime] = None) -> datetime:
+    """
+    Return the start of the day, days ago. Cutoffs are aligned to the
+    coarsest rollup so that no rollup bucket is left half compacted.
+    """
+    if now is None:
+        now = datetime.now()
+    return bucket_start(now - timedelta(days=days), max(ROLLUP_LEVELS))
+
+
+def compact(days: int = DATA_RETENTION_DAYS,
+            batch_size: int = DATA_RETENTION_BATCH,
+            pause: float = 0.1,
+            dry_run: bool = False) -> int:
+    """
+    Summarize the raw readings older than the cutoff into the rollup
+    tables and delete them.
+
+    :return: the number of raw rows deleted
+    """
+    if days <= 0:
+        return 0
+    cutoff = retention_cutoff(days)
+    data_man = DataManager()
+    table = data_man.table
+    with connectivity(data_man.db_engine)() as conn:
+        first = conn.execute(select(func.min(table.c.data_time))).scalar()
+    if first is None or first >= cutoff:
+        logger.info("[DataRetention.compact] nothing older than %s", cutoff)
+        return 0
+    logger.info("[DataRetention.compact] compacting %s - %s", first, cutoff)
+    if dry_run:
+        return data_man.count("data_time < :cutoff", {"cutoff": cutoff})
+    # make sure the rollups are complete before the raw rows go away
+    backfill(first, cutoff)
+    dropped = data_man.drop_partitions_before(cutoff)
+    if len(dropped) > 0:
+        logger.info("[DataRetention.compact] dropped partitions %s", dropped)
+    return data_man.delete_in_batches(table.c.data_time < cutoff,
+                                      condIsText=False,
+                                      batch_size=batch_size,
+                                      pause=pause)
+
+
+def expire_rollups(batch_size: int = DATA_RETENTION_BATCH, pause: float = 0.1) -> int:
+    """
+    Delete the rollup rows older than their level's retention.
+
+    :return: the number of rollup rows deleted
+    """
+    total = 0
+    for width in ROLLUP_LEVELS:
+        days = ROLLUP_RETENTION_DAYS.get(width, 0)
+        if days <= 0:
+            continue
+        man = DataRollupManager(width)
+        total += man.delete_in_batches(man.table.c.bucket_time < retention_cutoff(days),
+                                       condIsText=False,
+                                       batch_size=batch_size,
+                                       pause=pause)
+    return total
+
+
+def maintain_partitions() -> List[str]:
+    """
+    Create the upcoming monthly partitions of the data table (nothing
+    if it is not partitioned).
+
+    :return: the names of the partitions created
+    """
+    created = DataManager().ensure_partitions()
+    if len(created) > 0:
+        logger.info("[DataRetention] created partitions %s", created)
+    return created
+
+
+def partition_loop(interval: float = PARTITION_CHECK_INTERVAL):
+    """
+    Create the upcoming partitions now and every interval seconds (run
+    in a thread). Independent of the retention policy: without it, new
+    rows would all end up in p_future once the created months run out.
+    """
+    while not stop:
+        try:
+            maintain_partitions()
+        except Exception as e:
+            logger.error(f"[DataRetention] Failed to create partitions: {e}")
+        time.sleep(interval)
+
+
+def apply_retention() -> None:
+    deleted = compact()
+    expired = expire_rollups()
+    logger.info("[DataRetention] %s raw rows compacted, %s rollup rows expired", deleted, expired)
+
+
+def retention_loop(interval: float = 3600.0):
+    """
+    Apply the retention policy every interval seconds (run in a
+    thread).
+    """
+    while not stop:
+        try:
+            apply_retention()
+        except Exception as e:
+            logger.error(f"[DataRetention] Failed to apply retention: {e}")
+        time.sleep(interval)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compact and expire old sensor readings.')
+    parser.add_argument('command', nargs='?', choices=['compact', 'partition'], default='compact')
+    parser.add_argument('--days', type=int, default=DATA_RETENTION_DAYS)
+    parser.add_argument('--batch', type=int, default=DATA_RETENTION_BATCH)
+    parser.add_argument('--start', type=datetime.fromisoformat, default=None,
+                        help='first month of the partitions (partition)')
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args()
+    if args.command == 'partition':
+        man = DataManager()
+        if len(man.list_partitions()) > 0:
+            print('created', man.ensure_partitions())
+        else:
+            man.partition_table((args.start or datetime.now()).date())
+            print('partitioned', man.table_name, [n for (n, _) in man.list_partitions()])
+        exit()
+    n = compact(args.days, args.batch, dry_run=args.dry_run)
+    print(('would delete' if args.dry_run else 'deleted'), n, 'raw rows')
+    if not args.dry_run:
+        print('expired', expire_rollups(args.batch), 'rollup rows')
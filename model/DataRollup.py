@@ -0,0 +1,319 @@
+"""
+Downsampled rollups of the data table.
+
+Each rollup table keeps, per fixed-width bucket, the number of samples
+and the min, max and sum of every sensor column. They are maintained
+incrementally by DataManager.after_insert() and can be rebuilt from the
+raw readings with:
+
+    python -m model.DataRollup backfill [--start 2024-01-01] [--end 2024-02-01]
+
+Until then, DataManager.aggregate() answers the buckets before the
+first rollup row from the raw readings.
+"""
+
+import argparse
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel
+from sqlalchemy import func, select
+
+from model.DataManager import EPOCH, SENSOR_COLUMNS, DataBucket, DataManager, Stat
+from orchard.database import DbManager, connectivity
+from orchard.metrics import operation
+
+#: the widths (in seconds) of the rollup tables: 1 minute, 1 hour, 1 day
+ROLLUP_LEVELS = (60, 3600, 86400)
+
+
+class DataRollup(BaseModel):
+    bucket_time: datetime
+    samples: int
+    UV_min: Optional[float]
+    UV_max: Optional[float]
+    UV_sum: Optional[float]
+    light_min: Optional[float]
+    light_max: Optional[float]
+    light_sum: Optional[float]
+    temp_min: Optional[float]
+    temp_max: Optional[float]
+    temp_sum: Optional[float]
+    air_humidity_min: Optional[float]
+    air_humidity_max: Optional[float]
+    air_humidity_sum: Optional[float]
+    soil_humidity_min: Optional[float]
+    soil_humidity_max: Optional[float]
+    soil_humidity_sum: Optional[float]
+
+
+def epoch_seconds(dt: datetime) -> int:
+    return int((dt - EPOCH).total_seconds())
+
+
+def bucket_start(dt: datetime, width: int) -> datetime:
+    return EPOCH + timedelta(seconds=epoch_seconds(dt) // width * width)
+
+
+def merge_rows(old, new) -> Dict[str, Any]:
+    """
+    Merge two rollup rows of the same bucket.
+    """
+    def pick(f, a, b):
+        return b if a is None else a if b is None else f(a, b)
+
+    dat = {'bucket_time': new['bucket_time'], 'samples': old['samples'] + new['samples']}
+    for c in SENSOR_COLUMNS:
+        dat[c + '_min'] = pick(min, old[c + '_min'], new[c + '_min'])
+        dat[c + '_max'] = pick(max, old[c + '_max'], new[c + '_max'])
+        dat[c + '_sum'] = pick(lambda a, b: a + b, old[c + '_sum'], new[c + '_sum'])
+    return dat
+
+
+class DataRollupManager(DbManager):
+
+    sql_create_table_template = """
+CREATE TABLE `{table_name}` (
+  `bucket_time` datetime NOT NULL,
+  `samples` int(10) unsigned NOT NULL DEFAULT 0,
+{sensor_columns},
+  PRIMARY KEY (`bucket_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci
+    """
+
+    def __init__(self, width: int):
+        """
+        :param width: the width of a bucket in seconds, one of
+            ROLLUP_LEVELS
+        :type width: int
+        """
+        self.width = width
+        table_name = f"data_rollup_{width}"
+        self.sql_create_table = self.sql_create_table_template.format(
+            table_name=table_name,
+            sensor_columns=",\n".join(
+                f"  `{c}_min` float DEFAULT NULL,\n  `{c}_max` float DEFAULT NULL,\n  `{c}_sum` double DEFAULT NULL"
+                for c in SENSOR_COLUMNS)
+        )
+        super().__init__(table_name, DataRollup)
+
+    def summarize(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Aggregate raw readings (as dicts) into rollup rows, one per
+        bucket.
+        """
+        buckets: Dict[datetime, Dict[str, Any]] = {}
+        for r in rows:
+            if r.get('data_time') is None:
+                continue
+            t = bucket_start(r['data_time'], self.width)
+            b = buckets.get(t)
+            if b is None:
+                b = {'bucket_time': t, 'samples': 0}
+                for c in SENSOR_COLUMNS:
+                    b[c + '_min'] = None
+                    b[c + '_max'] = None
+                    b[c + '_sum'] = None
+                buckets[t] = b
+            b['samples'] += 1
+            for c in SENSOR_COLUMNS:
+                v = r.get(c)
+                if v is None:
+                    continue
+                b[c + '_min'] = v if b[c + '_min'] is None else min(b[c + '_min'], v)
+                b[c + '_max'] = v if b[c + '_max'] is None else max(b[c + '_max'], v)
+                b[c + '_sum'] = v if b[c + '_sum'] is None else b[c + '_sum'] + v
+        return list(buckets.values())
+
+    def merge_values(self, old, new) -> Dict[str, Any]:
+        """
+        Return the SET clause of an upsert merging the existing rollup
+        row (old columns) with the inserted one (new columns), same as
+        merge_rows().
+        """
+        least = func.min if self.db_engine.dialect.name == 'sqlite' else func.least
+        greatest = func.max if self.db_engine.dialect.name == 'sqlite' else func.greatest
+        values = {'samples': old.samples + new.samples}
+        for c in SENSOR_COLUMNS:
+            o_min, n_min = old[c + '_min'], new[c + '_min']
+            o_max, n_max = old[c + '_max'], new[c + '_max']
+            o_sum, n_sum = old[c + '_sum'], new[c + '_sum']
+            values[c + '_min'] = func.coalesce(least(o_min, n_min), o_min, n_min)
+            values[c + '_max'] = func.coalesce(greatest(o_max, n_max), o_max, n_max)
+            values[c + '_sum'] = func.coalesce(o_sum + n_sum, o_sum, n_sum)
+        return values
+
+    @operation
+    def rollup_rows(self, rows: List[Dict[str, Any]], connector=None) -> None:
+        """
+        Add raw readings to the rollup table (upsert per bucket).
+        """
+        dat = self.summarize(rows)
+        if len(dat) == 0:
+            return
+        table = self.table
+        dialect = self.db_engine.dialect.name
+        if connector is None:
+            connector = connectivity(self.db_engine)
+        with connector() as conn:
+            if dialect == 'mysql':
+                from sqlalchemy.dialects.mysql import insert
+                sql = insert(table).values(dat)
+                conn.execute(sql.on_duplicate_key_update(**self.merge_values(table.c, sql.inserted)))
+            elif dialect == 'sqlite':
+                from sqlalchemy.dialects.sqlite import insert
+                sql = insert(table).values(dat)
+                conn.execute(sql.on_conflict_do_update(index_elements=['bucket_time'],
+                                                       set_=self.merge_values(table.c, sql.excluded)))
+            else:
+                for d in dat:
+                    cond = table.c.bucket_time == d['bucket_time']
+                    rec = conn.execute(table.select().where(cond)).fetchone()
+                    if rec is None:
+                        conn.execute(table.insert().values(d))
+                    else:
+                        conn.execute(table.update().where(cond).values(merge_rows(rec._mapping, d)))
+
+    @operation
+    def backfill(self, start: datetime, end: datetime, connector=None) -> int:
+        """
+        Rebuild the rollup rows of [start, end) from the raw readings.
+        The range is widened to whole buckets.
+
+        :return: the number of rollup rows written
+        """
+        start = bucket_start(start, self.width)
+        if bucket_start(end, self.width) != end:
+            end = bucket_start(end, self.width) + timedelta(seconds=self.width)
+        data_man = DataManager()
+        raw = data_man.table
+        table = self.table
+        bucket = data_man.time_bucket(raw.c.data_time, self.width)
+        fields = [self.epoch_to_datetime(bucket).label('bucket_time'), func.count().label('samples')]
+        for c in SENSOR_COLUMNS:
+            fields += [func.min(raw.c[c]).label(c + '_min'),
+                       func.max(raw.c[c]).label(c + '_max'),
+                       func.sum(raw.c[c]).label(c + '_sum')]
+        sel = select(*fields) \
+            .where(raw.c.data_time >= start) \
+            .where(raw.c.data_time < end) \
+            .group_by(bucket)
+        if connector is None:
+            connector = connectivity(self.db_engine)
+        with connector() as conn:
+            conn.execute(table.delete()
+                         .where(table.c.bucket_time >= start)
+                         .where(table.c.bucket_time < end))
+            res = conn.execute(table.insert().from_select([f.name for f in fields], sel))
+        return res.rowcount
+
+    def covered_from(self, connector=None) -> Optional[datetime]:
+        """
+        Return the time from which this rollup holds all the readings,
+        or None if it is empty.
+
+        Without a backfill the rollup only holds the readings inserted
+        since it was created: its first bucket then holds fewer samples
+        than the raw table and coverage starts after it. Once backfilled,
+        or when the raw readings of the first bucket were compacted away
+        (see model.DataRetention), it starts with the first bucket.
+        """
+        table = self.table
+        data_man = DataManager()
+        raw = data_man.table
+        connector = self.read_connector(connector)
+        with connector() as conn:
+            first = conn.execute(select(table.c.bucket_time, table.c.samples)
+                                 .order_by(table.c.bucket_time).limit(1)).fetchone()
+            if first is None:
+                return None
+            (start, samples) = first
+            end = start + timedelta(seconds=self.width)
+            n = conn.execute(select(func.count()).select_from(raw)
+                             .where(raw.c.data_time >= start)
+                             .where(raw.c.data_time < end)).scalar()
+        return end if n > samples else start
+
+    @operation
+    def aggregate(self,
+                  start: datetime,
+                  end: datetime,
+                  bucket_seconds: int,
+                  connector=None) -> List[DataBucket]:
+        """
+        Same as DataManager.aggregate(), computed from this rollup.
+        start, end and bucket_seconds should be multiples of width.
+        """
+        table = self.table
+        bucket = self.time_bucket(table.c.bucket_time, bucket_seconds).label('bucket')
+        fields = [bucket, func.sum(table.c.samples).label('count')]
+        for c in SENSOR_COLUMNS:
+            fields += [func.min(table.c[c + '_min']).label(c + '_min'),
+                       func.max(table.c[c + '_max']).label(c + '_max'),
+                       (func.sum(table.c[c + '_sum']) / func.sum(table.c.samples)).label(c + '_avg')]
+        sql = select(*fields) \
+            .where(table.c.bucket_time >= start) \
+            .where(table.c.bucket_time < end) \
+            .group_by(bucket) \
+            .order_by(bucket)
+        connector = self.read_connector(connector)
+        with connector() as conn:
+            rows = conn.execute(sql).fetchall()
+        result = []
+        for r in rows:
+            m = r._mapping
+            dat = {c: Stat(min=m[c + '_min'], max=m[c + '_max'], avg=m[c + '_avg']) for c in SENSOR_COLUMNS}
+            result.append(DataBucket(bucket_time=EPOCH + timedelta(seconds=int(m['bucket'])),
+                                     count=m['count'],
+                                     **dat))
+        return result
+
+
+def rollup_level(start: datetime, end: datetime, bucket_seconds: int) -> Optional[int]:
+    """
+    Return the coarsest rollup width that can answer an aggregation of
+    [start, end) in bucket_seconds buckets exactly, or None.
+    """
+    for width in sorted(ROLLUP_LEVELS, reverse=True):
+        if (bucket_seconds % width == 0
+                and epoch_seconds(start) % width == 0
+                and epoch_seconds(end) % width == 0):
+            return width
+    return None
+
+
+def backfill(start: Optional[datetime] = None, end: Optional[datetime] = None, days_per_batch: int = 7):
+    """
+    Rebuild all rollup levels from the raw readings, a few days per
+    transaction.
+    """
+    data_man = DataManager()
+    if start is None or end is None:
+        table = data_man.table
+        with connectivity(data_man.db_engine)() as conn:
+            (first, last) = conn.execute(select(func.min(table.c.data_time),
+                                                func.max(table.c.data_time))).fetchone()
+        if first is None:
+            print('No readings to roll up.')
+            return
+        start = start if start is not None else first
+        end = end if end is not None else last + timedelta(seconds=1)
+    start = bucket_start(start, 86400)
+    for width in ROLLUP_LEVELS:
+        man = DataRollupManager(width)
+        t = start
+        while t < end:
+            t_end = min(t + timedelta(days=days_per_batch), end)
+            n = man.backfill(t, t_end)
+            print(man.table_name, t, '-', t_end, ':', n, 'rows')
+            t = t_end
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Maintain the rollup tables of the data table.')
+    parser.add_argument('command', choices=['backfill'])
+    parser.add_argument('--start', type=datetime.fromisoformat, default=None)
+    parser.add_argument('--end', type=datetime.fromisoformat, default=None)
+    args = parser.parse_args()
+    if args.command == 'backfill':
+        backfill(args.start, args.end)
@@ -47,5 +47,9 @@ CREATE TABLE `doc_template` (
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
     """
 
+    indexes = {
+        'template_name': ['template_name'],
+    }
+
     def __init__(self):
         super().__init__('doc_template', DocTemplate)
@@ -7,6 +7,7 @@ router = APIRouter()
 
 
 class TemplateResource(BaseResource):
+    cacheable = True
 
     def __init__(self):
         super().__init__(DocTemplateManager)
@@ -20,8 +21,10 @@ async def template_list(search_query: Optional[str] = None,
                         page: int = 0,
                         page_size: int = 100,
                         order_by: Optional[str] = None,
-                        format: Optional[str] = None):
-    return res_man.get(search_query, page, page_size, order_by, format)
+                        format: Optional[str] = None,
+                        after: Optional[str] = None,
+                        count_mode: Optional[str] = None):
+    return await res_man.get_async(search_query, page, page_size, order_by, format, after=after, count_mode=count_mode)
 
 
 @router.post("/")
@@ -30,7 +33,7 @@ async def template_add(template_in: DocTemplateIn):
         template_in.page_width = 0
     if template_in.page_height is None:
         template_in.page_height = 0
-    return res_man.post(template_in)
+    return await res_man.post_async(template_in)
 
 
 @router.put("/{template_id}")
@@ -39,14 +42,14 @@ async def template_update(template_id: str, template_in: DocTemplateIn):
         template_in.page_width = 0
     if template_in.page_height is None:
         template_in.page_height = 0
-    return res_man.put_with_id(template_id, template_in)
+    return await res_man.put_with_id_async(template_id, template_in)
 
 
 @router.get("/{template_id}")
 async def template_get(template_id: str):
-    return res_man.get_with_id(template_id)
+    return await res_man.get_with_id_async(template_id)
 
 
 @router.delete("/{template_id}")
 async def template_delete(template_id: str):
-    return res_man.delete_with_id(template_id)
+    return await res_man.delete_with_id_async(template_id)
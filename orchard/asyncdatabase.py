@@ -0,0 +1,245 @@
+"""
+Async counterpart of DbManager for the FastAPI routes.
+
+AsyncDbManager wraps a DbManager and exposes the same search, insert,
+update and count methods as coroutines. The statements are still built
+by the wrapped manager; they are executed on an async engine
+(aiomysql/aiosqlite) through AsyncConnection.run_sync(), so waiting for
+the database never blocks the event loop. When no async driver is
+installed, the calls run in a worker thread instead. Read-only calls
+go to the read replicas like their sync counterparts (see
+orchard.database.replica_router), except for the row cache lookups of
+get_with_key(), which must not load a lagging replica's rows.
+
+Usage::
+
+    man = AsyncDbManager(ExpPresetManager())
+    presets = await man.search("1")
+"""
+
+import asyncio
+import contextlib
+import functools
+import logging
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+
+from orchard import settings
+from orchard.database import DB_REPLICA_URIS, DB_URI, DbManager, PoolBusyError, db_engine, pool_options, \
+    replica_router, run_after_commit, sqlite_begin, sqlite_pragmas
+from orchard.metrics import instrument_engine, query_metrics
+
+DB_ASYNC_URI = settings.config.DB_ASYNC_URI
+DB_ASYNC_POOL_SIZE = settings.config.DB_ASYNC_POOL_SIZE
+DB_ASYNC_POOL_MAX_OVERFLOW = settings.config.DB_ASYNC_POOL_MAX_OVERFLOW
+
+#: the async driver of each backend
+ASYNC_DRIVERS = {
+    'mysql': 'aiomysql',
+    'sqlite': 'aiosqlite',
+}
+
+#: the pool timeout used for DB_POOL_ADMISSION='fail_fast' (seconds)
+ASYNC_FAIL_FAST_TIMEOUT = 0.01
+
+R = TypeVar("R")
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+def async_uri(uri: str) -> str:
+    """
+    Return the URI of the async driver of the same database, e.g.
+    mysql+aiomysql://... for mysql://...
+    """
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver is None:
+        raise ValueError(f"no async driver for '{backend}'")
+    return str(url.set(drivername=f"{backend}+{driver}"))
+
+
+def async_pool_options(pool_size: int = DB_ASYNC_POOL_SIZE,
+                       max_overflow: int = DB_ASYNC_POOL_MAX_OVERFLOW) -> Dict[str, Any]:
+    """
+    Return the create_async_engine() arguments of the pool. The async
+    pool waits with asyncio.wait_for(), which gives up at once with a
+    zero timeout even when a connection is idle, so 'fail_fast' waits
+    ASYNC_FAIL_FAST_TIMEOUT instead.
+    """
+    options = pool_options(pool_size, max_overflow)
+    options['pool_timeout'] = max(options['pool_timeout'], ASYNC_FAIL_FAST_TIMEOUT)
+    return options
+
+
+@functools.lru_cache(maxsize=None)
+def create_async_db_engine(uri: Optional[str] = None):
+    """
+    Create (once per URI) the async engine, with the same SQLite pragmas
+    as orchard.database.create_db_engine().
+
+    Its pool is separate from the sync engine's and sized by
+    DB_ASYNC_POOL_SIZE and DB_ASYNC_POOL_MAX_OVERFLOW (the other DB_POOL_*
+    settings are shared), so the connections of a process to a database
+    are bounded by the sum of both pools; keep it below the server's
+    max_connections. A PoolBusyError is raised when either pool is
+    exhausted, and pool_status() of each engine (see /api/metrics)
+    reports its own use.
+
+    :return: the AsyncEngine, or None if SQLAlchemy's asyncio extension
+        or the async driver is not installed
+    """
+    if uri is None:
+        uri = DB_ASYNC_URI or async_uri(DB_URI)
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        if make_url(uri).get_backend_name() == 'sqlite':
+            engine = create_async_engine(uri)
+            event.listen(engine.sync_engine, 'connect', sqlite_pragmas)
+            event.listen(engine.sync_engine, 'begin', sqlite_begin)
+        else:
+            engine = create_async_engine(uri, **async_pool_options())
+    except ImportError as e:
+        logger.warning(f"[orchard.asyncdatabase] No async driver ({e}), queries will run in threads")
+        return None
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+def _connector(conn):
+    # a connectivity() style connector bound to an open connection
+    @contextlib.contextmanager
+    def connect():
+        yield conn
+
+    return connect
+
+
+class AsyncDbManager:
+    """
+    Awaitable methods of a DbManager, executed on the async engine.
+    """
+
+    def __init__(self, manager: DbManager, engine=None) -> None:
+        """
+        :param manager: the manager of the table
+        :type manager: DbManager
+
+        :param engine: an AsyncEngine, defaults to the engine of
+            DB_ASYNC_URI (or of DB_URI's async driver)
+        """
+        self.manager = manager
+        if engine is None:
+            engine = create_async_db_engine()
+        self.async_engine = engine
+
+    def read_engine(self):
+        """
+        Return the async engine of the next usable read replica, or the
+        primary's. Does not block: replica_router.pick() only reads the
+        lags measured by its background thread.
+        """
+        if self.async_engine is None or self.manager.db_engine is not db_engine:
+            return self.async_engine
+        i = replica_router.pick()
+        if i is None:
+            return self.async_engine
+        return create_async_db_engine(async_uri(DB_REPLICA_URIS[i])) or self.async_engine
+
+    async def run(self, fn: Callable[..., R], *args, **kwargs) -> R:
+        """
+        Await fn(*args, connector=..., **kwargs) in one transaction on
+        the primary.
+
+        fn is any function taking a connectivity() connector, such as
+        the DbManager methods or BaseResource.get().
+        """
+        return await self._run(self.async_engine, fn, args, kwargs)
+
+    async def run_read(self, fn: Callable[..., R], *args, **kwargs) -> R:
+        """
+        Same as run() for a read-only fn, on a read replica if one is
+        usable.
+        """
+        return await self._run(self.read_engine(), fn, args, kwargs)
+
+    async def _run(self, engine, fn: Callable[..., R], args, kwargs) -> R:
+        if engine is None:
+            return await asyncio.to_thread(functools.partial(fn, *args, **kwargs))
+
+        def call(conn):
+            return fn(*args, connector=_connector(conn), **kwargs)
+
+        start = time.perf_counter()
+        try:
+            conn = await engine.connect()
+        except PoolTimeoutError as e:
+            query_metrics.observe_pool_timeout((time.perf_counter() - start) * 1000)
+            raise PoolBusyError(str(e)) from e
+        query_metrics.observe_checkout((time.perf_counter() - start) * 1000)
+        try:
+            async with conn.begin():
+                return await conn.run_sync(call)
+        finally:
+            run_after_commit(conn.sync_connection)
+            await conn.close()
+
+    async def count(self, criteria: Optional[str] = None, bound_params: Optional[dict] = None) -> int:
+        return await self.run_read(self.manager.count, criteria=criteria, bound_params=bound_params)
+
+    async def estimate_count(self, criteria: Optional[str] = None, bound_params: Optional[dict] = None) -> int:
+        return await self.run_read(self.manager.estimate_count, criteria=criteria, bound_params=bound_params)
+
+    async def get_with_key(self, key: Optional[str] = None, uid: Optional[str] = None, primary: bool = False,
+                           **kwargs):
+        """
+        Same as DbManager.get_with_key(). Lookups through the row cache
+        (cacheable=True) and primary ones, e.g. reading back a row just
+        written, are executed on the primary.
+        """
+        run = self.run if primary or kwargs.get('cacheable') else self.run_read
+        return await run(self.manager.get_with_key, key=key, uid=uid, **kwargs)
+
+    async def get_with_cond(self, cond, condIsText=True):
+        return await self.run_read(self.manager.get_with_cond, cond, condIsText=condIsText)
+
+    async def search(self, criteria: str, page: int = 0, page_size: Optional[int] = None, **kwargs) -> List[Any]:
+        return await self.run_read(self.manager.search, criteria, page=page, page_size=page_size, **kwargs)
+
+    async def search_with_cond(self, cond, order_by=None, condIsText=True, **kwargs) -> List[Any]:
+        return await self.run_read(self.manager.search_with_cond, cond, order_by=order_by, condIsText=condIsText,
+                              **kwargs)
+
+    async def search_with_count(self, criteria: str, page: int = 0, page_size: Optional[int] = None,
+                                **kwargs) -> Tuple[int, List[Any]]:
+        return await self.run_read(self.manager.search_with_count, criteria, page=page, page_size=page_size, **kwargs)
+
+    async def search_keyset(self, criteria: str, page_size: int, **kwargs) -> Tuple[List[Any], Optional[str]]:
+        return await self.run_read(self.manager.search_keyset, criteria, page_size, **kwargs)
+
+    async def select_distinct(self, select_field, reverse: Optional[bool] = False) -> List[Any]:
+        return await self.run_read(self.manager.select_distinct, select_field, reverse=reverse)
+
+    async def insert(self, objs):
+        return await self.run(self.manager.insert, objs)
+
+    async def insert_bulk(self, objs, chunk_size: Optional[int] = None, return_keys: bool = True) -> List[Any]:
+        return await self.run(self.manager.insert_bulk, objs, chunk_size=chunk_size, return_keys=return_keys)
+
+    async def insert_with_get(self, obj):
+        return await self.run(self.manager.insert_with_get, obj)
+
+    async def update(self, obj, key: Optional[str] = None, **kwargs) -> int:
+        return await self.run(self.manager.update, obj, key=key, **kwargs)
+
+    async def update_with_get(self, obj, key, criteria: Optional[str] = None):
+        return await self.run(self.manager.update_with_get, obj, key, criteria=criteria)
+
+    async def delete(self, key: Optional[str] = None, **kwargs) -> int:
+        return await self.run(self.manager.delete, key=key, **kwargs)
@@ -0,0 +1,124 @@
+"""
+Bounded LRU cache with time-to-live, shared by DbManager instances.
+
+Entries are keyed by (table name, key). Any object with the same
+get/set/delete/invalidate_table/clear/stats methods can be plugged
+into DbManager instead.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from orchard import settings
+
+DB_CACHE_SIZE = settings.config.DB_CACHE_SIZE
+DB_CACHE_TTL = settings.config.DB_CACHE_TTL
+
+#: returned by get() when the key is not cached
+MISS = object()
+
+
+class LRUCache:
+    """
+    A thread-safe, bounded LRU cache whose entries expire after ttl
+    seconds.
+    """
+
+    def __init__(self, maxsize: int = DB_CACHE_SIZE, ttl: Optional[float] = DB_CACHE_TTL) -> None:
+        """
+        :param maxsize: the maximum number of entries
+        :type maxsize: int
+
+        :param ttl: the lifetime of an entry in seconds, None for no
+            expiry
+        :type ttl: Optional[float]
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data: "OrderedDict[Tuple[str, Hashable], Tuple[float, Any]]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, table_name: str, key: Hashable) -> Any:
+        """
+        Return the cached value, or MISS.
+        """
+        k = (table_name, key)
+        with self.lock:
+            item = self.data.get(k)
+            if item is None:
+                self.misses += 1
+                return MISS
+            (expire, value) = item
+            if self.ttl is not None and expire < time.monotonic():
+                del self.data[k]
+                self.expirations += 1
+                self.misses += 1
+                return MISS
+            self.data.move_to_end(k)
+            self.hits += 1
+            return value
+
+    def generation(self, table_name: str) -> int:
+        """
+        Return a counter that changes whenever entries of the table are
+        invalidated. Pass it to set() to avoid caching a row that was
+        read before a concurrent write.
+        """
+        return self.generations.get(table_name, 0)
+
+    def set(self, table_name: str, key: Hashable, value: Any, generation: Optional[int] = None) -> None:
+        k = (table_name, key)
+        expire = time.monotonic() + self.ttl if self.ttl is not None else 0.0
+        with self.lock:
+            if generation is not None and generation != self.generations.get(table_name, 0):
+                return
+            self.data[k] = (expire, value)
+            self.data.move_to_end(k)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, table_name: str, key: Hashable) -> None:
+        with self.lock:
+            self.data.pop((table_name, key), None)
+            self.generations[table_name] = self.generations.get(table_name, 0) + 1
+
+    def invalidate_table(self, table_name: str) -> None:
+        """
+        Remove all entries of a table.
+        """
+        with self.lock:
+            for k in [k for k in self.data.keys() if k[0] == table_name]:
+                del self.data[k]
+            self.generations[table_name] = self.generations.get(table_name, 0) + 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.data.clear()
+            for k in self.generations.keys():
+                self.generations[k] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups > 0 else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+#: the process-wide cache used by DbManager.get_with_key(cacheable=True)
+row_cache = LRUCache()
@@ -4,29 +4,139 @@ History:
     add and_criteria to support criteria generator for search
 """
 
+import base64
+import datetime
+import decimal
+import functools
+import json
 import logging
-from typing import Any, Dict, List, Optional, Type, TypeVar, Union
+import re
+import threading
+import time
+from collections import namedtuple
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type, TypeVar, Union
 
 from pydantic import BaseModel
-from sqlalchemy import MetaData, Table, create_engine, text, func, inspect
-from sqlalchemy.engine import Engine
-from sqlalchemy.exc import NoSuchTableError
+from sqlalchemy import Column, Index, Integer, MetaData, Table, and_, bindparam, cast, create_engine, event, false, \
+    literal_column, or_, text, func, inspect
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import DBAPIError, NoSuchTableError, SQLAlchemyError, TimeoutError as PoolTimeoutError
 from sqlalchemy.sql import Insert
 from sqlalchemy.sql.expression import TextClause, UnaryExpression, select
 import contextlib
 
 from orchard import settings
+from orchard.cache import MISS, LRUCache, row_cache
+from orchard.metrics import instrument_engine, operation, query_metrics
+from orchard.replica import ReplicaRouter
 
 DB_URI = settings.config.DB_URI
+DB_SCHEMA_VERSION = settings.config.DB_SCHEMA_VERSION
+DB_SCHEMA_VERIFY = settings.config.DB_SCHEMA_VERIFY
+DB_AUTO_INDEX = settings.config.DB_AUTO_INDEX
+DB_STATEMENT_CACHE_SIZE = settings.config.DB_STATEMENT_CACHE_SIZE
+DB_POOL_SIZE = settings.config.DB_POOL_SIZE
+DB_POOL_MAX_OVERFLOW = settings.config.DB_POOL_MAX_OVERFLOW
+DB_POOL_ADMISSION = settings.config.DB_POOL_ADMISSION
+DB_POOL_TIMEOUT = settings.config.DB_POOL_TIMEOUT
+DB_POOL_RECYCLE = settings.config.DB_POOL_RECYCLE
+DB_POOL_PRE_PING = settings.config.DB_POOL_PRE_PING
+DB_REPLICA_URIS = [u.strip() for u in settings.config.DB_REPLICA_URIS.split(',') if u.strip() != '']
+DB_REPLICA_MAX_LAG = settings.config.DB_REPLICA_MAX_LAG
+DB_REPLICA_CHECK_INTERVAL = settings.config.DB_REPLICA_CHECK_INTERVAL
+DB_SQLITE_JOURNAL_MODE = settings.config.DB_SQLITE_JOURNAL_MODE
+DB_SQLITE_SYNCHRONOUS = settings.config.DB_SQLITE_SYNCHRONOUS
+DB_SQLITE_BUSY_TIMEOUT = settings.config.DB_SQLITE_BUSY_TIMEOUT
+DB_SQLITE_CACHE_SIZE = settings.config.DB_SQLITE_CACHE_SIZE
+
+
+#: the admission policies of the connection pool
+POOL_ADMISSIONS = ('queue', 'fail_fast')
+
+
+class PoolBusyError(Exception):
+    """
+    Raised when no pooled connection could be checked out in time (see
+    DB_POOL_ADMISSION). Unlike SQLAlchemy's TimeoutError it is not an
+    SQLAlchemyError, so that it reaches the API's 503 handler.
+    """
+
+
+def pool_options(pool_size: int = DB_POOL_SIZE, max_overflow: int = DB_POOL_MAX_OVERFLOW) -> Dict[str, Any]:
+    """
+    Return the create_engine() arguments of the DB_POOL_* settings.
+    """
+    if DB_POOL_ADMISSION not in POOL_ADMISSIONS:
+        raise ValueError(f"Invalid DB_POOL_ADMISSION {DB_POOL_ADMISSION}")
+    return {
+        "pool_size": pool_size,
+        "max_overflow": max_overflow,
+        # QueuePool raises at once with a zero timeout
+        "pool_timeout": 0 if DB_POOL_ADMISSION == 'fail_fast' else DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # Run on every new SQLite connection. The journal mode is stored in
+    # the database file, the other pragmas are per connection.
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={DB_SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={DB_SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={int(DB_SQLITE_BUSY_TIMEOUT)}")
+    cursor.execute(f"PRAGMA cache_size={int(DB_SQLITE_CACHE_SIZE)}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+    # let SQLAlchemy emit BEGIN so that a connectivity() transaction
+    # covers reads as well as writes (pysqlite only begins before DML)
+    dbapi_connection.isolation_level = None
+
+
+def sqlite_begin(conn) -> None:
+    conn.exec_driver_sql("BEGIN")
+
+
+def create_db_engine(uri: str = DB_URI, **kwargs) -> Engine:
+    """
+    Create the engine of a database URI.
 
-db_engine: Engine = create_engine(
-    DB_URI,
-    pool_size=20,
-    max_overflow=0,
-    pool_recycle=3600,
-    #echo=True,
-    #echo_pool="debug",
-)
+    MySQL/MariaDB engines get the DB_POOL_* connection pool. SQLite
+    engines (file databases) get a small pool shared across threads, WAL
+    journaling and the DB_SQLITE_* pragmas; since SQLite has a single
+    writer, writes should be batched into few transactions (see
+    orchard.writebuffer).
+    """
+    url = make_url(uri)
+    if url.get_backend_name() != 'sqlite':
+        engine = create_engine(
+            uri,
+            **pool_options(),
+            #echo=True,
+            #echo_pool="debug",
+            **kwargs
+        )
+        instrument_engine(engine)
+        return engine
+    if url.database not in (None, '', ':memory:'):
+        kwargs.setdefault('poolclass', QueuePool)
+        for (k, v) in pool_options(pool_size=5, max_overflow=5).items():
+            kwargs.setdefault(k, v)
+    engine = create_engine(uri, connect_args={'check_same_thread': False}, **kwargs)
+    event.listen(engine, 'connect', sqlite_pragmas)
+    event.listen(engine, 'begin', sqlite_begin)
+    instrument_engine(engine)
+    return engine
+
+
+db_engine: Engine = create_db_engine(DB_URI)
+
+#: the read replicas used by the DbManager reads on db_engine
+replica_router = ReplicaRouter([create_db_engine(uri) for uri in DB_REPLICA_URIS],
+                               max_lag=DB_REPLICA_MAX_LAG,
+                               check_interval=DB_REPLICA_CHECK_INTERVAL)
 
 meta = MetaData()
 
@@ -48,16 +158,234 @@ def connectivity(engine):
         nonlocal connection
 
         if connection is None:
-            connection = engine.connect()
+            start = time.perf_counter()
+            try:
+                connection = engine.connect()
+            except PoolTimeoutError as e:
+                query_metrics.observe_pool_timeout((time.perf_counter() - start) * 1000)
+                raise PoolBusyError(str(e)) from e
+            query_metrics.observe_checkout((time.perf_counter() - start) * 1000)
             with connection:
-                with connection.begin():
-                    yield connection
+                try:
+                    with connection.begin():
+                        yield connection
+                finally:
+                    run_after_commit(connection)
         else:
             yield connection
 
     return connect
 
 
+#: Connection.info key of the callbacks of after_commit()
+AFTER_COMMIT = 'orchard_after_commit'
+
+
+def after_commit(conn, fn: Callable[[], None]) -> None:
+    """
+    Call fn once the transaction of conn is over, i.e. at the exit of
+    the outermost connectivity() or AsyncDbManager.run(), or now if conn
+    is not in a transaction. Used to invalidate cached rows only once
+    the new ones can be read.
+    """
+    if conn.in_transaction():
+        conn.info.setdefault(AFTER_COMMIT, []).append(fn)
+    else:
+        fn()
+
+
+def run_after_commit(conn) -> None:
+    # run (and forget) the callbacks registered by after_commit(), also
+    # after a rollback: dropping a cached row is always safe
+    for fn in conn.info.pop(AFTER_COMMIT, []):
+        fn()
+
+
+# Process-wide registry of reflected tables, shared by all manager
+# instances and threads. Keyed by (engine url, metadata, table name).
+_table_registry: Dict[Tuple[str, int, str], Table] = {}
+_table_registry_lock = threading.RLock()
+_indexed_tables = set()
+
+
+def _registry_key(engine: Engine, meta: MetaData, table_name: str) -> Tuple[str, int, str]:
+    return str(engine.url), id(meta), table_name
+
+
+def lookup_table(engine: Engine, meta: MetaData, table_name: str) -> Optional[Table]:
+    """
+    Return the registered Table object, or None if the table has not
+    been reflected in this process yet.
+    """
+    return _table_registry.get(_registry_key(engine, meta, table_name))
+
+
+def register_table(engine: Engine, meta: MetaData, table: Table) -> Table:
+    """
+    Register a Table object so that later managers can reuse it
+    without reflecting.
+    """
+    with _table_registry_lock:
+        _table_registry[_registry_key(engine, meta, table.name)] = table
+    return table
+
+
+#: statements of DbManager queries, keyed by table and query shape (see
+#: DbManager.cached_statement())
+statement_cache = LRUCache(maxsize=DB_STATEMENT_CACHE_SIZE, ttl=None)
+
+
+def clear_table_registry(table_name: Optional[str] = None) -> None:
+    """
+    Forget registered tables (all, or the ones with the given name),
+    e.g. after altering a table. The next manager will reflect again.
+    """
+    with _table_registry_lock:
+        for k in list(_table_registry.keys()):
+            if table_name is None or k[2] == table_name:
+                table = _table_registry.pop(k)
+                if table.metadata is not None and table.key in table.metadata.tables:
+                    table.metadata.remove(table)
+    if table_name is None:
+        statement_cache.clear()
+    else:
+        statement_cache.invalidate_table(table_name)
+
+
+#: query shapes seen by DbManager, used by the index advisor in
+#: orchard.utils.db_structure: {(table name, filter columns, order-by
+#: columns): count}
+query_patterns: Dict[Tuple[str, Tuple[str, ...], Tuple[str, ...]], int] = {}
+
+
+@functools.lru_cache(maxsize=1024)
+def query_shape(columns: Tuple[str, ...],
+                criteria: Optional[str],
+                order_by: Optional[str]) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """
+    Return the columns referenced by a criteria string and an order-by
+    string (bound parameter names are ignored).
+    """
+    filters = []
+    if criteria is not None:
+        for name in re.findall(r'(?<![:\w])`?([A-Za-z_]\w*)`?', criteria):
+            if name in columns and name not in filters:
+                filters.append(name)
+    orders = []
+    if order_by is not None:
+        for term in order_by.split(','):
+            parts = term.split()
+            if len(parts) > 0 and parts[0].strip('`') in columns:
+                orders.append(parts[0].strip('`'))
+    return tuple(filters), tuple(orders)
+
+
+#: the formats supported by DbManager.rows_to_objs()
+ROW_FORMATS = ('model', 'construct', 'dict', 'tuple')
+
+_record_classes: Dict[Tuple[str, Tuple[str, ...]], Any] = {}
+
+
+def _model_fields(cls) -> Dict[str, Any]:
+    # pydantic 2 / pydantic 1
+    return getattr(cls, 'model_fields', None) or cls.__fields__
+
+
+def _model_construct(cls):
+    # pydantic 2 / pydantic 1
+    return getattr(cls, 'model_construct', None) or cls.construct
+
+
+def _month_start(d: datetime.date) -> datetime.date:
+    return datetime.date(d.year, d.month, 1)
+
+
+def _add_months(d: datetime.date, n: int) -> datetime.date:
+    m = d.year * 12 + d.month - 1 + n
+    return datetime.date(m // 12, m % 12 + 1, 1)
+
+
+def _month_range(start: datetime.date, end: datetime.date) -> List[datetime.date]:
+    # the month starts in [start, end]
+    months = []
+    while start <= end:
+        months.append(start)
+        start = _add_months(start, 1)
+    return months
+
+
+def _to_days(d: datetime.date) -> int:
+    # MySQL TO_DAYS()
+    return d.toordinal() + 365
+
+
+def _from_days(n: int) -> datetime.date:
+    return datetime.date.fromordinal(n - 365)
+
+
+_ddl_key = re.compile(r"^(UNIQUE\s+)?(?:KEY|INDEX)\s+`?(\w+)`?\s*\((.*)\)$", re.I)
+_ddl_primary_key = re.compile(r"^PRIMARY\s+KEY\s*\((.*)\)$", re.I)
+_ddl_column = re.compile(r"^`?(\w+)`?\s+(.*)$")
+
+
+def sqlite_create_table(sql: str) -> List[str]:
+    """
+    Translate a MySQL/MariaDB CREATE TABLE statement (as used in
+    sql_create_table) into SQLite statements: the CREATE TABLE followed
+    by one CREATE INDEX per KEY.
+
+    A single AUTO_INCREMENT primary key becomes INTEGER PRIMARY KEY
+    AUTOINCREMENT; unsigned, character sets, collations, comments,
+    ON UPDATE clauses and table options are dropped.
+    """
+    m = re.search(r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?\s*\((.*)\)", sql, re.I | re.S)
+    if m is None:
+        raise ValueError("not a CREATE TABLE statement")
+    table_name = m.group(1)
+    lines = [line.strip().rstrip(',') for line in m.group(2).split('\n') if line.strip() != '']
+    columns = []
+    constraints = []
+    indexes = []
+    primary_key = None
+    for line in lines:
+        k = _ddl_primary_key.match(line)
+        if k is not None:
+            primary_key = [c.strip(' `') for c in k.group(1).split(',')]
+            continue
+        k = _ddl_key.match(line)
+        if k is not None:
+            cols = ', '.join(f'"{c.strip(" `")}"' for c in k.group(3).split(','))
+            unique = 'UNIQUE ' if k.group(1) else ''
+            indexes.append(f'CREATE {unique}INDEX IF NOT EXISTS "{table_name}_{k.group(2)}" '
+                           f'ON "{table_name}" ({cols})')
+            continue
+        c = _ddl_column.match(line)
+        if c is None or re.match(r"^(CONSTRAINT|FOREIGN|CHECK)\b", line, re.I):
+            constraints.append(line)
+            continue
+        definition = c.group(2)
+        definition = re.sub(r"^(enum|set)\s*\(.*?\)", "text", definition, flags=re.I)
+        definition = re.sub(r"\s+unsigned\b|\s+zerofill\b", "", definition, flags=re.I)
+        definition = re.sub(r"\s+(CHARACTER\s+SET|CHARSET|COLLATE)\s+\w+", "", definition, flags=re.I)
+        definition = re.sub(r"\s+COMMENT\s+'(?:[^']|'')*'", "", definition, flags=re.I)
+        definition = re.sub(r"\s+ON\s+UPDATE\s+current_timestamp(\(\))?", "", definition, flags=re.I)
+        definition = re.sub(r"current_timestamp\(\)", "CURRENT_TIMESTAMP", definition, flags=re.I)
+        columns.append([c.group(1), definition])
+    for col in columns:
+        if re.search(r"\bAUTO_INCREMENT\b", col[1], re.I):
+            if primary_key != [col[0]]:
+                raise ValueError(f"AUTO_INCREMENT column '{col[0]}' must be the primary key")
+            col[1] = "INTEGER PRIMARY KEY AUTOINCREMENT"
+            primary_key = None
+    body = [f'"{name}" {definition}' for (name, definition) in columns]
+    if primary_key is not None:
+        pkey = ', '.join(f'"{c}"' for c in primary_key)
+        body.append(f"PRIMARY KEY ({pkey})")
+    body += constraints
+    create = f'CREATE TABLE IF NOT EXISTS "{table_name}" (\n  ' + ',\n  '.join(body) + '\n)'
+    return [create] + indexes
+
+
 class DbManager:
     """
     A manager class for a table, similar to a data access object
@@ -78,12 +406,31 @@ class DbManager:
     #: a string of CREATE TABLE SQL statement used to create the table.
     sql_create_table = ""
 
+    #: the default number of rows per statement used by insert_bulk()
+    insert_chunk_size = 1000
+
+    #: the default row_format of searches (see rows_to_objs())
+    row_format = 'model'
+
+    #: the DATETIME column of monthly RANGE partitions (MySQL/MariaDB),
+    #: see partition_table()
+    partition_column: Optional[str] = None
+
+    #: the number of future monthly partitions kept by ensure_partitions()
+    partition_months_ahead = 3
+
+    #: secondary indexes of the table, {index name: [column, ...]};
+    #: missing ones are created on first use (see ensure_indexes())
+    indexes: Dict[str, List[str]] = {}
+
     def __init__(self,
                  table_name: str,
                  data_model_class: Type[T],
                  engine: Engine = db_engine,
                  meta=meta,
-                 auto_create_table: bool = True
+                 auto_create_table: bool = True,
+                 schema_version: Optional[str] = DB_SCHEMA_VERSION,
+                 cache=None
                  ) -> None:
         """
         Initialize a manager class by opening a new connection and
@@ -99,13 +446,25 @@ class DbManager:
             the result rows into
         :type data_model_class: Type[T], where T is a subtype of
             BaseModel type
+
+        :param schema_version: build the table from the schema dump of
+            this version (see orchard.utils.db_structure) instead of
+            reflecting it; '' or None to reflect
+        :type schema_version: Optional[str]
+
+        :param cache: the cache used by get_with_key(cacheable=True),
+            defaults to the process-wide orchard.cache.row_cache
+        :type cache: Optional[LRUCache]
         """
         self.db_engine: Engine = engine
         self.meta = meta
+        self.schema_version = schema_version
         self.table_name = table_name
         self.data_model_class = data_model_class
         self.reflect_table()
-        self.cache = {}
+        if DB_AUTO_INDEX and len(self.indexes) > 0:
+            self.ensure_indexes()
+        self.cache = cache if cache is not None else row_cache
         logger.info("DbManager.init %s" % (table_name))
 
     def reflect_table(self) -> None:
@@ -113,6 +472,11 @@ class DbManager:
         Load information about the table that this class manages using
         reflection and store it in the table attribute.
 
+        Reflected tables are kept in a process-wide registry, so the
+        database is only queried by the first manager of each table.
+        When schema_version is set, the table is built from the schema
+        dump instead (see load_table()).
+
         Also, if the table does not exist, invoke the table_create()
         method to create it.
         """
@@ -120,13 +484,124 @@ class DbManager:
             # Check to see if we've already reflected the table
             self.table
         except AttributeError:
-            try:
-                self.table: Table = Table(
-                    self.table_name, self.meta, autoload_with=self.db_engine
-                )
-            except NoSuchTableError:
+            table = lookup_table(self.db_engine, self.meta, self.table_name)
+            if table is None:
+                with _table_registry_lock:
+                    table = lookup_table(self.db_engine, self.meta, self.table_name)
+                    if table is None and self.schema_version:
+                        table = self.load_table()
+                    if table is None:
+                        try:
+                            table = register_table(self.db_engine, self.meta, Table(
+                                self.table_name, self.meta, autoload_with=self.db_engine
+                            ))
+                            logger.info("Reflecting table '%s'" % table)
+                        except NoSuchTableError:
+                            pass
+            if table is None:
                 self.table_create()
-                logger.info("Reflecting table '%s'" % self.table)
+            else:
+                self.table: Table = table
+
+    def load_table(self, verify: bool = DB_SCHEMA_VERIFY) -> Optional[Table]:
+        """
+        Build and register the table from the offline schema dump of
+        schema_version, without reflecting it.
+
+        If verify is set, the checksum of the dumped columns and
+        indexes is compared with the live table; on mismatch None is
+        returned so that the table is reflected instead. If the
+        database cannot be reached, the dump is trusted.
+
+        :return: the Table object, or None if there is no usable dump
+        :rtype: Optional[Table]
+        """
+        from orchard.utils import db_structure
+        try:
+            table_info = db_structure.load_table_info(self.table_name, self.schema_version)
+        except (OSError, ValueError) as e:
+            logger.warning("No schema dump for '%s' (%s): %s", self.table_name, self.schema_version, e)
+            return None
+        if verify:
+            expected = db_structure.table_checksum(table_info.fields, table_info.indexes)
+            try:
+                with connectivity(self.db_engine)() as conn:
+                    actual = db_structure.live_table_checksum(conn, self.table_name)
+            except (SQLAlchemyError, DBAPIError) as e:
+                logger.warning("Cannot verify schema dump for '%s': %s", self.table_name, e)
+            else:
+                if actual != expected:
+                    logger.warning("Schema dump for '%s' does not match the database", self.table_name)
+                    return None
+        table = db_structure.table_from_info(table_info, self.meta, self.db_engine.dialect)
+        logger.info("Loading table '%s' from schema %s", self.table_name, self.schema_version)
+        return register_table(self.db_engine, self.meta, table)
+
+    def ensure_indexes(self, create: bool = True) -> List[str]:
+        """
+        Verify that the indexes declared in the indexes attribute exist
+        (by their columns) and create the missing ones. This is done
+        once per table and process.
+
+        :param create: create the missing indexes
+        :type create: bool
+
+        :return: the names of the declared indexes that were missing
+        :rtype: List[str]
+        """
+        k = _registry_key(self.db_engine, self.meta, self.table_name)
+        if k in _indexed_tables:
+            return []
+        missing = []
+        try:
+            existing = [[c for c in i['column_names']] for i in inspect(self.db_engine).get_indexes(self.table_name)]
+            for (name, columns) in self.indexes.items():
+                if list(columns) in existing:
+                    continue
+                missing.append(name)
+                if create:
+                    logger.info("Creating index '%s' on %s (%s)", name, self.table_name, ", ".join(columns))
+                    with self.db_engine.begin() as conn:
+                        Index(name, *[self.table.c[c] for c in columns]).create(conn)
+        except (SQLAlchemyError, DBAPIError) as e:
+            logger.warning("Cannot verify indexes of '%s': %s", self.table_name, e)
+            return missing
+        if create or len(missing) == 0:
+            _indexed_tables.add(k)
+        return missing
+
+    def read_engine(self) -> Engine:
+        """
+        Return the engine of a read-only query: a read replica (see
+        replica_router) for managers on db_engine, else db_engine.
+        """
+        if self.db_engine is not db_engine:
+            return self.db_engine
+        return replica_router.engine(self.db_engine)
+
+    def read_connector(self, connector=None):
+        """
+        Return the connector of a read-only query. A given connector
+        (e.g. of a connectivity() transaction) is kept, so that reads
+        inside a transaction stay on the primary; otherwise a new
+        connector on read_engine() is returned.
+        """
+        if connector is not None:
+            return connector
+        return connectivity(self.read_engine())
+
+    def create_table_sql(self) -> List[str]:
+        """
+        Return the statements creating the table in the engine's
+        dialect. sql_create_table is written for MySQL/MariaDB and is
+        translated for SQLite (see sqlite_create_table()); override this
+        method for DDL that cannot be translated.
+        """
+        if self.sql_create_table == '':
+            return []
+        if self.db_engine.dialect.name == 'sqlite':
+            return sqlite_create_table(self.sql_create_table)
+        return [self.sql_create_table]
 
     def table_create(self) -> None:
         """
@@ -136,12 +611,13 @@ class DbManager:
         method.
         """
         logger.info("Creating table '%s'" % self.table_name)
-        sql = self.sql_create_table
-        if sql=='':
+        sqls = self.create_table_sql()
+        if len(sqls) == 0:
             logger.info('-- NO CREATE TABLE SQL specified')
             return
         with self.db_engine.begin() as conn:
-            conn.execute(text(sql))
+            for sql in sqls:
+                conn.execute(text(sql))
         self.reflect_table()
 
     def row_to_obj(self, row: Any) -> T:
@@ -162,6 +638,81 @@ class DbManager:
             return self.data_model_class()
         return self.data_model_class(** row._asdict())
 
+    def record_class(self, fields: Tuple[str, ...]):
+        """
+        Return the (cached) namedtuple class used for row_format='tuple'.
+        """
+        k = (self.table_name, fields)
+        cls = _record_classes.get(k)
+        if cls is None:
+            cls = namedtuple(self.table_name.title().replace('_', '') + 'Record', fields, rename=True)
+            _record_classes[k] = cls
+        return cls
+
+    def rows_to_objs(self,
+                     rows: List[Any],
+                     row_format: Optional[str] = None,
+                     columns: Optional[List[str]] = None) -> List[Any]:
+        """
+        Convert rows retrieved from the database.
+
+        Rows read from our own tables are trusted, so the validation of
+        row_to_obj() can be skipped with one of the faster formats:
+
+        - 'model': validated instances of the data model class (default)
+        - 'construct': instances of the data model class built without
+          validation (only the fields of the model are set)
+        - 'dict': plain dicts
+        - 'tuple': namedtuple records (compact, attribute access)
+
+        :param rows: the rows retrieved from the database
+        :param row_format: one of ROW_FORMATS, defaults to the
+            row_format attribute
+        :param columns: the columns to keep, defaults to all
+        :return: the converted rows
+        """
+        if row_format is None:
+            row_format = self.row_format
+        if row_format not in ROW_FORMATS:
+            raise ValueError(f"unsupported row format '{row_format}'")
+        if len(rows) == 0:
+            return []
+        fields = rows[0]._fields
+        if row_format == 'model':
+            if columns is None:
+                return [self.row_to_obj(r) for r in rows]
+            return [self.data_model_class(**{k: r._mapping[k] for k in columns}) for r in rows]
+        if columns is None:
+            columns = list(fields)
+        if row_format == 'construct':
+            model_fields = _model_fields(self.data_model_class)
+            columns = [c for c in columns if c in model_fields]
+        positions = [fields.index(c) for c in columns]
+        if row_format == 'tuple':
+            cls = self.record_class(tuple(columns))
+            if positions == list(range(len(fields))):
+                return [cls._make(r) for r in rows]
+            return [cls._make([r[i] for i in positions]) for r in rows]
+        pairs = list(zip(columns, positions))
+        if row_format == 'dict':
+            return [{k: r[i] for (k, i) in pairs} for r in rows]
+        construct = _model_construct(self.data_model_class)
+        return [construct(**{k: r[i] for (k, i) in pairs}) for r in rows]
+
+    def row_to_record(self, row: Any, row_format: Optional[str] = None) -> Any:
+        """
+        Convert a single row, see rows_to_objs().
+        """
+        return self.rows_to_objs([row], row_format)[0]
+
+    def record_query(self, criteria: Optional[str], order_by: Optional[str] = None) -> None:
+        """
+        Count the shape of a query in query_patterns.
+        """
+        k = (self.table_name,) + query_shape(tuple(self.table.c.keys()), criteria, order_by)
+        query_patterns[k] = query_patterns.get(k, 0) + 1
+
+    @operation
     def count(self, criteria: Optional[str] = None,
               bound_params: Optional[Dict[str, Any]] = None,
               connector=None) -> int:
@@ -175,13 +726,16 @@ class DbManager:
         :rtype: int
         """
         table = self.table
-        if criteria is None:
-            sql = select([func.count("*")]).select_from(table)
-        else:
-            sql = select([func.count("*")]).select_from(table).where(text(criteria))
+        self.record_query(criteria)
+
+        def build():
+            if criteria is None:
+                return select([func.count("*")]).select_from(table)
+            return select([func.count("*")]).select_from(table).where(text(criteria))
+
+        sql = self.cached_statement(('count', criteria), build)
         # print(sql)
-        if connector is None:
-            connector = connectivity(self.db_engine)
+        connector = self.read_connector(connector)
         with connector() as conn:
             if bound_params is None:
                 res = conn.execute(sql)
@@ -191,23 +745,28 @@ class DbManager:
                     + f" [bound params] {bound_params}"
                 )
                 res = conn.execute(sql, bound_params)
-
-        res = res.fetchone()
+            res = res.fetchone()
         return res["count_1"]
 
     # Get Object
+    @operation
     def get_with_key(
             self, key: Optional[str] = None,
             uid: Optional[str] = None,
             connector=None,
-            cacheable=False
+            cacheable=False,
+            row_format: Optional[str] = None
     ) -> Optional[T]:
         """
         Return a new instance of a data mongo_doc class initialized from
         the row with either the given primary key or UID.
 
         :param connector: use custom connector (default: None)
-        :param cacheable: use cache (default: false)
+        :param cacheable: use the shared row cache, only for lookups
+            by key and validated models; update() and delete()
+            invalidate it once their transaction is over. Cache misses are read from the primary, a
+            lagging replica could load an outdated row (default: false)
+        :param row_format: see rows_to_objs() (default: row_format)
         :param key: the primary key of the row to be retrieved
         :type key: Optional[str]
 
@@ -220,32 +779,40 @@ class DbManager:
                  a None if the row with the given key is not found
         :rtype: Optional[T], where T is a subtype of BaseModel type
         """
+        if row_format is None:
+            row_format = self.row_format
+        cacheable = cacheable and key is not None and row_format == 'model'
         if cacheable:
-            if key in self.cache.keys():
-                logger.info('get_with_key.cache HIT %s', key)
-                return self.cache[key]
-            else:
-                logger.info('get_with_key.cache MISS %s', key)
+            generation = self.cache.generation(self.table_name)
+            obj = self.cache.get(self.table_name, str(key))
+            if obj is not MISS:
+                logger.debug('get_with_key.cache HIT %s', key)
+                return obj
+            logger.debug('get_with_key.cache MISS %s', key)
         table = self.table
+        params = {}
         if key is not None:
             pkey = table.primary_key.columns.values()[0]
-            sql = table.select().where(pkey == key)
+            sql = self.cached_statement(('key',), lambda: table.select().where(
+                pkey == bindparam('pkey_', type_=pkey.type)))
+            params['pkey_'] = key
         elif uid is not None and "sql" not in locals():
             uid_column = self.table_name + "_uid"
             sql = table.select().where(text(f"{uid_column} = '{uid}'"))
-        if connector is None:
+        if cacheable and connector is None:
             connector = connectivity(self.db_engine)
+        connector = self.read_connector(connector)
         with connector() as conn:
-            res = conn.execute(sql)
-        rec = res.fetchone()
+            rec = conn.execute(sql, params).fetchone()
         if rec == None:
             return None
-        obj: T = self.row_to_obj(rec)
+        obj: T = self.row_to_record(rec, row_format)
         if cacheable:
-            logger.info('get_with_key.cache LOAD %s', key)
-            self.cache[key] = obj
+            logger.debug('get_with_key.cache LOAD %s', key)
+            self.cache.set(self.table_name, str(key), obj, generation=generation)
         return obj
 
+    @operation
     def get_with_cond(self,
                       cond,
                       condIsText=True,
@@ -257,21 +824,21 @@ class DbManager:
         else:
             m_cond = cond
         sql = table.select().where(m_cond)
-        if connector is None:
-            connector = connectivity(self.db_engine)
+        connector = self.read_connector(connector)
         with connector() as conn:
-            res = conn.execute(sql)
-        rec = res.fetchone()
+            rec = conn.execute(sql).fetchone()
         if rec == None:
             return None
         obj: T = self.row_to_obj(rec)
         return obj
 
+    @operation
     def search_with_cond(self,
                          cond,
                          order_by=None,
                          condIsText=True,
-                         connector=None
+                         connector=None,
+                         row_format: Optional[str] = None
                          ) -> Optional[List[T]]:
         table = self.table
         if condIsText:
@@ -285,14 +852,70 @@ class DbManager:
             else:
                 m_order = order_by
             sql = sql.order_by(m_order)
-        if connector is None:
-            connector = connectivity(self.db_engine)
+        connector = self.read_connector(connector)
         with connector() as conn:
-            res = conn.execute(sql)
-        arr: List[T] = [self.row_to_obj(r) for r in res.fetchall()]
+            rows = conn.execute(sql).fetchall()
+        arr: List[T] = self.rows_to_objs(rows, row_format)
         return arr
 
+    def cached_statement(self, shape: Tuple, build: Callable[[], Any]):
+        """
+        Return the statement of a query shape from statement_cache,
+        building it with build() on a miss. Everything that varies
+        between calls with the same shape must be a bound parameter.
+
+        Reusing the statement object saves building it and computing
+        its cache key, which SQLAlchemy uses to look up the compiled
+        form.
+        """
+        key = (id(self.table),) + shape
+        sql = statement_cache.get(self.table_name, key)
+        if sql is MISS:
+            sql = build()
+            statement_cache.set(self.table_name, key, sql)
+        return sql
+
+    def build_search_sql(self,
+                         criteria: str,
+                         page: int = 0,
+                         page_size: Optional[int] = None,
+                         order_by: Optional[str] = None,
+                         with_total: bool = False) -> Tuple[Any, Dict[str, Any]]:
+        """
+        Return the SELECT statement used by search() and the values of
+        its paging parameters (page_limit_, page_offset_), to be
+        executed along with the criteria's bound parameters.
+
+        :param with_total: also select COUNT(*) OVER () as total_count_
+            (see search_with_count())
+        """
+        table = self.table
+        self.record_query(criteria, order_by)
+
+        def build():
+            # Build the order-by clauses
+            if order_by is None:
+                pkey = table.primary_key.columns.values()[0]
+                order_by_clauses: Union[UnaryExpression, TextClause] = pkey.asc()
+            else:
+                order_by_clauses = text(order_by)
+            # Build the main SQL "search" statement
+            sql = table.select()
+            if with_total:
+                sql = sql.add_columns(func.count().over().label('total_count_'))
+            sql = sql.where(text(criteria)).order_by(order_by_clauses)
+            if page_size is not None:
+                sql = sql.limit(bindparam('page_limit_', type_=Integer)) \
+                    .offset(bindparam('page_offset_', type_=Integer))
+            return sql
+
+        sql = self.cached_statement(('search', criteria, order_by, page_size is not None, with_total), build)
+        if page_size is None:
+            return sql, {}
+        return sql, {'page_limit_': page_size, 'page_offset_': page * page_size}
+
     # Search
+    @operation
     def search(
             self,
             criteria: str,
@@ -300,7 +923,8 @@ class DbManager:
             page_size: Optional[int] = None,
             order_by: Optional[str] = None,
             bound_params: Optional[Dict[str, Any]] = None,
-            connector=None
+            connector=None,
+            row_format: Optional[str] = None
     ) -> List[T]:
         """
         Select/Search the table and return a list containing the
@@ -321,40 +945,356 @@ class DbManager:
             results, defaults to None
         :type order_by: str, optional
 
+        :param row_format: how rows are converted, see rows_to_objs(),
+            defaults to the row_format attribute
+        :type row_format: str, optional
+
         :return: a list containing the results of the search query as
                  instances of a data mongo_doc class, T
         :rtype: List[T], where T is a subtype of BaseModel type
         """
-        table = self.table
-        # Build the order-by clauses
-        if order_by is None:
-            pkey = table.primary_key.columns.values()[0]
-            order_by_clauses: Union[UnaryExpression, TextClause] = pkey.asc()
-        else:
-            order_by_clauses = text(order_by)
-        # Build the main SQL "search" statement
-        sql = table.select().where(text(criteria)).order_by(order_by_clauses)
-        if page_size is not None:
-            sql = sql.limit(page_size).offset(page * page_size)
+        (sql, params) = self.build_search_sql(criteria, page, page_size, order_by)
         # Execute the SQL statement
-        logger.info(f"[api.core.database.DbManager.search] [SQL] {sql}")
-        if connector is None:
-            connector = connectivity(self.db_engine)
+        logger.info("[api.core.database.DbManager.search] [SQL] %s", sql)
+        connector = self.read_connector(connector)
         with connector() as conn:
-            if bound_params is None:
-                res = conn.execute(sql)
-            else:
+            if bound_params is not None:
                 logger.info(
                     "[api.core.database.DbManager.search]"
                     + f" [bound params] {bound_params}"
                 )
-                res = conn.execute(sql, bound_params)
-
-        # Use list comprehension to aggregate results into a list
-        arr: List[T] = [self.row_to_obj(r) for r in res.fetchall()]
+                params = {**bound_params, **params}
+            rows = conn.execute(sql, params).fetchall()
+        arr: List[T] = self.rows_to_objs(rows, row_format)
         return arr
 
+    # Streaming
+    def stream_sql(self,
+                   sql,
+                   bound_params: Optional[Dict[str, Any]] = None,
+                   batch_size: int = 1000,
+                   row_format: Optional[str] = None,
+                   batches: bool = False,
+                   connector=None) -> Iterator[Any]:
+        """
+        Execute a SELECT on a server-side cursor and yield converted
+        rows (or lists of rows if batches is True), fetching batch_size
+        rows at a time.
+
+        The connection is only held while iterating; it is released
+        when the generator is exhausted or closed.
+        """
+        connector = self.read_connector(connector)
+        with connector() as conn:
+            res = conn.execution_options(stream_results=True, max_row_buffer=batch_size).execute(
+                sql, bound_params if bound_params is not None else {})
+            try:
+                for part in res.partitions(batch_size):
+                    arr = self.rows_to_objs(part, row_format)
+                    if batches:
+                        yield arr
+                    else:
+                        yield from arr
+            finally:
+                res.close()
+
+    def iter_search(self,
+                    criteria: str,
+                    order_by: Optional[str] = None,
+                    bound_params: Optional[Dict[str, Any]] = None,
+                    batch_size: int = 1000,
+                    row_format: Optional[str] = None,
+                    batches: bool = False,
+                    connector=None) -> Iterator[Any]:
+        """
+        Like search() without paging, but yields the results from a
+        server-side cursor instead of building the whole list, so
+        memory stays flat for any number of rows.
+
+        Usage::
+
+            for rec in man.iter_search('1', order_by='data_time', row_format='tuple'):
+                ...
+
+        :param batch_size: the number of rows fetched at a time
+        :type batch_size: int
+
+        :param batches: yield lists of up to batch_size results instead
+            of single results
+        :type batches: bool
+        """
+        (sql, _) = self.build_search_sql(criteria, order_by=order_by)
+        logger.info("[api.core.database.DbManager.iter_search] [SQL] %s", sql)
+        return self.stream_sql(sql, bound_params, batch_size, row_format, batches, connector)
+
+    def iter_search_with_cond(self,
+                              cond,
+                              order_by=None,
+                              condIsText=True,
+                              batch_size: int = 1000,
+                              row_format: Optional[str] = None,
+                              batches: bool = False,
+                              connector=None) -> Iterator[Any]:
+        """
+        Streaming counterpart of search_with_cond(), see iter_search().
+        """
+        sql = self.table.select().where(text(cond) if condIsText else cond)
+        if order_by is not None:
+            sql = sql.order_by(text(order_by) if condIsText else order_by)
+        return self.stream_sql(sql, None, batch_size, row_format, batches, connector)
+
+    @operation
+    def search_with_count(
+            self,
+            criteria: str,
+            page: int = 0,
+            page_size: Optional[int] = None,
+            order_by: Optional[str] = None,
+            bound_params: Optional[Dict[str, Any]] = None,
+            connector=None,
+            row_format: Optional[str] = None
+    ) -> Tuple[int, List[T]]:
+        """
+        Return the total number of matching rows together with a page
+        of results, in a single query using COUNT(*) OVER ().
+
+        Window functions require MySQL 8 or MariaDB 10.2. If the page
+        is empty (e.g. past the end), the total is obtained with
+        count() on the same connection.
+
+        :return: the total number of rows matching the criteria and the
+                 results of the requested page
+        :rtype: Tuple[int, List[T]]
+        """
+        (sql, params) = self.build_search_sql(criteria, page, page_size, order_by, with_total=True)
+        logger.info("[api.core.database.DbManager.search_with_count] [SQL] %s", sql)
+        connector = self.read_connector(connector)
+        with connector() as conn:
+            if bound_params is not None:
+                params = {**bound_params, **params}
+            rows = conn.execute(sql, params).fetchall()
+            if len(rows) == 0:
+                return self.count(criteria, bound_params, connector=connector), []
+        total = rows[0]._mapping['total_count_']
+        names = [c.name for c in self.table.columns]
+        arr: List[T] = self.rows_to_objs(rows, row_format, columns=names)
+        return total, arr
+
+    @operation
+    def estimate_count(self,
+                       criteria: Optional[str] = None,
+                       bound_params: Optional[Dict[str, Any]] = None,
+                       connector=None) -> int:
+        """
+        Return an approximate number of rows.
+
+        Without criteria on MySQL/MariaDB, the row estimate kept in
+        information_schema is used (no table scan); otherwise this
+        falls back to count().
+        """
+        if (criteria is None or criteria.strip() == '1') and self.db_engine.dialect.name == 'mysql':
+            sql = text("SELECT TABLE_ROWS FROM information_schema.TABLES"
+                       " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name")
+            connector = self.read_connector(connector)
+            with connector() as conn:
+                rec = conn.execute(sql, {"table_name": self.table_name}).fetchone()
+            if rec is not None and rec[0] is not None:
+                return int(rec[0])
+        return self.count(criteria, bound_params, connector=connector)
+
+    # Keyset (seek) pagination
+    def keyset_order(self, order_by: Optional[str] = None) -> List[Tuple[Column, bool]]:
+        """
+        Parse an order-by string ("col [ASC|DESC], ...") into a list
+        of (column, descending) pairs usable for keyset pagination.
+        The primary key is appended as a tie-breaker if missing.
+
+        :raise ValueError: if the expression is not a plain list of
+            columns of this table
+        """
+        table = self.table
+        keys: List[Tuple[Column, bool]] = []
+        if order_by is not None and order_by.strip() != '':
+            for term in order_by.split(','):
+                parts = term.split()
+                if len(parts) == 0 or len(parts) > 2:
+                    raise ValueError(f"unsupported order by '{order_by}'")
+                name = parts[0].strip('`')
+                direction = parts[1].upper() if len(parts) == 2 else 'ASC'
+                if name not in table.c or direction not in ('ASC', 'DESC'):
+                    raise ValueError(f"unsupported order by '{order_by}'")
+                keys.append((table.c[name], direction == 'DESC'))
+        names = [c.name for (c, _) in keys]
+        for pkey in table.primary_key.columns.values():
+            if pkey.name not in names:
+                keys.append((pkey, keys[-1][1] if len(keys) > 0 else False))
+        return keys
+
+    @staticmethod
+    def _order_signature(keys: List[Tuple[Column, bool]]) -> str:
+        return ','.join(c.name + (' DESC' if desc else '') for (c, desc) in keys)
+
+    def encode_cursor(self, keys: List[Tuple[Column, bool]], row: Any) -> str:
+        """
+        Build an opaque "after" token from the order-by values of a
+        result row.
+        """
+        mapping = row._mapping
+        values = []
+        for (c, _) in keys:
+            v = mapping[c.name]
+            if isinstance(v, (datetime.date, datetime.time)):
+                v = v.isoformat()
+            elif isinstance(v, decimal.Decimal):
+                v = str(v)
+            values.append(v)
+        dat = json.dumps({'o': self._order_signature(keys), 'v': values})
+        return base64.urlsafe_b64encode(dat.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, keys: List[Tuple[Column, bool]], token: str) -> List[Any]:
+        """
+        Return the order-by values stored in an "after" token.
+
+        :raise ValueError: if the token is malformed or was built for
+            another ordering
+        """
+        try:
+            dat = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+            signature, values = dat['o'], dat['v']
+        except (ValueError, TypeError, KeyError) as e:
+            raise ValueError(f"invalid cursor: {e}")
+        if signature != self._order_signature(keys) or len(values) != len(keys):
+            raise ValueError("cursor does not match the order by")
+        result = []
+        for ((c, _), v) in zip(keys, values):
+            try:
+                py_type = c.type.python_type
+            except NotImplementedError:
+                py_type = None
+            if v is not None and py_type in (datetime.datetime, datetime.date, datetime.time):
+                v = py_type.fromisoformat(v)
+            elif v is not None and py_type is decimal.Decimal:
+                v = decimal.Decimal(v)
+            result.append(v)
+        return result
+
+    @staticmethod
+    def keyset_cond(keys: List[Tuple[Column, bool]], values: List[Any]):
+        """
+        Return the condition selecting the rows after the given
+        order-by values: (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ...
+        (with < for descending keys).
+
+        NULLs sort before any value (as on MySQL/MariaDB and SQLite, see
+        keyset_order_by()), so on nullable columns a None value selects
+        the non-NULL rows going up and no row going down, and a value
+        going down also selects the NULL rows. The values are bind
+        parameters or None, the statement differs for each NULL pattern.
+        """
+        def eq(c, v):
+            return c.is_(None) if v is None else c == v
+
+        def after(c, desc, v):
+            if v is None:
+                return false() if desc else c.isnot(None)
+            if desc and c.nullable:
+                return or_(c < v, c.is_(None))
+            return c < v if desc else c > v
+
+        conds = []
+        for i, (c, desc) in enumerate(keys):
+            eqs = [eq(k, v) for ((k, _), v) in zip(keys[:i], values[:i])]
+            conds.append(and_(*eqs, after(c, desc, values[i])))
+        return or_(*conds)
+
+    def keyset_order_by(self, keys: List[Tuple[Column, bool]]) -> list:
+        """
+        Return the ORDER BY clauses of the keys, with NULLs first going
+        up and last going down on the dialects which do not already sort
+        them so (the order keyset_cond() expects).
+        """
+        native = self.db_engine.dialect.name in ('mysql', 'sqlite')
+        clauses = []
+        for (c, desc) in keys:
+            clause = c.desc() if desc else c.asc()
+            if c.nullable and not native:
+                clause = clause.nulls_last() if desc else clause.nulls_first()
+            clauses.append(clause)
+        return clauses
+
+    @operation
+    def search_keyset(
+            self,
+            criteria: str,
+            page_size: int,
+            order_by: Optional[str] = None,
+            after: Optional[str] = None,
+            bound_params: Optional[Dict[str, Any]] = None,
+            connector=None,
+            row_format: Optional[str] = None
+    ) -> Tuple[List[T], Optional[str]]:
+        """
+        Select/Search the table with keyset (seek) pagination.
+
+        Unlike search(), which uses LIMIT/OFFSET, the next page starts
+        right after the last row of the previous one, so the cost of a
+        page does not grow with its depth.
+
+        :param criteria: the criteria to be used for
+            searching/filtering
+        :type criteria: str
+
+        :param page_size: the number of the results per page
+        :type page_size: int
+
+        :param order_by: comma separated columns with optional
+            ASC/DESC, defaults to the primary key
+        :type order_by: str, optional
+
+        :param after: the token returned with the previous page, or
+            None for the first page
+        :type after: str, optional
+
+        :return: the results and the token of the next page (None on
+                 the last page)
+        :rtype: Tuple[List[T], Optional[str]]
+        """
+        table = self.table
+        keys = self.keyset_order(order_by)
+        self.record_query(criteria, order_by)
+        seek = after is not None and after != ''
+        params = {'page_limit_': page_size}
+        nulls: Tuple[bool, ...] = ()
+        if seek:
+            values = self.decode_cursor(keys, after)
+            nulls = tuple(v is None for v in values)
+            for (i, v) in enumerate(values):
+                if v is not None:
+                    params[f'keyset_{i}_'] = v
+
+        def build():
+            sql = table.select().where(text(criteria))
+            if seek:
+                sql = sql.where(self.keyset_cond(keys, [None if null else bindparam(f'keyset_{i}_', type_=c.type)
+                                                        for (i, ((c, _), null)) in enumerate(zip(keys, nulls))]))
+            return sql.order_by(*self.keyset_order_by(keys)) \
+                .limit(bindparam('page_limit_', type_=Integer))
+
+        sql = self.cached_statement(('keyset', criteria, order_by, seek, nulls), build)
+        logger.info("[api.core.database.DbManager.search_keyset] [SQL] %s", sql)
+        connector = self.read_connector(connector)
+        with connector() as conn:
+            if bound_params is not None:
+                params = {**bound_params, **params}
+            rows = conn.execute(sql, params).fetchall()
+        next_cursor = None
+        if len(rows) == page_size:
+            next_cursor = self.encode_cursor(keys, rows[-1])
+        arr: List[T] = self.rows_to_objs(rows, row_format)
+        return arr, next_cursor
+
     # Insert New Object
+    @operation
     def insert(self,
                objs: Union[T, List[T]],
                connector=None
@@ -362,6 +1302,8 @@ class DbManager:
         """
         Insert a single or multiple rows.
 
+        Multiple rows are delegated to insert_bulk().
+
         :param objs: either an instance of a data mongo_doc class, T, to
             be inserted as a new row, or a list of instances of the
             data mongo_doc class T, to be inserted as multiple new rows
@@ -373,42 +1315,103 @@ class DbManager:
                  inserted
         :rtype: Union[int, List[Any]]
         """
+        if isinstance(objs, (list, tuple)):
+            return self.insert_bulk(objs, connector=connector)
         table = self.table
-        try:
-            dat: Union[Dict[str, Any], List[Dict[str, Any]]] = objs.__dict__
-            sql: Union[Insert, str] = table.insert().values(**dat)
-            logger.info(f"[api.core.database.DbManager.insert] [SINGLE] [SQL] {sql} {sql.compile().params}")
-            if connector is None:
-                connector = connectivity(self.db_engine)
-            with connector() as conn:
-                res = conn.execute(sql)
-            logger.debug('primary key '+str(res.inserted_primary_key))
-            return res.inserted_primary_key[0]
-        except AttributeError:
-            dat = []
-            for i in objs:
-                dat.append(i.__dict__)
-            pkey = table.primary_key.columns.values()[0]
-            # column_names = [c.name for c in table.columns]
-            column_names = [f"`{i}`" for i in dat[0].keys()]
-            values = [list(i.values()) for i in dat]
-            logger.debug(values)
-            sql = f"""INSERT INTO `{self.table_name}` ({", ".join(column_names)})
-VALUES ({", ".join([str(i) for i in values[0]])})"""
-            logger.debug(sql)
-            for v in values[1:]:
-                sql += f""",
-       ({", ".join([str(i) for i in v])})"""
-            sql += f"""
-RETURNING {pkey.name}"""
-            logger.info(f"[api.core.database.DbManager.insert] [MULTI] [SQL] {sql}")
-            if connector is None:
-                connector = connectivity(self.db_engine)
-            with connector() as conn:
-                res = conn.execute(text(sql))
-            return res.fetchall()
+        dat: Dict[str, Any] = objs.__dict__
+        sql: Insert = table.insert().values(**dat)
+        logger.info("[api.core.database.DbManager.insert] [SINGLE] [SQL] %s %s", sql, dat)
+        if connector is None:
+            connector = connectivity(self.db_engine)
+        with connector() as conn:
+            res = conn.execute(sql)
+            self.after_insert([dat], connector=connector)
+        logger.debug('primary key '+str(res.inserted_primary_key))
+        return res.inserted_primary_key[0]
+
+    @operation
+    def insert_bulk(self,
+                    objs: List[T],
+                    chunk_size: Optional[int] = None,
+                    return_keys: bool = True,
+                    connector=None
+                    ) -> List[Any]:
+        """
+        Insert multiple rows in chunks using bound parameters
+        (executemany). All chunks share one transaction.
+
+        Generated keys are taken from the rows when the primary key is
+        given, and from RETURNING when the dialect supports it for
+        executemany. Otherwise each chunk is sent as one multi-row
+        INSERT (still with bound parameters) and the keys are derived
+        from its auto-increment value, since MySQL/MariaDB and SQLite
+        assign consecutive values to the rows of a single statement.
+
+        :param objs: a list of instances of the data mongo_doc class T
+        :type objs: List[T], where T is a subtype of BaseModel type
+
+        :param chunk_size: the number of rows per statement, defaults
+            to insert_chunk_size
+        :type chunk_size: Optional[int]
+
+        :param return_keys: collect the primary keys of the new rows
+        :type return_keys: bool
+
+        :return: a list of the primary keys of the rows that were
+                 inserted (empty if return_keys is False)
+        :rtype: List[Any]
+        """
+        if len(objs) == 0:
+            return []
+        if chunk_size is None:
+            chunk_size = self.insert_chunk_size
+        table = self.table
+        pkey = table.primary_key.columns.values()[0]
+        dat: List[Dict[str, Any]] = [o.__dict__ for o in objs]
+        has_keys = dat[0].get(pkey.name) is not None
+        returning = (return_keys and not has_keys
+                     and self.db_engine.dialect.insert_executemany_returning)
+        multi_values = return_keys and not has_keys and not returning
+        sql: Insert = table.insert()
+        if returning:
+            sql = sql.returning(pkey)
+        logger.info("[api.core.database.DbManager.insert] [MULTI] [SQL] %s rows=%s chunk_size=%s",
+                    sql, len(dat), chunk_size)
+        keys: List[Any] = []
+        if connector is None:
+            connector = connectivity(self.db_engine)
+        with connector() as conn:
+            for i in range(0, len(dat), chunk_size):
+                chunk = dat[i:i + chunk_size]
+                if multi_values:
+                    res = conn.execute(table.insert().values(chunk))
+                    first = res.lastrowid
+                    if self.db_engine.dialect.name == 'sqlite':
+                        # SQLite reports the rowid of the last row
+                        first = first - len(chunk) + 1
+                    keys.extend(range(first, first + len(chunk)))
+                    continue
+                res = conn.execute(sql, chunk)
+                if returning:
+                    keys.extend(r[0] for r in res.fetchall())
+                elif return_keys:
+                    keys.extend(r[pkey.name] for r in chunk)
+            self.after_insert(dat, connector=connector)
+        return keys
+
+    def after_insert(self, rows: List[Dict[str, Any]], connector=None) -> None:
+        """
+        Called after rows have been inserted by insert(), insert_bulk()
+        or a WriteBuffer, within the same transaction (use connector).
+        This method should be overloaded to maintain derived data.
+
+        :param rows: the inserted rows as dicts
+        :param connector: the connector of the insert
+        """
+        pass
 
     # Update Object
+    @operation
     def update(
             self,
             obj: T,
@@ -459,9 +1462,12 @@ RETURNING {pkey.name}"""
             connector = connectivity(self.db_engine)
         with connector() as conn:
             res = conn.execute(sql)
+            # once committed, or a concurrent read could cache the old row
+            after_commit(conn, functools.partial(self.cache_invalidate, key))
         return res.rowcount
 
     # Delete Object
+    @operation
     def delete(
             self,
             key: Optional[str] = None,
@@ -504,30 +1510,238 @@ RETURNING {pkey.name}"""
             connector = connectivity(self.db_engine)
         with connector() as conn:
             res = conn.execute(sql)
+            # once committed, or a concurrent read could cache the old row
+            after_commit(conn, functools.partial(self.cache_invalidate, key))
         return res.rowcount
 
+    @operation
+    def delete_in_batches(self,
+                          cond,
+                          condIsText=True,
+                          batch_size: int = 1000,
+                          pause: float = 0.0,
+                          max_batches: Optional[int] = None) -> int:
+        """
+        Delete the rows matching a condition in batches of batch_size
+        rows (by primary key), each in its own short transaction, so
+        that the table is never locked for long.
+
+        :param cond: the condition of the rows to delete
+        :param batch_size: the number of rows deleted per transaction
+        :param pause: seconds to sleep between batches
+        :param max_batches: stop after this many batches (None for no
+            limit)
+        :return: the number of rows deleted
+        :rtype: int
+        """
+        table = self.table
+        pkey = table.primary_key.columns.values()[0]
+        m_cond = text(cond) if condIsText else cond
+        sql = select(pkey).where(m_cond).order_by(pkey).limit(batch_size)
+        total = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            with connectivity(self.db_engine)() as conn:
+                keys = [r[0] for r in conn.execute(sql).fetchall()]
+                if len(keys) == 0:
+                    break
+                res = conn.execute(table.delete().where(pkey.in_(keys)))
+            total += res.rowcount
+            batches += 1
+            logger.info("[api.core.database.DbManager.delete_in_batches] %s batch %s: %s rows",
+                        self.table_name, batches, res.rowcount)
+            if len(keys) < batch_size:
+                break
+            if pause > 0:
+                time.sleep(pause)
+        if total > 0:
+            self.cache_invalidate()
+        return total
+
+    # Partitioning (MySQL/MariaDB)
+    def list_partitions(self) -> List[Tuple[str, Optional[int]]]:
+        """
+        Return the RANGE partitions of the table as (name, upper bound)
+        pairs, the bound being a TO_DAYS() value or None for MAXVALUE.
+        Empty if the table is not partitioned.
+        """
+        if self.db_engine.dialect.name != 'mysql':
+            return []
+        sql = text("SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS"
+                   " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name"
+                   " AND PARTITION_NAME IS NOT NULL ORDER BY PARTITION_ORDINAL_POSITION")
+        with connectivity(self.db_engine)() as conn:
+            rows = conn.execute(sql, {"table_name": self.table_name}).fetchall()
+        return [(name, None if desc == 'MAXVALUE' else int(desc)) for (name, desc) in rows]
+
+    def partition_sql(self, months: List[datetime.date]) -> str:
+        """
+        Return the partition definitions for the given month starts,
+        followed by the catch-all p_future partition.
+        """
+        defs = [f"PARTITION p{m.strftime('%Y%m')} VALUES LESS THAN "
+                f"(TO_DAYS('{_add_months(m, 1).isoformat()}'))" for m in months]
+        defs.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+        return ",\n  ".join(defs)
+
+    def partition_table_sql(self, first_month: datetime.date, months_ahead: Optional[int] = None) -> List[str]:
+        """
+        Return the statements of partition_table(): one ALTER making
+        partition_column NOT NULL and part of the primary key, then the
+        PARTITION BY RANGE.
+        """
+        if self.partition_column is None:
+            raise ValueError(f"no partition column for '{self.table_name}'")
+        if months_ahead is None:
+            months_ahead = self.partition_months_ahead
+        col = self.partition_column
+        pkeys = [c.name for c in self.table.primary_key.columns.values()]
+        if col not in pkeys:
+            pkeys.append(col)
+        months = _month_range(_month_start(first_month), _add_months(_month_start(datetime.date.today()), months_ahead))
+        return [
+            f"ALTER TABLE `{self.table_name}` MODIFY `{col}` "
+            f"{self.table.c[col].type.compile(dialect=self.db_engine.dialect)} NOT NULL, "
+            f"DROP PRIMARY KEY, ADD PRIMARY KEY ({', '.join(f'`{k}`' for k in pkeys)})",
+            f"ALTER TABLE `{self.table_name}` PARTITION BY RANGE (TO_DAYS(`{col}`)) (\n  "
+            f"{self.partition_sql(months)}\n)",
+        ]
+
+    def partition_table(self, first_month: datetime.date, months_ahead: Optional[int] = None) -> None:
+        """
+        Convert the table to monthly RANGE partitions on
+        partition_column, from first_month to months_ahead months from
+        now.
+
+        MySQL requires the partitioning column in every unique key, so
+        the column is made NOT NULL and added to the primary key. Rows
+        with a NULL partition_column must be fixed or deleted first, a
+        ValueError is raised otherwise.
+
+        The migration is not atomic: DDL commits implicitly, so if the
+        PARTITION BY statement fails, the table is left with the new
+        primary key and NOT NULL column but without partitions (running
+        partition_table() again completes it).
+        """
+        sqls = self.partition_table_sql(first_month, months_ahead)
+        col = self.table.c[self.partition_column]
+        with connectivity(self.db_engine)() as conn:
+            nulls = conn.execute(select(func.count()).select_from(self.table).where(col.is_(None))).scalar()
+        if nulls > 0:
+            raise ValueError(f"{nulls} rows of '{self.table_name}' have a NULL {col.name}, "
+                             f"fix or delete them before partitioning")
+        for sql in sqls:
+            logger.info(sql)
+            with self.db_engine.begin() as conn:
+                conn.execute(text(sql))
+        # the primary key has changed
+        clear_table_registry(self.table_name)
+        del self.table
+        self.reflect_table()
+
+    def ensure_partitions(self, months_ahead: Optional[int] = None) -> List[str]:
+        """
+        Add the monthly partitions up to months_ahead months from now
+        by splitting p_future. Does nothing if the table is not
+        partitioned.
+
+        :return: the names of the partitions created
+        """
+        if months_ahead is None:
+            months_ahead = self.partition_months_ahead
+        bounded = [(n, b) for (n, b) in self.list_partitions() if b is not None]
+        if len(bounded) == 0:
+            return []
+        start = _from_days(bounded[-1][1])
+        months = _month_range(start, _add_months(_month_start(datetime.date.today()), months_ahead))
+        if len(months) == 0:
+            return []
+        sql = (f"ALTER TABLE `{self.table_name}` REORGANIZE PARTITION p_future INTO (\n  "
+               f"{self.partition_sql(months)}\n)")
+        logger.info(sql)
+        with self.db_engine.begin() as conn:
+            conn.execute(text(sql))
+        return [f"p{m.strftime('%Y%m')}" for m in months]
+
+    def drop_partitions_before(self, cutoff: datetime.date) -> List[str]:
+        """
+        Drop the partitions that only hold rows before cutoff. This is
+        a metadata operation, unlike a DELETE.
+
+        :return: the names of the partitions dropped
+        """
+        limit = _to_days(cutoff)
+        names = [n for (n, b) in self.list_partitions() if b is not None and b <= limit]
+        if len(names) == 0:
+            return []
+        sql = f"ALTER TABLE `{self.table_name}` DROP PARTITION {', '.join(names)}"
+        logger.info(sql)
+        with self.db_engine.begin() as conn:
+            conn.execute(text(sql))
+        self.cache_invalidate()
+        return names
+
     def insert_with_get(self, obj, connector=None):
-        key = self.insert(obj)
-        return self.get_with_key(key)
+        # read back on the primary, in the same transaction
+        if connector is None:
+            connector = connectivity(self.db_engine)
+        with connector():
+            key = self.insert(obj, connector=connector)
+            return self.get_with_key(key, connector=connector)
 
     def update_with_get(self,
                         obj,
                         key,
                         criteria: Optional[str] = None,
                         connector=None):
-        rows_update = self.update(obj=obj,
-                                  key=key,
-                                  criteria=criteria,
-                                  connector=connector)
-        if rows_update > 0:
-            # Getting the primary key value from the obj if it is available
-            if self.table.primary_key.columns.values()[0].name in obj.__fields_set__:
-                key = obj.dict()[self.table.primary_key.columns.values()[0].name]
+        # read back on the primary, in the same transaction
+        if connector is None:
+            connector = connectivity(self.db_engine)
+        with connector():
+            rows_update = self.update(obj=obj,
+                                      key=key,
+                                      criteria=criteria,
+                                      connector=connector)
+            if rows_update > 0:
+                # Getting the primary key value from the obj if it is available
+                if self.table.primary_key.columns.values()[0].name in obj.__fields_set__:
+                    key = obj.dict()[self.table.primary_key.columns.values()[0].name]
+
+                return self.get_with_key(key, connector=connector)
+            else:
+                return None
 
-            return self.get_with_key(key, connector=connector)
-        else:
-            return None
+    def epoch_seconds(self, column):
+        """
+        Return an SQL expression converting a DATETIME column into
+        seconds since 1970-01-01 (no time zone conversion).
+        """
+        if self.db_engine.dialect.name == 'sqlite':
+            return cast(func.strftime('%s', column), Integer)
+        return func.timestampdiff(literal_column('SECOND'), literal_column("'1970-01-01 00:00:00'"), column)
+
+    def epoch_to_datetime(self, seconds):
+        """
+        Return an SQL expression converting seconds since 1970-01-01
+        back into a DATETIME (inverse of epoch_seconds()).
+        """
+        if self.db_engine.dialect.name == 'sqlite':
+            # same text format as SQLAlchemy's DateTime on SQLite
+            return func.datetime(seconds, 'unixepoch').op('||')('.000000')
+        return func.timestampadd(literal_column('SECOND'), seconds, literal_column("'1970-01-01 00:00:00'"))
+
+    def time_bucket(self, column, width: int):
+        """
+        Return an SQL expression of the start of the width-second
+        bucket of a DATETIME column, in seconds since 1970-01-01.
+        """
+        width = literal_column(str(int(width)))
+        if self.db_engine.dialect.name == 'sqlite':
+            # integer division already rounds down
+            return (self.epoch_seconds(column) / width) * width
+        return func.floor(self.epoch_seconds(column) / width) * width
 
+    @operation
     def select_distinct(self,
                         select_field,
                         reverse: Optional[bool] = False,
@@ -544,15 +1758,23 @@ RETURNING {pkey.name}"""
         order_by_clauses = text(select_field + (" ASC" if not reverse else " DESC"))
         sql = select([func.distinct(text(select_field))]).select_from(self.table).order_by(order_by_clauses)
         logger.info(sql)
-        if connector is None:
-            connector = connectivity(self.db_engine)
+        connector = self.read_connector(connector)
         with connector() as conn:
-            res = conn.execute(sql)
-        rec = res.fetchall()
+            rec = conn.execute(sql).fetchall()
         result = []
         [result.append(r["distinct_1"]) for r in rec]
         return result
 
 
+    def cache_invalidate(self, key: Optional[Any] = None) -> None:
+        """
+        Drop the cached row with the given primary key, or all cached
+        rows of the table if key is None.
+        """
+        if key is None:
+            self.cache.invalidate_table(self.table_name)
+        else:
+            self.cache.delete(self.table_name, str(key))
+
     def cache_flush(self):
-        self.cache = {}
\ No newline at end of file
+        self.cache_invalidate()
\ No newline at end of file
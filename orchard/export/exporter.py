@@ -84,8 +84,10 @@ def data_exporter(man, field_list, default_filter=None):
     for g in groups:
         sql = sql.group_by(g)
     print('sql', sql)
-    conn = man.db_engine.connect()
-    res = conn.execute(sql)
+    # buffer the rows so that the connection goes back to the pool at once
+    with man.db_engine.connect() as conn:
+        frozen = conn.execute(sql).freeze()
+    res = frozen()
     if len(pivot_index) ==0 and len(pivot_column) == 0 and len(pivot_value) == 0:
         return res
     df = pd.DataFrame(res)
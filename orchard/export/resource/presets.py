@@ -4,6 +4,7 @@ import hashlib
 from fastapi import APIRouter, HTTPException, status
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 
+from orchard.asyncdatabase import AsyncDbManager
 from orchard.export.model.exp_preset import ExpPreset, ExpPresetIn, ExpPresetManager
 
 router = APIRouter()
@@ -17,9 +18,9 @@ async def preset_list() -> List[ExpPreset]:
     :return: a list of ExpPreset
     :rtype: List[ExpPreset]
     """
-    man = ExpPresetManager()
+    man = AsyncDbManager(ExpPresetManager())
     try:
-        m_list: List[ExpPreset] = man.search("1")
+        m_list: List[ExpPreset] = await man.search("1")
     except (SQLAlchemyError, DBAPIError) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -33,7 +34,7 @@ async def preset_add(dat_in: ExpPresetIn) -> dict:
     """
     Update a preset.\f
     """
-    man = ExpPresetManager()
+    man = AsyncDbManager(ExpPresetManager())
     try:
         m_preset_id=hashlib.sha1(('logbook_preset'+str(datetime.now())).encode()).hexdigest()
         # dat = ExpPreset(**dat_in.dict(),
@@ -41,7 +42,7 @@ async def preset_add(dat_in: ExpPresetIn) -> dict:
         #                 update_time=datetime.now(),
         #                 create_time=datetime.now())
         # print(dat)
-        id = man.insert(dat_in)
+        id = await man.insert(dat_in)
     except (SQLAlchemyError, DBAPIError) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -52,15 +53,16 @@ async def preset_add(dat_in: ExpPresetIn) -> dict:
 
 @router.put("/{preset_id}", response_model=ExpPreset)
 async def preset_update(preset_id: str, dat_in: ExpPresetIn):
-    man = ExpPresetManager()
+    man = AsyncDbManager(ExpPresetManager())
     try:
-        org: ExpPreset = man.get_with_key(preset_id)
+        org: ExpPreset = await man.get_with_key(preset_id)
         # dat = ExpPreset(**dat_in.dict(),
         #                 preset_id=org.preset_id,
         #                 update_time=datetime.now(),
         #                 create_time=org.create_time)
-        rows_updated = man.update(dat_in, preset_id)
-        dat: ExpPreset = man.get_with_key(preset_id)
+        rows_updated = await man.update(dat_in, preset_id)
+        # read back from the primary, a replica may not have the update yet
+        dat: ExpPreset = await man.get_with_key(preset_id, primary=True)
     except (SQLAlchemyError, DBAPIError) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -71,9 +73,9 @@ async def preset_update(preset_id: str, dat_in: ExpPresetIn):
 
 @router.get("/{preset_id}", response_model=ExpPreset)
 async def preset_get(preset_id: str):
-    man = ExpPresetManager()
+    man = AsyncDbManager(ExpPresetManager())
     try:
-        dat: ExpPreset = man.get_with_key(preset_id)
+        dat: ExpPreset = await man.get_with_key(preset_id, cacheable=True)
     except (SQLAlchemyError, DBAPIError) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -84,9 +86,9 @@ async def preset_get(preset_id: str):
 
 @router.delete("/{preset_id}", response_model=Dict[str, int])
 async def preset_delete(preset_id: str) -> dict:
-    man = ExpPresetManager()
+    man = AsyncDbManager(ExpPresetManager())
     try:
-        rows_deleted: int = man.delete(preset_id)
+        rows_deleted: int = await man.delete(preset_id)
     except (SQLAlchemyError, DBAPIError) as e:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
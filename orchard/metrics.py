@@ -0,0 +1,299 @@
+"""
+Query instrumentation of the database engines.
+
+instrument_engine() hooks the cursor events of an engine and records,
+per DbManager operation (e.g. 'data.search') and statement type
+(SELECT, INSERT, ...), a latency histogram and the number of rows, and
+the hit ratio of SQLAlchemy's compiled statement cache.
+Statements slower than DB_SLOW_QUERY_MS are logged and kept in a ring
+buffer of the last DB_SLOW_QUERY_LOG_SIZE slow statements. Pool
+checkout waits and timeouts are recorded by
+orchard.database.connectivity() and AsyncDbManager.run(), the pool
+events (checkouts, new and invalidated connections) by the pool hooks;
+pool_status() reports the current use of an engine's pool.
+
+The figures are exposed by query_metrics.snapshot() (see the
+/api/metrics endpoint).
+"""
+
+import contextvars
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from orchard import settings
+
+DB_METRICS = settings.config.DB_METRICS
+DB_SLOW_QUERY_MS = settings.config.DB_SLOW_QUERY_MS
+DB_SLOW_QUERY_LOG_SIZE = settings.config.DB_SLOW_QUERY_LOG_SIZE
+
+#: the upper bounds (in milliseconds) of the histogram buckets
+HISTOGRAM_BOUNDS_MS: Tuple[float, ...] = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+#: the maximum length of a statement kept in the slow query log
+SLOW_QUERY_MAX_LENGTH = 1000
+
+# the DbManager operation being executed by the current thread/task
+_operation: contextvars.ContextVar = contextvars.ContextVar('orchard_db_operation', default=None)
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+class Histogram:
+    """
+    A latency histogram with fixed buckets.
+    """
+
+    def __init__(self, bounds: Tuple[float, ...] = HISTOGRAM_BOUNDS_MS) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float) -> None:
+        i = 0
+        while i < len(self.bounds) and value > self.bounds[i]:
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Return the upper bound of the bucket holding the q quantile
+        (max for the last bucket), or None if empty.
+        """
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n > 0:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        buckets = {f"le_{b:g}": n for (b, n) in zip(self.bounds, self.counts)}
+        buckets["inf"] = self.counts[-1]
+        return {
+            "count": self.count,
+            "sum_ms": round(self.total, 3),
+            "avg_ms": round(self.total / self.count, 3) if self.count > 0 else None,
+            "max_ms": round(self.max, 3),
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "buckets": buckets,
+        }
+
+
+class QueryMetrics:
+    """
+    Thread-safe collector of the statement, operation and pool checkout
+    timings.
+    """
+
+    def __init__(self,
+                 slow_query_ms: float = DB_SLOW_QUERY_MS,
+                 slow_query_log_size: int = DB_SLOW_QUERY_LOG_SIZE) -> None:
+        """
+        :param slow_query_ms: statements at least this slow are logged
+            and kept in the slow query log
+        :type slow_query_ms: float
+
+        :param slow_query_log_size: the number of slow statements kept
+        :type slow_query_log_size: int
+        """
+        self.slow_query_ms = slow_query_ms
+        self.lock = threading.Lock()
+        self.statements: Dict[str, Histogram] = {}
+        self.rows: Dict[str, int] = {}
+        self.errors: Dict[str, int] = {}
+        self.operations: Dict[str, Histogram] = {}
+        self.checkout = Histogram()
+        self.pool: Dict[str, int] = {}
+        self.compiled_cache = {'hits': 0, 'misses': 0}
+        self.slow_queries: Deque[Dict[str, Any]] = deque(maxlen=slow_query_log_size)
+        self.since = datetime.now()
+
+    def observe_statement(self, key: str, ms: float, rowcount: int, statement: str) -> None:
+        with self.lock:
+            hist = self.statements.get(key)
+            if hist is None:
+                hist = self.statements[key] = Histogram()
+            hist.observe(ms)
+            if rowcount is not None and rowcount >= 0:
+                self.rows[key] = self.rows.get(key, 0) + rowcount
+            if ms >= self.slow_query_ms:
+                self.slow_queries.append({
+                    "time": datetime.now().isoformat(),
+                    "key": key,
+                    "duration_ms": round(ms, 3),
+                    "rowcount": rowcount,
+                    "statement": statement[:SLOW_QUERY_MAX_LENGTH],
+                })
+        if ms >= self.slow_query_ms:
+            logger.warning(f"[orchard.metrics] slow query {key} {ms:.1f} ms: {statement[:200]}")
+
+    def observe_error(self, key: str) -> None:
+        with self.lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def observe_operation(self, name: str, ms: float) -> None:
+        with self.lock:
+            hist = self.operations.get(name)
+            if hist is None:
+                hist = self.operations[name] = Histogram()
+            hist.observe(ms)
+
+    def observe_checkout(self, ms: float) -> None:
+        with self.lock:
+            self.checkout.observe(ms)
+
+    def observe_pool_timeout(self, ms: float) -> None:
+        with self.lock:
+            self.pool['timeouts'] = self.pool.get('timeouts', 0) + 1
+        logger.warning(f"[orchard.metrics] no pooled connection after {ms:.1f} ms")
+
+    def observe_compiled_cache(self, hit: bool) -> None:
+        with self.lock:
+            self.compiled_cache['hits' if hit else 'misses'] += 1
+
+    def observe_pool_event(self, name: str) -> None:
+        with self.lock:
+            self.pool[name] = self.pool.get(name, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            lookups = self.compiled_cache['hits'] + self.compiled_cache['misses']
+            statements = {}
+            for (k, hist) in sorted(self.statements.items()):
+                statements[k] = hist.snapshot()
+                statements[k]["rows"] = self.rows.get(k)
+            return {
+                "since": self.since.isoformat(),
+                "slow_query_ms": self.slow_query_ms,
+                "statements": statements,
+                "operations": {k: h.snapshot() for (k, h) in sorted(self.operations.items())},
+                "errors": dict(self.errors),
+                "pool_checkout": self.checkout.snapshot(),
+                "pool_events": dict(self.pool),
+                "compiled_cache": dict(self.compiled_cache,
+                                       hit_ratio=self.compiled_cache['hits'] / lookups if lookups > 0 else 0.0),
+                "slow_queries": list(self.slow_queries),
+            }
+
+    def reset(self) -> None:
+        with self.lock:
+            self.statements.clear()
+            self.rows.clear()
+            self.errors.clear()
+            self.operations.clear()
+            self.checkout = Histogram()
+            self.pool.clear()
+            self.compiled_cache = {'hits': 0, 'misses': 0}
+            self.slow_queries.clear()
+            self.since = datetime.now()
+
+
+#: the process-wide metrics of all instrumented engines
+query_metrics = QueryMetrics()
+
+
+def statement_type(statement: str) -> str:
+    words = statement.lstrip(" (\n\t").split(None, 1)
+    return words[0].upper() if len(words) > 0 else ''
+
+
+def statement_key(statement: str) -> str:
+    return f"{_operation.get() or 'other'}:{statement_type(statement)}"
+
+
+def operation(fn):
+    """
+    Decorate a DbManager method so that its statements are recorded
+    under '<table>.<method>' and its total latency is measured. Nested
+    calls (e.g. insert() calling insert_bulk()) are attributed to the
+    outermost one.
+    """
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        if not DB_METRICS or _operation.get() is not None:
+            return fn(self, *args, **kwargs)
+        name = f"{self.table_name}.{fn.__name__}"
+        token = _operation.set(name)
+        start = time.perf_counter()
+        try:
+            return fn(self, *args, **kwargs)
+        finally:
+            _operation.reset(token)
+            query_metrics.observe_operation(name, (time.perf_counter() - start) * 1000)
+
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('orchard_query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts: List[float] = conn.info.get('orchard_query_start')
+    if not starts:
+        return
+    ms = (time.perf_counter() - starts.pop()) * 1000
+    query_metrics.observe_statement(statement_key(statement), ms, cursor.rowcount, statement)
+    # whether SQLAlchemy found the compiled form in its cache
+    cache_hit = getattr(context, 'cache_hit', None)
+    if cache_hit is not None and cache_hit in (context.dialect.CACHE_HIT, context.dialect.CACHE_MISS):
+        query_metrics.observe_compiled_cache(cache_hit is context.dialect.CACHE_HIT)
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get('orchard_query_start'):
+        conn.info['orchard_query_start'].pop()
+    query_metrics.observe_error(statement_key(exception_context.statement or ''))
+
+
+def _pool_event(name, *args):
+    query_metrics.observe_pool_event(name)
+
+
+def pool_status(engine) -> Dict[str, Any]:
+    """
+    Return the current use of the engine's pool: size, in use (checked
+    out), idle (checked in) and overflow connections, and the timeout.
+    """
+    pool = engine.pool
+    dat: Dict[str, Any] = {"pool": type(pool).__name__}
+    for (k, name) in (("size", "size"), ("in_use", "checkedout"), ("idle", "checkedin"),
+                      ("overflow", "overflow"), ("timeout", "timeout")):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            dat[k] = fn()
+    return dat
+
+
+def instrument_engine(engine) -> None:
+    """
+    Attach the metrics hooks to an Engine (for an AsyncEngine, pass its
+    sync_engine). Does nothing if DB_METRICS is off.
+    """
+    if not DB_METRICS or getattr(engine, '_orchard_metrics', False):
+        return
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+    for name in ('checkout', 'checkin', 'connect', 'invalidate'):
+        event.listen(engine, name, functools.partial(_pool_event, name))
+    engine._orchard_metrics = True
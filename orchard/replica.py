@@ -0,0 +1,178 @@
+"""
+Routing of read-only queries to read replicas.
+
+ReplicaRouter hands out the replica engines round-robin, skipping the
+ones whose replication lag exceeds max_lag seconds or that cannot be
+reached; when none qualifies, reads fall back to the primary. The lags
+are measured every check_interval seconds by a background thread,
+started by the first pick(), so that choosing a replica never waits for
+the database (it is called on the event loop by AsyncDbManager).
+Until the first measurement, and when the measurements stop (e.g. a
+lag check hangs), reads go to the primary.
+"""
+
+import logging
+import threading
+import time
+from typing import Callable, List, Optional
+
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError, SQLAlchemyError
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+def replica_lag(engine: Engine) -> Optional[float]:
+    """
+    Return the replication lag of a replica in seconds, 0 if it does
+    not replicate (or is not MySQL/MariaDB), or None if replication is
+    broken.
+    """
+    if engine.dialect.name != 'mysql':
+        return 0.0
+    with engine.connect() as conn:
+        for sql in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):
+            try:
+                row = conn.exec_driver_sql(sql).mappings().fetchone()
+            except DBAPIError:
+                # older servers only know SHOW SLAVE STATUS
+                continue
+            if row is None:
+                return 0.0
+            lag = row.get('Seconds_Behind_Source', row.get('Seconds_Behind_Master'))
+            return None if lag is None else float(lag)
+    return None
+
+
+class ReplicaRouter:
+    """
+    Round-robin choice of a read replica with lag-aware fallback.
+    """
+
+    def __init__(self,
+                 engines: List[Engine],
+                 max_lag: float = 5.0,
+                 check_interval: float = 10.0,
+                 lag_fn: Callable[[Engine], Optional[float]] = replica_lag,
+                 background: bool = True) -> None:
+        """
+        :param engines: the engines of the replicas
+        :type engines: List[Engine]
+
+        :param max_lag: the maximum replication lag (in seconds) of a
+            replica that is used
+        :type max_lag: float
+
+        :param check_interval: the number of seconds a lag measurement
+            is trusted
+        :type check_interval: float
+
+        :param lag_fn: the function measuring the lag of an engine
+
+        :param background: measure the lags in a background thread,
+            otherwise only refresh() does
+        :type background: bool
+        """
+        self.engines = engines
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lag_fn = lag_fn
+        self.background = background
+        self.lags: List[Optional[float]] = [None] * len(engines)
+        self.checked: List[Optional[float]] = [None] * len(engines)
+        self.next = 0
+        self.lock = threading.Lock()
+        self.reads = [0] * len(engines)
+        self.fallbacks = 0
+        self.thread: Optional[threading.Thread] = None
+        self.stop_event = threading.Event()
+
+    def measure(self, i: int) -> Optional[float]:
+        """
+        Measure the lag of replica i (blocking), None if unusable.
+        """
+        try:
+            lag = self.lag_fn(self.engines[i])
+        except (SQLAlchemyError, DBAPIError) as e:
+            logger.warning("[orchard.replica.ReplicaRouter] replica %s unreachable: %s", i, e)
+            lag = None
+        if lag is None or lag > self.max_lag:
+            logger.warning("[orchard.replica.ReplicaRouter] skipping replica %s (lag %s)", i, lag)
+        return lag
+
+    def refresh(self) -> None:
+        """
+        Measure the lag of every replica (blocking).
+        """
+        for i in range(len(self.engines)):
+            lag = self.measure(i)
+            self.lags[i] = lag
+            self.checked[i] = time.monotonic()
+
+    def start(self) -> None:
+        """
+        Start the background lag checks, once.
+        """
+        if not self.background or len(self.engines) == 0 or self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._refresh_loop, name='replica-lag', daemon=True)
+                self.thread.start()
+
+    def stop(self) -> None:
+        self.stop_event.set()
+
+    def _refresh_loop(self) -> None:
+        while not self.stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error("[orchard.replica.ReplicaRouter] lag check failed: %s", e)
+            self.stop_event.wait(self.check_interval)
+
+    def lag(self, i: int) -> Optional[float]:
+        """
+        Return the last measured lag of replica i, None if unusable, not
+        measured yet or measured too long ago.
+        """
+        checked = self.checked[i]
+        if checked is None or time.monotonic() - checked > 3 * self.check_interval:
+            return None
+        return self.lags[i]
+
+    def pick(self) -> Optional[int]:
+        """
+        Return the index of the next usable replica, or None to read
+        from the primary.
+        """
+        if len(self.engines) == 0:
+            return None
+        self.start()
+        with self.lock:
+            start = self.next
+            self.next = (self.next + 1) % len(self.engines)
+        for k in range(len(self.engines)):
+            i = (start + k) % len(self.engines)
+            lag = self.lag(i)
+            if lag is not None and lag <= self.max_lag:
+                self.reads[i] += 1
+                return i
+        self.fallbacks += 1
+        return None
+
+    def engine(self, primary: Engine) -> Engine:
+        """
+        Return the engine of the next usable replica, or primary.
+        """
+        i = self.pick()
+        return primary if i is None else self.engines[i]
+
+    def stats(self):
+        return {
+            "replicas": [{"url": repr(e.url), "lag": self.lags[i], "reads": self.reads[i]}
+                         for (i, e) in enumerate(self.engines)],
+            "max_lag": self.max_lag,
+            "primary_fallbacks": self.fallbacks,
+        }
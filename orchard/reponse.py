@@ -20,10 +20,11 @@ class ResponseModel(ResponseBaseModel):
 
 
 class SearchResponseModel(ResponseBaseModel):
-    count: int = 0
+    count: Optional[int] = 0
     data: Optional[List[Any]]
     page: Optional[int]
     page_size: Optional[int]
+    next: Optional[str] = None
 
 
 class ResponseException(Exception):
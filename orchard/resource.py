@@ -4,6 +4,7 @@ from typing import TypeVar, Type, Optional
 from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 from starlette import status
 
+from orchard.asyncdatabase import AsyncDbManager
 from orchard.database import DbManager
 from orchard.reponse import ResponseException, SearchResponseModel, ReturnStatus, ResponseModel
 
@@ -15,11 +16,21 @@ M = TypeVar("M", bound=DbManager)
 # logging
 logger = logging.getLogger(__name__)
 
+#: the ways BaseResource.get can obtain the total number of rows
+COUNT_MODES = ('exact', 'window', 'estimate', 'none')
+
 class BaseResource():
 
+    #: the default count_mode of get()
+    count_mode = 'exact'
+
+    #: serve get_with_id() from the shared row cache (by primary key)
+    cacheable = False
+
     def __init__(self, manager_type: Type[M]):
         self.t_manager = manager_type
         self.table_manager: DbManager = self.t_manager()
+        self.async_manager = AsyncDbManager(self.table_manager)
 
 
     def gen_query_params(self, search_query: str = None, extra_params: dict = None) -> (str, dict):
@@ -84,19 +95,69 @@ class BaseResource():
             page_size: int = 100,
             order_by: Optional[str] = None,
             format: Optional[str] = None,
-            extra_params: Optional[dict] = None
+            extra_params: Optional[dict] = None,
+            after: Optional[str] = None,
+            count_mode: Optional[str] = None,
+            connector=None
             ):
+        """
+        Search the resource.
+
+        If after is given (an empty string for the first page), keyset
+        pagination is used instead of page/offset and the token of the
+        next page is returned in the 'next' field.
+
+        count_mode (defaults to the count_mode attribute) selects how
+        the total is obtained: 'exact' (separate COUNT on the same
+        connection), 'window' (COUNT(*) OVER () in the page query),
+        'estimate' (approximate, see DbManager.estimate_count) or
+        'none' (count is not returned).
+        """
         man = self.table_manager
         (query, bound_params) = self.gen_query_params(search_query, extra_params)
         if format == 'option':
             page_size = None
+        if count_mode is None:
+            count_mode = self.count_mode
+        if count_mode not in COUNT_MODES:
+            raise ResponseException(code=status.HTTP_400_BAD_REQUEST, info=f"Invalid count mode {count_mode}")
+        keyset = after is not None and page_size is not None
+        next_cursor = None
+        count: Optional[int] = None
+        # count and page on the same (replica) connection
+        connector = man.read_connector(connector)
         try:
-            count: int = man.count(criteria=query, bound_params=bound_params)
-            data = man.search(criteria=query,
-                              page=page,
-                              page_size=page_size,
-                              order_by=order_by,
-                              bound_params=bound_params)
+            with connector():
+                if count_mode == 'window' and not keyset:
+                    (count, data) = man.search_with_count(criteria=query,
+                                                          page=page,
+                                                          page_size=page_size,
+                                                          order_by=order_by,
+                                                          bound_params=bound_params,
+                                                          connector=connector)
+                else:
+                    if count_mode == 'estimate':
+                        count = man.estimate_count(criteria=query, bound_params=bound_params, connector=connector)
+                    elif count_mode != 'none':
+                        count = man.count(criteria=query, bound_params=bound_params, connector=connector)
+                    if keyset:
+                        (data, next_cursor) = man.search_keyset(criteria=query,
+                                                                page_size=page_size,
+                                                                order_by=order_by,
+                                                                after=after,
+                                                                bound_params=bound_params,
+                                                                connector=connector)
+                    else:
+                        data = man.search(criteria=query,
+                                          page=page,
+                                          page_size=page_size,
+                                          order_by=order_by,
+                                          bound_params=bound_params,
+                                          connector=connector)
+        except ValueError as e:
+            classname = __class__
+            logger.error(f"[{classname}] Invalid search parameters: {e}")
+            raise ResponseException(code=status.HTTP_400_BAD_REQUEST, info=f"Invalid search parameters: {e}")
         except (SQLAlchemyError, DBAPIError) as e:
             classname = __class__
             print(e)
@@ -108,13 +169,17 @@ class BaseResource():
                                    count=count,
                                    data=self.format_data(format, data),
                                    page=page,
-                                   page_size=page_size)
+                                   page_size=page_size,
+                                   next=next_cursor)
 
-    def get_with_id(self, uid):
+    def get_with_id(self, uid, connector=None):
         man = self.t_manager()
-        cond = self.gen_cond_with_uid(uid)
         try:
-            data = man.get_with_cond(cond, condIsText=False)
+            if self.cacheable:
+                data = man.get_with_key(uid, cacheable=True, connector=connector)
+            else:
+                cond = self.gen_cond_with_uid(uid)
+                data = man.get_with_cond(cond, condIsText=False, connector=connector)
         except (SQLAlchemyError, DBAPIError) as e:
             classname = __class__
             logger.error(f"[{classname}] Failed to get search results: {e}")
@@ -123,10 +188,10 @@ class BaseResource():
                              content=self.format_record(data),
                              info=f'retrived {uid}')
 
-    def post(self, res_in):
+    def post(self, res_in, connector=None):
         man = self.table_manager
         try:
-            res = man.insert_with_get(res_in)
+            res = man.insert_with_get(res_in, connector=connector)
         except (SQLAlchemyError, DBAPIError) as e:
             classname = __class__
             logger.error(f"[{classname}] Failed to add record: {e}")
@@ -135,10 +200,10 @@ class BaseResource():
                              content=self.format_record(res),
                              info=str({"rows_inserted": 1}))
 
-    def put_with_id(self, uid, res_in):
+    def put_with_id(self, uid, res_in, connector=None):
         man = self.table_manager
         try:
-            res = man.update_with_get(res_in, uid)
+            res = man.update_with_get(res_in, uid, connector=connector)
             if res is None:
                 raise ResponseException(code=status.HTTP_404_NOT_FOUND,
                                         info=f"could not find data {uid} to update")
@@ -150,10 +215,10 @@ class BaseResource():
                              content=self.format_record(res),
                              info=str({"rows_updated": 1}))
 
-    def delete_with_id(self, uid):
+    def delete_with_id(self, uid, connector=None):
         man = self.table_manager
         try:
-            rows_deleted: int = man.delete(uid)
+            rows_deleted: int = man.delete(uid, connector=connector)
         except (SQLAlchemyError, DBAPIError) as e:
             classname = __class__
             logger.error(f"[{classname}] Failed to delete user and group mapping: {e}")
@@ -167,3 +232,22 @@ class BaseResource():
         return ResponseModel(status=ReturnStatus.FAIL.value,
                              content=uid,
                              info=f"Could not find a record to delete")
+
+    # Awaitable versions for async routes, executed on the async engine
+    # (see orchard.asyncdatabase)
+    async def get_async(self, *args, **kwargs):
+        return await self.async_manager.run_read(self.get, *args, **kwargs)
+
+    async def get_with_id_async(self, uid):
+        # cached lookups go to the primary, see AsyncDbManager.get_with_key()
+        run = self.async_manager.run if self.cacheable else self.async_manager.run_read
+        return await run(self.get_with_id, uid)
+
+    async def post_async(self, res_in):
+        return await self.async_manager.run(self.post, res_in)
+
+    async def put_with_id_async(self, uid, res_in):
+        return await self.async_manager.run(self.put_with_id, uid, res_in)
+
+    async def delete_with_id_async(self, uid):
+        return await self.async_manager.run(self.delete_with_id, uid)
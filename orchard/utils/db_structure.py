@@ -1,13 +1,20 @@
+import hashlib
 import json
 import os.path
+import re
 from pprint import pprint
 from typing import List, Dict, Optional
 
 from sqlalchemy.exc import ProgrammingError
 
-from orchard.database import db_engine, connectivity
+from orchard.database import DbManager, db_engine, connectivity, query_patterns
 from pydantic import BaseModel
-from sqlalchemy import text
+from sqlalchemy import Column, MetaData, Table, inspect, text, types
+from sqlalchemy.engine import Dialect
+from sqlalchemy.schema import FetchedValue
+
+#: the directory containing the schema dumps (schemas/<version>/<table>.json)
+SCHEMA_DIR = 'schemas'
 
 
 class TableInfo(BaseModel):
@@ -51,15 +58,85 @@ def dump_create_table(conn, table_name):
         return None
 
 
+def latest_schema_version() -> str:
+    with open(os.path.join(SCHEMA_DIR, 'schema_info.json'), 'rb') as f:
+        info = json.load(f)
+    return info['schema_version']
+
+
+def load_table_info(table_name, schema_version=-1) -> TableInfo:
+    if schema_version == -1 or schema_version == 'latest':
+        schema_version = latest_schema_version()
+    with open(os.path.join(SCHEMA_DIR, schema_version, table_name + '.json'), 'r') as f:
+        return TableInfo(**json.load(f))
+
+
 def get_create_table_sql(table_name, schema_version=-1):
-    if schema_version == -1:
-        # latest version
-        with open('schemas/schema_info.json', 'rb') as f:
-            info = json.load(f)
-            schema_version = info['schema_version']
-    with open(os.path.join('schemas', schema_version, table_name), 'r') as f1:
-        table_info = TableInfo(**json.load(f))
-    return table_info.create_table_sql
+    return load_table_info(table_name, schema_version).create_table_sql
+
+
+def table_checksum(fields: List[Dict], indexes: List[Dict]) -> str:
+    """
+    Checksum of the column and index definitions of a table, as
+    returned by dump_fields() and dump_indexes().
+    """
+    dat = json.dumps({'fields': fields, 'indexes': indexes}, sort_keys=True, default=str)
+    return hashlib.sha1(dat.encode()).hexdigest()
+
+
+def live_table_checksum(conn, table_name) -> str:
+    return table_checksum(dump_fields(conn, table_name), dump_indexes(conn, table_name))
+
+
+def parse_column_type(type_str: str, dialect: Optional[Dialect] = None) -> types.TypeEngine:
+    """
+    Convert a SHOW COLUMNS type (e.g. 'int(10) unsigned',
+    'varchar(200)') into a SQLAlchemy type, using the dialect's
+    type names when available.
+    """
+    m = re.match(r'^(\w+)(?:\((.*)\))?', type_str.strip().lower())
+    name = m.group(1)
+    args = m.group(2)
+    names = dialect.ischema_names if dialect is not None and hasattr(dialect, 'ischema_names') else {}
+    type_cls = names.get(name)
+    if type_cls is None:
+        type_cls = types.NullType
+        for k, v in (('int', types.Integer), ('char', types.String), ('text', types.Text),
+                     ('blob', types.LargeBinary), ('float', types.Float), ('double', types.Float),
+                     ('decimal', types.Numeric), ('datetime', types.DateTime),
+                     ('timestamp', types.DateTime), ('date', types.Date), ('time', types.Time)):
+            if k in name:
+                type_cls = v
+                break
+    type_args = []
+    if args and re.match(r'^[\d,\s]+$', args):
+        type_args = [int(a) for a in args.split(',')]
+    try:
+        return type_cls(*type_args)
+    except TypeError:
+        return type_cls()
+
+
+def table_from_info(table_info: TableInfo, meta: MetaData, dialect: Optional[Dialect] = None) -> Table:
+    """
+    Build a Table object from a schema dump without touching the
+    database.
+    """
+    columns = []
+    for f in table_info.fields:
+        extra = (f.get('Extra') or '').lower()
+        kw = {}
+        if f.get('Default') is not None or 'on update' in extra or 'generated' in extra:
+            kw['server_default'] = FetchedValue()
+        columns.append(Column(
+            f['Field'],
+            parse_column_type(f['Type'], dialect),
+            primary_key=f.get('Key') == 'PRI',
+            nullable=f.get('Null') == 'YES',
+            autoincrement='auto_increment' in extra,
+            **kw
+        ))
+    return Table(table_info.table_name, meta, *columns, extend_existing=True)
 
 
 def db_structure_dump(schema_version='0000000000', table_names: List[str] = None):
@@ -150,3 +227,59 @@ def db_structure_check(schema_version='0000000000'):
     else:
         print(' * schemas matched.')
     return all_valid, invalid_list
+
+
+def table_indexes(table_name, engine=db_engine) -> Dict[str, List[str]]:
+    """
+    Return the indexes of a table, including the primary key, as
+    {index name: [column, ...]}.
+    """
+    insp = inspect(engine)
+    indexes = {i['name']: list(i['column_names']) for i in insp.get_indexes(table_name)}
+    pkey = insp.get_pk_constraint(table_name)
+    if pkey and pkey.get('constrained_columns'):
+        indexes['PRIMARY'] = list(pkey['constrained_columns'])
+    return indexes
+
+
+def index_advice(managers: List[DbManager], patterns: Optional[Dict] = None, min_count: int = 1):
+    """
+    Report missing indexes for a list of managers:
+
+    - INDEX_MISSING: an index declared in the manager's indexes
+      attribute does not exist;
+    - INDEX_SUGGESTED: a query shape (filter columns + order-by columns)
+      recorded in orchard.database.query_patterns, or given in
+      patterns, is not served by the leading column of any index.
+
+    :param managers: the managers (instances) to check
+    :param patterns: {(table name, filter columns, order-by columns):
+        count}, defaults to the patterns recorded in this process
+    :param min_count: ignore shapes seen fewer times
+    :return: a list of advices
+    """
+    if patterns is None:
+        patterns = query_patterns
+    advices = []
+    for man in managers:
+        table_name = man.table_name
+        print(' * Checking indexes of ' + table_name)
+        existing = table_indexes(table_name, man.db_engine)
+        for (name, columns) in man.indexes.items():
+            if list(columns) not in existing.values():
+                print(' < missing index', name, columns)
+                advices.append({'type': 'INDEX_MISSING', 'table': table_name, 'index': name, 'columns': columns})
+        for ((t, filters, orders), count) in patterns.items():
+            if t != table_name or count < min_count:
+                continue
+            columns = list(filters) + [c for c in orders if c not in filters]
+            if len(columns) == 0:
+                continue
+            if any(len(cols) > 0 and cols[0] in columns for cols in existing.values()):
+                continue
+            print(' > suggest index', columns, 'used', count, 'times')
+            advices.append({'type': 'INDEX_SUGGESTED', 'table': table_name, 'columns': columns,
+                            'filters': list(filters), 'order_by': list(orders), 'count': count})
+    if len(advices) == 0:
+        print(' * indexes ok.')
+    return advices
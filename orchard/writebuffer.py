@@ -0,0 +1,216 @@
+"""
+Write-behind buffer for DbManager.
+
+Rows are collected in memory and written to the table with
+DbManager.insert_bulk() once either the size threshold or the time
+threshold is reached. The buffer is flushed on interpreter exit.
+
+When the database is unavailable the rows are kept and the flushes are
+retried with exponential backoff. A batch rejected for its data
+(constraint violation, invalid value) is written again row by row, and
+only the rejected rows are logged and dropped, since retrying them
+cannot succeed.
+"""
+
+import atexit
+import copy
+import logging
+import threading
+import time
+from typing import Any, List, Optional
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from orchard.database import DbManager
+
+#: errors caused by the rows themselves, as opposed to transient ones
+DATA_ERRORS = (IntegrityError, DataError)
+
+# logging
+logger = logging.getLogger(__name__)
+
+
+class WriteBuffer:
+    """
+    Buffer inserts for a DbManager and write them in batches.
+
+    Usage::
+
+        buf = WriteBuffer(DataManager(), max_rows=20, flush_interval=60)
+        buf.add(data)
+        ...
+        buf.close()
+    """
+
+    def __init__(self,
+                 manager: DbManager,
+                 max_rows: int = 50,
+                 flush_interval: Optional[float] = 60.0,
+                 max_pending: int = 10000,
+                 flush_at_exit: bool = True,
+                 retry_delay: float = 1.0,
+                 max_retry_delay: float = 300.0
+                 ) -> None:
+        """
+        :param manager: the manager of the table the rows are written to
+        :type manager: DbManager
+
+        :param max_rows: flush when this many rows are buffered
+        :type max_rows: int
+
+        :param flush_interval: flush when the oldest buffered row is
+            older than this (in seconds); None disables the timer
+        :type flush_interval: Optional[float]
+
+        :param max_pending: upper bound of rows kept in memory while
+            the database is unavailable; the oldest rows are dropped
+        :type max_pending: int
+
+        :param flush_at_exit: register close() with atexit
+        :type flush_at_exit: bool
+
+        :param retry_delay: the delay (in seconds) before retrying after
+            a failed flush, doubled after each further failure
+        :type retry_delay: float
+
+        :param max_retry_delay: the upper bound of the retry delay
+        :type max_retry_delay: float
+        """
+        self.manager = manager
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.rows: List[Any] = []
+        self.first_added: Optional[float] = None
+        self.failures = 0
+        self.retry_at: Optional[float] = None
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.timer: Optional[threading.Thread] = None
+        if flush_interval is not None:
+            self.timer = threading.Thread(target=self._timer_loop, daemon=True)
+            self.timer.start()
+        if flush_at_exit:
+            atexit.register(self.close)
+
+    def add(self, obj) -> None:
+        """
+        Append an object to the buffer, flushing if the size threshold
+        is reached.
+
+        :param obj: an instance of the manager's data model class
+        """
+        with self.lock:
+            if self.first_added is None:
+                self.first_added = time.monotonic()
+            self.rows.append(copy.copy(obj))
+            # flushes are skipped while backing off, keep the bound
+            self._trim()
+            full = len(self.rows) >= self.max_rows
+        if full:
+            self.flush()
+
+    def flush(self, connector=None, force: bool = False) -> int:
+        """
+        Write all buffered rows with DbManager.insert_bulk().
+
+        If the write fails for a transient reason (e.g. the database is
+        down), the rows are put back at the front of the buffer and no
+        flush is attempted before the retry delay has passed. If the
+        batch is rejected for its rows (DATA_ERRORS), they are written
+        one by one and the rejected ones are dropped.
+
+        :param force: flush even during the retry delay
+        :type force: bool
+
+        :return: the number of rows written
+        :rtype: int
+        """
+        with self.lock:
+            if not force and self.retry_at is not None and time.monotonic() < self.retry_at:
+                return 0
+            rows = self.rows
+            self.rows = []
+            self.first_added = None
+        if len(rows) == 0:
+            return 0
+        logger.info("[orchard.writebuffer.WriteBuffer.flush] %s rows into %s",
+                    len(rows), self.manager.table_name)
+        try:
+            self.manager.insert_bulk(rows, return_keys=False, connector=connector)
+        except DATA_ERRORS as e:
+            logger.warning("[orchard.writebuffer.WriteBuffer.flush] %s rows rejected, writing them one by one: %s",
+                           len(rows), e)
+            return self._flush_each(rows, connector)
+        except Exception as e:
+            self._back_off(rows, e)
+            return 0
+        self._succeeded()
+        return len(rows)
+
+    def _flush_each(self, rows: List[Any], connector=None) -> int:
+        # write a rejected batch row by row, dropping the rejected rows
+        written = 0
+        for (i, row) in enumerate(rows):
+            try:
+                self.manager.insert_bulk([row], return_keys=False, connector=connector)
+            except DATA_ERRORS as e:
+                logger.error("[orchard.writebuffer.WriteBuffer.flush] dropping a row rejected by the database: %s", e)
+                with self.lock:
+                    self.dropped += 1
+            except Exception as e:
+                self._back_off(rows[i:], e)
+                return written
+            else:
+                written += 1
+        self._succeeded()
+        return written
+
+    def _back_off(self, rows: List[Any], e: Exception) -> None:
+        # put the unwritten rows back and delay the next flush
+        with self.lock:
+            self.failures += 1
+            delay = min(self.max_retry_delay, self.retry_delay * 2 ** (self.failures - 1))
+            self.retry_at = time.monotonic() + delay
+            self.rows = rows + self.rows
+            self._trim()
+            if self.first_added is None:
+                self.first_added = time.monotonic()
+        logger.error("[orchard.writebuffer.WriteBuffer.flush] Failed to write %s rows (retrying in %.0f s): %s",
+                     len(rows), delay, e)
+
+    def _succeeded(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.retry_at = None
+
+    def _trim(self) -> None:
+        # drop the oldest rows beyond max_pending, the lock is held
+        if len(self.rows) > self.max_pending:
+            dropped = len(self.rows) - self.max_pending
+            logger.warning("[orchard.writebuffer.WriteBuffer] dropping %s oldest rows", dropped)
+            self.rows = self.rows[dropped:]
+            self.dropped += dropped
+
+    def _timer_loop(self) -> None:
+        while not self.stop_event.wait(min(self.flush_interval, 1.0)):
+            with self.lock:
+                due = (self.first_added is not None
+                       and time.monotonic() - self.first_added >= self.flush_interval)
+            if due:
+                self.flush()
+
+    def close(self) -> None:
+        """
+        Stop the timer and flush the remaining rows.
+        """
+        self.stop_event.set()
+        if self.timer is not None and self.timer is not threading.current_thread():
+            self.timer.join(timeout=5)
+        self.flush(force=True)
+
+    def __len__(self) -> int:
+        return len(self.rows)
@@ -1,6 +1,8 @@
-import json
 import gpiozero
-import time
+import queue
+
+import livestate
+import statestore
 print("Hi from RelayController")
 
 # Set the GPIO pin numbers
@@ -11,27 +13,63 @@ PUMP_PIN = 27
 uvrelay = gpiozero.OutputDevice(UV_LAMP_PIN, active_high=False, initial_value=False)
 pumprelay = gpiozero.OutputDevice(PUMP_PIN, active_high=False, initial_value=False)
 
-def read_json():
-    with open("./current.json", "r") as current_json:
-        current = json.load(current_json)
-    with open("./userstate.json", "r") as state_json:
-        state = json.load(state_json)
-        print(state)
-    return current['light'], current['soil_humidity'], state['uvlamp'], state['pump']
+# Seconds of readings averaged for the automatic decisions
+DECISION_WINDOW = 10
+# Seconds after which the relays are re-evaluated without any event, to
+# pick up changes made by other processes
+RESYNC_INTERVAL = 60
+
+# Wakes the relay engine: 'reading' for a new light or soil humidity
+# sample, 'command' when the user changed a relay mode
+events = queue.Queue()
+
+def on_reading(name):
+    if name in ('light', 'soil_humidity'):
+        events.put('reading')
+
+def on_state(fields):
+    if 'pump' in fields or 'uvlamp' in fields:
+        events.put('command')
+
+def wait_events():
+    # block until something happened, then take all the pending events
+    # at once (a frame brings several samples)
+    try:
+        events.get(timeout=RESYNC_INTERVAL)
+    except queue.Empty:
+        return
+    while True:
+        try:
+            events.get_nowait()
+        except queue.Empty:
+            return
+
+def read_modes():
+    state = statestore.store.read()
+    return state['uvlamp'], state['pump']
+
+def read_sensors():
+    # mean light and soil humidity of the last DECISION_WINDOW seconds,
+    # None when there is no recent reading
+    light = livestate.stats('light', DECISION_WINDOW)
+    soil_humidity = livestate.stats('soil_humidity', DECISION_WINDOW)
+    return (None if light is None else light['mean'],
+            None if soil_humidity is None else soil_humidity['mean'])
 
 def relaycontroller():
     light = 60
     soil_humidity = 60
     uvlamp = "auto"
     pump = "auto"
+    published = None
+    livestate.listeners.append(on_reading)
+    statestore.store.listeners.append(on_state)
     print("Relay Controller Started")
     while True:
-        print("Relay Controller Running")
-        try :
-            light, soil_humidity, uvlamp, pump = read_json()
-            print(light, soil_humidity, uvlamp, pump)
-        except :
-            print("Error reading JSON")
+        recent_light, recent_soil_humidity = read_sensors()
+        if recent_light is not None and recent_soil_humidity is not None:
+            light, soil_humidity = recent_light, recent_soil_humidity
+        uvlamp, pump = read_modes()
         try:
             if uvlamp == "auto":
                 if light < 40:
@@ -61,11 +99,12 @@ def relaycontroller():
                 pumpstate="manoff"
                 pumprelay.off()
 
-            # Save to state.json
-            state = {"pump": pumpstate, "uvlamp": uvstate}
-            with open('state.json', 'w') as f:
-                json.dump(state, f)
+            # Publish the relay states when they change
+            if (pumpstate, uvstate) != published:
+                print(light, soil_humidity, uvlamp, pump, "->", pumpstate, uvstate)
+                statestore.store.update(pump_state=pumpstate, uvlamp_state=uvstate)
+                published = (pumpstate, uvstate)
         except KeyboardInterrupt or SystemExit:
             print("Quitting !")
             break
-        time.sleep(1)
\ No newline at end of file
+        wait_events()
@@ -0,0 +1,139 @@
+# serialprotocol.py
+#
+# The sample frames sent by ESP32/main.py (read by serialreader). A frame is
+#
+#   sync    2 bytes  0xAA 0x55
+#   version 1 byte   PROTOCOL_VERSION
+#   kind    1 byte   FRAME_SAMPLES or FRAME_WINDOW
+#   seq     uint16   frame counter, wraps at 65536
+#   t0      uint32   device ticks_ms() of the first sample
+#   period  uint16   milliseconds between two samples
+#   count   uint8    number of samples in the frame
+#   chans   uint8    number of channels per sample (uv, light, soil)
+#   payload count * chans channel values, sample by sample
+#   crc     uint32   CRC-32 of everything between sync and crc
+#
+# all little-endian. A channel value of a FRAME_SAMPLES frame is the raw
+# uint16 ADC reading. The firmware filters on the device and sends
+# FRAME_WINDOW frames, whose channel values are the filtered reading, min
+# and max (uint16) and variance (uint32, ADC counts squared) of the
+# window a sample was decimated from. The parser is incremental: bytes
+# are fed as they arrive and complete frames come out, garbage and
+# corrupted frames are skipped by resynchronizing on the next sync marker.
+import binascii
+import struct
+import time
+from collections import namedtuple
+
+SYNC = b'\xaa\x55'
+PROTOCOL_VERSION = 1
+FRAME_SAMPLES = 1
+FRAME_WINDOW = 2
+# the struct format of one channel value, per frame kind
+CHANNEL_FORMATS = {FRAME_SAMPLES: 'H', FRAME_WINDOW: 'HHHI'}
+CHANNEL_NAMES = ('uv', 'light', 'dirt')
+HEADER = struct.Struct('<2sBBHIHBB')
+CRC = struct.Struct('<I')
+# MicroPython's ticks_ms() wraps at 2**30
+TICKS_PERIOD = 1 << 30
+ADC_MAX = 4095
+# the most samples the firmware puts in a frame (its SAMPLES_PER_FRAME
+# must not exceed it); headers announcing more are corrupted
+MAX_FRAME_SAMPLES = 32
+
+Frame = namedtuple('Frame', ['kind', 'seq', 't0', 'period', 'samples'])
+
+
+class FrameParser:
+    """
+    Incremental parser of the sample frames. stats counts the frames,
+    lost frames, CRC errors and skipped bytes so far.
+    """
+
+    def __init__(self, stats=None):
+        self.buf = bytearray()
+        self.next_seq = None
+        if stats is None:
+            stats = {}
+        for k in ('frames', 'lost', 'crc_errors', 'skipped'):
+            stats.setdefault(k, 0)
+        self.stats = stats
+
+    def feed(self, data):
+        """
+        Add received bytes and return the frames completed by them.
+        """
+        buf = self.buf
+        buf.extend(data)
+        frames = []
+        pos = 0
+        while True:
+            start = buf.find(SYNC, pos)
+            if start < 0:
+                # a trailing 0xAA may be the start of the next sync
+                keep = 1 if pos < len(buf) and buf[-1:] == SYNC[:1] else 0
+                self.stats['skipped'] += max(0, len(buf) - pos - keep)
+                pos = max(pos, len(buf) - keep)
+                break
+            self.stats['skipped'] += start - pos
+            pos = start
+            if len(buf) - pos < HEADER.size:
+                break
+            (_, version, kind, seq, t0, period, count, chans) = HEADER.unpack_from(buf, pos)
+            fmt = CHANNEL_FORMATS.get(kind)
+            if (version != PROTOCOL_VERSION or fmt is None or chans != len(CHANNEL_NAMES)
+                    or not 0 < count <= MAX_FRAME_SAMPLES):
+                # not a frame (or a corrupted header), look for the next
+                # sync rather than wait for a bogus length
+                pos += 1
+                continue
+            end = pos + HEADER.size + struct.calcsize('<' + fmt) * count * chans + CRC.size
+            if len(buf) < end:
+                break
+            if binascii.crc32(buf[pos + len(SYNC):end - CRC.size]) != CRC.unpack_from(buf, end - CRC.size)[0]:
+                self.stats['crc_errors'] += 1
+                pos += 1
+                continue
+            values = struct.unpack_from('<' + fmt * (count * chans), buf, pos + HEADER.size)
+            width = len(fmt) * chans
+            samples = [values[i:i + width] for i in range(0, len(values), width)]
+            frames.append(Frame(kind, seq, t0, period, samples))
+            self.track(seq)
+            pos = end
+        del buf[:pos]
+        return frames
+
+    def track(self, seq):
+        # count the frames missing between two received ones; a big jump
+        # backwards is a device restart, not a loss
+        if self.next_seq is not None:
+            gap = (seq - self.next_seq) & 0xFFFF
+            if gap < 0x8000:
+                self.stats['lost'] += gap
+        self.next_seq = (seq + 1) & 0xFFFF
+        self.stats['frames'] += 1
+
+
+class DeviceClock:
+    """
+    Maps the device's ticks_ms() to host time.time(). The offset is the
+    smallest (lowest latency) one seen, re-anchored when the device
+    restarts or drifts more than max_drift seconds.
+    """
+
+    def __init__(self, max_drift=2.0):
+        self.max_drift = max_drift
+        self.last = None
+        self.ms = 0
+        self.offset = None
+
+    def host_time(self, ticks, now=None):
+        if now is None:
+            now = time.time()
+        if self.last is not None:
+            self.ms += (ticks - self.last) % TICKS_PERIOD
+        self.last = ticks
+        t = self.ms / 1000
+        if self.offset is None or now - t < self.offset or now - t - self.offset > self.max_drift:
+            self.offset = now - t
+        return t + self.offset
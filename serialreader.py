@@ -1,35 +1,78 @@
 # serialreader.py
+#
+# Reads the sample frames sent by ESP32/main.py (see serialprotocol for
+# the frame layout) and publishes the readings.
 import time
 
 import serial
 
-ser = serial.Serial('/dev/ttyUSB0', 115200)  # Change this to match your serial port
+import livestate
+from serialprotocol import ADC_MAX, CHANNEL_NAMES, FRAME_WINDOW, TICKS_PERIOD, DeviceClock, FrameParser
+
+ser = serial.Serial('/dev/ttyUSB0', 115200, timeout=1)  # Change this to match your serial port
 
 uv = None  # Define uv
 dirt = None  # Define dirt
 light = None
+sample_time = None  # host time.time() of the latest sample
+# min, max and variance (in percent) of the latest window, per channel
+window = {}
 
 # Dirt mak = dry
 # UV noi = bright
 stop = False
 
+# frames, samples, lost frames, CRC errors and skipped bytes so far
+stats = {'frames': 0, 'samples': 0, 'lost': 0, 'crc_errors': 0, 'skipped': 0}
+
+
+def scale(rawuv, rawlight, rawdirt):
+    # raw ADC values to percents
+    return ((rawuv / ADC_MAX) * 100,
+            100 - ((rawlight / ADC_MAX) * 100),
+            100 - (rawdirt / ADC_MAX) * 100)
+
+
+def scale_window(name, rawmin, rawmax, rawvariance):
+    # window statistics in percents; light and dirt are inverted
+    low, high = (rawmin / ADC_MAX) * 100, (rawmax / ADC_MAX) * 100
+    if name != 'uv':
+        low, high = 100 - high, 100 - low
+    return {'min': low, 'max': high, 'variance': rawvariance * (100 / ADC_MAX) ** 2}
+
+
 def readloop():
-    global uv, dirt, light  # Declare uv and dirt as global
-    if not stop:
-        while True:
-            try:
-                data = ser.readline().decode().strip()
-                # print(data)
-                rawuv, rawlight, rawdirt = (data.split(" "))  # update the shared variables
-                uv = (int(rawuv)/4095)*100
-                light = 100-((int(rawlight)/4095)*100)
-                dirt = 100-(int(rawdirt)/4095)*100
-            except:
-                print("Error reading serial data.")
+    global uv, dirt, light, sample_time, window  # Declare uv and dirt as global
+    parser = FrameParser(stats)
+    clock = DeviceClock()
+    while not stop:
+        try:
+            # blocks until at least one byte (or the timeout), no polling
+            data = ser.read(ser.in_waiting or 1)
+        except serial.SerialException as e:
+            print(f"Error reading serial data: {e}")
             time.sleep(1)
-    elif KeyboardInterrupt or SystemExit or stop:
-        ser.close()
-        print("Serial connection closed.")
-        exit()
+            continue
+        for frame in parser.feed(data):
+            if len(frame.samples) == 0:
+                continue
+            last = len(frame.samples) - 1
+            sample_time = clock.host_time((frame.t0 + last * frame.period) % TICKS_PERIOD)
+            for (i, values) in enumerate(frame.samples):
+                if frame.kind == FRAME_WINDOW:
+                    uv, light, dirt = scale(*values[0:12:4])  # update the shared variables
+                else:
+                    uv, light, dirt = scale(*values[:3])  # update the shared variables
+                t = sample_time - (last - i) * frame.period / 1000
+                livestate.record('UV', uv, t)
+                livestate.record('light', light, t)
+                livestate.record('soil_humidity', dirt, t)
+            if frame.kind == FRAME_WINDOW:
+                values = frame.samples[last]
+                window = {name: scale_window(name, *values[4 * c + 1:4 * c + 4])
+                          for (c, name) in enumerate(CHANNEL_NAMES)}
+            stats['samples'] += len(frame.samples)
+    ser.close()
+    print("Serial connection closed.")
 
-# readloop()
\ No newline at end of file
+# readloop()
@@ -0,0 +1,209 @@
+# statestore.py
+#
+# The shared state of the controller (latest readings, relay states and
+# the user's relay modes), kept in a memory-mapped file instead of
+# current.json / state.json / userstate.json. The file lives in
+# /dev/shm (RAM, no SD card writes) and can be opened by several
+# threads and processes. Its layout is fixed:
+#
+#   magic   4 bytes  b'ORST'
+#   layout  uint16   LAYOUT_VERSION
+#   size    uint16   size of the body
+#   seq     uint64   seqlock counter, odd while a write is in progress
+#   body    the FIELDS, packed little-endian without padding
+#
+# Writers (serialized by a thread lock and flock()) make seq odd, write
+# their fields and make it even again. Readers copy the body and retry
+# until seq was the same even number before and after the copy, so they
+# never see a half-written state. seq // 2 is the version of the state.
+# The body can be checkpointed to disk and is restored from the
+# checkpoint when the shared memory is new (e.g. after a reboot).
+import contextlib
+import fcntl
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+STATE_PATH = '/dev/shm/orchard-state' if os.path.isdir('/dev/shm') else '/tmp/orchard-state'
+CHECKPOINT_PATH = 'state.bin'
+# Seconds between two checkpoints (0 to disable)
+CHECKPOINT_INTERVAL = 300
+
+MAGIC = b'ORST'
+LAYOUT_VERSION = 1
+
+# Relay states and user modes, stored as their index
+RELAY_STATES = (None, 'autoon', 'autooff', 'manon', 'manoff')
+RELAY_MODES = ('auto', 'on', 'off')
+
+# (name, struct format, choices of an enumerated field)
+FIELDS = (
+    ('data_time', 'd', None),
+    ('UV', 'd', None),
+    ('light', 'd', None),
+    ('temp', 'd', None),
+    ('air_humidity', 'd', None),
+    ('soil_humidity', 'd', None),
+    ('pump_state', 'B', RELAY_STATES),
+    ('uvlamp_state', 'B', RELAY_STATES),
+    ('pump', 'B', RELAY_MODES),
+    ('uvlamp', 'B', RELAY_MODES),
+)
+
+HEADER = struct.Struct('<4sHHQ')
+SEQ = struct.Struct('<Q')
+SEQ_OFFSET = HEADER.size - SEQ.size
+BODY = struct.Struct('<' + ''.join(fmt for (_, fmt, _) in FIELDS))
+OFFSETS = {}
+_offset = HEADER.size
+for (_name, _fmt, _choices) in FIELDS:
+    OFFSETS[_name] = (_offset, struct.Struct('<' + _fmt), _choices)
+    _offset += struct.calcsize('<' + _fmt)
+
+# spins of a reader before it checks for a writer that died mid-write
+MAX_SPINS = 1000
+
+
+def encode(choices, value):
+    if choices is not None:
+        return choices.index(value)
+    return math.nan if value is None else value
+
+
+def decode(choices, value):
+    if choices is not None:
+        return choices[value] if value < len(choices) else None
+    return None if math.isnan(value) else value
+
+
+class StateStore:
+    """
+    A memory-mapped, versioned state with seqlock reads.
+    """
+
+    def __init__(self, path=STATE_PATH, checkpoint_path=CHECKPOINT_PATH):
+        self.path = path
+        self.checkpoint_path = checkpoint_path
+        self.lock = threading.Lock()
+        self.checkpointed = None
+        # callbacks called with the names of the fields after each
+        # update() of this process, in the updating thread
+        self.listeners = []
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        size = HEADER.size + BODY.size
+        with self.writing():
+            if os.fstat(self.fd).st_size < size:
+                os.ftruncate(self.fd, size)
+            self.mm = mmap.mmap(self.fd, size)
+            if HEADER.unpack_from(self.mm)[:3] != (MAGIC, LAYOUT_VERSION, BODY.size):
+                self.initialize()
+
+    @contextlib.contextmanager
+    def writing(self):
+        # excludes the writers of this process (thread lock) and of the
+        # others (flock on the file)
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def initialize(self):
+        # a new (or incompatible) file: restore the checkpoint or start
+        # from the defaults; the writer lock is held
+        body = None
+        try:
+            with open(self.checkpoint_path, 'rb') as f:
+                dat = f.read()
+            if HEADER.unpack_from(dat)[:3] == (MAGIC, LAYOUT_VERSION, BODY.size):
+                body = dat[HEADER.size:HEADER.size + BODY.size]
+        except (OSError, struct.error):
+            pass
+        if body is None:
+            body = BODY.pack(*(encode(choices, None if choices is None else choices[0])
+                               for (_, _, choices) in FIELDS))
+        HEADER.pack_into(self.mm, 0, MAGIC, LAYOUT_VERSION, BODY.size, 0)
+        self.mm[HEADER.size:HEADER.size + BODY.size] = body
+
+    def read_body(self):
+        """
+        Return a consistent copy of the body and its version.
+        """
+        spins = 0
+        while True:
+            seq = SEQ.unpack_from(self.mm, SEQ_OFFSET)[0]
+            if seq & 1 == 0:
+                body = self.mm[HEADER.size:HEADER.size + BODY.size]
+                if SEQ.unpack_from(self.mm, SEQ_OFFSET)[0] == seq:
+                    return body, seq // 2
+            spins += 1
+            if spins >= MAX_SPINS:
+                # the writer may have died mid-write, once it holds no
+                # lock anymore the state is as good as it gets
+                with self.writing():
+                    seq = SEQ.unpack_from(self.mm, SEQ_OFFSET)[0]
+                    if seq & 1:
+                        SEQ.pack_into(self.mm, SEQ_OFFSET, seq + 1)
+                spins = 0
+            time.sleep(0)
+
+    def read(self):
+        """
+        Return a consistent copy of all the fields, by name.
+        """
+        body, _ = self.read_body()
+        return {name: decode(choices, value) for ((name, _, choices), value) in zip(FIELDS, BODY.unpack(body))}
+
+    @property
+    def version(self):
+        return SEQ.unpack_from(self.mm, SEQ_OFFSET)[0] // 2
+
+    def update(self, **values):
+        """
+        Atomically set some fields.
+        """
+        packed = [(OFFSETS[name][0], OFFSETS[name][1], encode(OFFSETS[name][2], value))
+                  for (name, value) in values.items()]
+        with self.writing():
+            seq = SEQ.unpack_from(self.mm, SEQ_OFFSET)[0] | 1
+            SEQ.pack_into(self.mm, SEQ_OFFSET, seq)
+            try:
+                for (offset, fmt, value) in packed:
+                    fmt.pack_into(self.mm, offset, value)
+            finally:
+                SEQ.pack_into(self.mm, SEQ_OFFSET, seq + 1)
+        for listener in self.listeners:
+            listener(values.keys())
+
+    def checkpoint(self):
+        """
+        Write the state to checkpoint_path if it changed since the last
+        checkpoint. Returns whether it was written.
+        """
+        body, version = self.read_body()
+        if version == self.checkpointed:
+            return False
+        tmp = self.checkpoint_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, LAYOUT_VERSION, BODY.size, version * 2) + body)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.checkpoint_path)
+        self.checkpointed = version
+        return True
+
+    def checkpoint_loop(self, interval=CHECKPOINT_INTERVAL):
+        # run in a thread
+        while True:
+            time.sleep(interval)
+            try:
+                self.checkpoint()
+            except OSError as e:
+                print(f"State checkpoint failed: {e}")
+
+
+store = StateStore()
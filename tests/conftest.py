@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# the tests run on the SQLite backend, settings are read at import
+os.environ.setdefault('DB_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='orchard-test-'), 'orchard.db'))
@@ -0,0 +1,92 @@
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+from sqlalchemy import text
+
+from orchard import database
+from orchard.database import DbManager, query_patterns, query_shape
+from orchard.utils.db_structure import index_advice, table_indexes
+
+
+class Widget(BaseModel):
+    widget_id: Optional[int] = None
+    name: str
+    color: Optional[str] = None
+
+
+class WidgetManager(DbManager):
+
+    sql_create_table = """
+CREATE TABLE `widget` (
+  `widget_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `name` varchar(64) NOT NULL,
+  `color` varchar(16) DEFAULT NULL,
+  PRIMARY KEY (`widget_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+
+    indexes = {
+        'widget_name': ['name'],
+    }
+
+    def __init__(self):
+        super().__init__("widget", Widget)
+
+
+@pytest.fixture
+def widgets():
+    man = WidgetManager()
+    man.delete_in_batches("1")
+    return man
+
+
+def test_query_shape():
+    columns = ('widget_id', 'name', 'color')
+    assert query_shape(columns, "`color` = :name AND name LIKE 'a%'", "widget_id DESC") == \
+        (('color', 'name'), ('widget_id',))
+    assert query_shape(columns, "1", None) == ((), ())
+    assert query_shape(columns, "size > 3", "size") == ((), ())
+
+
+def test_queries_are_recorded(widgets):
+    k = ('widget', ('color',), ('name',))
+    before = query_patterns.get(k, 0)
+    widgets.search("color = :c", order_by='name', bound_params={'c': 'red'})
+    widgets.count("color = 'red'")
+    assert query_patterns[k] == before + 1
+    assert query_patterns[('widget', ('color',), ())] >= 1
+
+
+def test_declared_indexes_are_created(widgets):
+    assert table_indexes('widget', widgets.db_engine)['widget_name'] == ['name']
+    # once per process: nothing to do for the next managers
+    assert widgets.ensure_indexes() == []
+
+
+def test_missing_index_is_reported(widgets, monkeypatch):
+    with widgets.db_engine.begin() as conn:
+        conn.execute(text("DROP INDEX widget_name"))
+    monkeypatch.setattr(database, '_indexed_tables', set())
+    assert widgets.ensure_indexes(create=False) == ['widget_name']
+    advices = index_advice([widgets], patterns={})
+    assert advices == [{'type': 'INDEX_MISSING', 'table': 'widget', 'index': 'widget_name', 'columns': ['name']}]
+    assert widgets.ensure_indexes() == ['widget_name']
+    assert 'widget_name' in table_indexes('widget', widgets.db_engine)
+    assert widgets.ensure_indexes() == []
+
+
+def test_index_advice_suggests_unserved_shapes(widgets):
+    patterns = {
+        ('widget', ('color',), ()): 7,
+        # led by the name index or the primary key
+        ('widget', ('name',), ()): 9,
+        ('widget', ('color',), ('name',)): 4,
+        ('widget', (), ('widget_id',)): 5,
+        ('other', ('color',), ()): 3,
+    }
+    advices = index_advice([widgets], patterns=patterns)
+    assert advices == [{'type': 'INDEX_SUGGESTED', 'table': 'widget', 'columns': ['color'],
+                        'filters': ['color'], 'order_by': [], 'count': 7}]
+    # rare shapes are ignored
+    assert index_advice([widgets], patterns=patterns, min_count=8) == []
@@ -0,0 +1,106 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from model.DataManager import DataIn, DataManager
+from orchard.asyncdatabase import AsyncDbManager
+from orchard.database import DbManager
+
+
+class Note(BaseModel):
+    note_id: Optional[int] = None
+    rank: Optional[int] = None
+
+
+class NoteManager(DbManager):
+
+    sql_create_table = """
+CREATE TABLE `note` (
+  `note_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `rank` int(10) DEFAULT NULL,
+  PRIMARY KEY (`note_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+
+    def __init__(self):
+        super().__init__("note", Note)
+
+
+RANKS = [3, None, 1, 3, None, 2, 1, None, 3]
+
+
+@pytest.fixture(scope='module')
+def notes():
+    man = NoteManager()
+    man.delete_in_batches("1")
+    for (i, rank) in enumerate(RANKS, start=1):
+        man.insert(Note(note_id=i, rank=rank))
+    return man
+
+
+def pages(man, order_by, page_size):
+    rows, after = man.search_keyset("1", page_size, order_by=order_by)
+    result = [rows]
+    while after is not None:
+        rows, after = man.search_keyset("1", page_size, order_by=order_by, after=after)
+        result.append(rows)
+    return result
+
+
+def sort_key(note, desc):
+    # NULLs first going up, last going down, ties by note_id
+    key = (note.rank is not None, note.rank or 0, note.note_id)
+    return tuple(-k for k in key) if desc else key
+
+
+@pytest.mark.parametrize('desc', [False, True])
+@pytest.mark.parametrize('page_size', [1, 2, 4, 9])
+def test_pages_cover_nullable_column(notes, desc, page_size):
+    order_by = 'rank DESC' if desc else 'rank'
+    result = pages(notes, order_by, page_size)
+    seen = [n for rows in result for n in rows]
+    expected = sorted((Note(note_id=i, rank=r) for (i, r) in enumerate(RANKS, start=1)),
+                      key=lambda n: sort_key(n, desc))
+    assert [(n.note_id, n.rank) for n in seen] == [(n.note_id, n.rank) for n in expected]
+    assert all(len(rows) <= page_size for rows in result)
+
+
+def test_primary_key_order(notes):
+    seen = [n.note_id for rows in pages(notes, None, 4) for n in rows]
+    assert seen == list(range(1, len(RANKS) + 1))
+
+
+def test_cursor_round_trip(notes):
+    keys = notes.keyset_order('rank DESC')
+    rows, after = notes.search_keyset("1", 2, order_by='rank DESC')
+    assert notes.decode_cursor(keys, after) == [rows[-1].rank, rows[-1].note_id]
+
+
+def test_cursor_of_another_order_is_rejected(notes):
+    _, after = notes.search_keyset("1", 2, order_by='rank DESC')
+    with pytest.raises(ValueError):
+        notes.search_keyset("1", 2, order_by='rank', after=after)
+    with pytest.raises(ValueError):
+        notes.search_keyset("1", 2, order_by='rank', after='not a cursor')
+
+
+def test_data_pages_from_the_first_one():
+    # as /api does: no after for the first page, then X-Next-Cursor
+    data_man = DataManager()
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.delete())
+    t0 = datetime(2026, 2, 1)
+    data_man.insert([DataIn(data_time=t0 + timedelta(minutes=i), UV=i, light=i, temp=i, air_humidity=i,
+                            soil_humidity=i) for i in range(5)])
+    man = AsyncDbManager(data_man)
+    seen, after = [], None
+    while True:
+        lst, after = asyncio.run(man.search_keyset('1', page_size=2, order_by='data_time DESC', after=after,
+                                                   row_format='construct'))
+        seen += [d.UV for d in lst]
+        if after is None:
+            break
+    assert seen == [4, 3, 2, 1, 0]
@@ -0,0 +1,105 @@
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.pool import QueuePool
+
+from orchard import metrics
+from orchard.database import DbManager
+from orchard.metrics import Histogram, QueryMetrics, instrument_engine, pool_status, query_metrics, statement_type
+
+
+class Gauge(BaseModel):
+    gauge_id: Optional[int] = None
+    value: float
+
+
+class GaugeManager(DbManager):
+
+    sql_create_table = """
+CREATE TABLE `gauge` (
+  `gauge_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `value` float NOT NULL,
+  PRIMARY KEY (`gauge_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+
+    def __init__(self):
+        super().__init__("gauge", Gauge)
+
+
+@pytest.fixture
+def gauges():
+    man = GaugeManager()
+    man.delete_in_batches("1")
+    query_metrics.reset()
+    return man
+
+
+def test_histogram():
+    hist = Histogram(bounds=(1, 10, 100))
+    for v in (0.5, 0.5, 5, 50, 500):
+        hist.observe(v)
+    snap = hist.snapshot()
+    assert snap['buckets'] == {'le_1': 2, 'le_10': 1, 'le_100': 1, 'inf': 1}
+    assert snap['count'] == 5 and snap['max_ms'] == 500
+    assert hist.quantile(0.4) == 1
+    assert hist.quantile(0.6) == 10
+    assert hist.quantile(1.0) == 500
+    assert Histogram().quantile(0.5) is None
+
+
+def test_statement_type():
+    assert statement_type("\n  SELECT 1") == 'SELECT'
+    assert statement_type("(select 1) union (select 2)") == 'SELECT'
+    assert statement_type("insert into t values (1)") == 'INSERT'
+    assert statement_type("") == ''
+
+
+def test_operations_and_statements_are_recorded(gauges):
+    gauges.insert([Gauge(value=1.0), Gauge(value=2.0)])
+    gauges.search("value > :v", bound_params={'v': 0})
+    snap = query_metrics.snapshot()
+    assert snap['operations']['gauge.insert']['count'] == 1
+    assert snap['operations']['gauge.search']['count'] == 1
+    # insert_bulk() called by insert() is attributed to insert
+    assert 'gauge.insert_bulk' not in snap['operations']
+    assert snap['statements']['gauge.insert:INSERT']['rows'] == 2
+    assert snap['statements']['gauge.search:SELECT']['count'] == 1
+    # the same query again: compiled form from SQLAlchemy's cache
+    gauges.search("value > :v", bound_params={'v': 1})
+    assert query_metrics.snapshot()['compiled_cache']['hits'] >= 1
+
+
+def test_errors_are_counted(gauges):
+    with pytest.raises(OperationalError):
+        gauges.search("no_such_column = 1")
+    assert query_metrics.snapshot()['errors'] == {'gauge.search:SELECT': 1}
+
+
+def test_slow_query_log():
+    qm = QueryMetrics(slow_query_ms=10, slow_query_log_size=2)
+    qm.observe_statement('a:SELECT', 5, 1, 'SELECT 1')
+    for i in range(3):
+        qm.observe_statement('a:SELECT', 20 + i, 1, f'SELECT {i}')
+    slow = qm.snapshot()['slow_queries']
+    assert [q['statement'] for q in slow] == ['SELECT 1', 'SELECT 2']
+    assert slow[-1]['duration_ms'] == 22
+    qm.reset()
+    assert qm.snapshot()['slow_queries'] == [] and qm.snapshot()['statements'] == {}
+
+
+def test_pool_events_and_status(monkeypatch):
+    monkeypatch.setattr(metrics, 'query_metrics', QueryMetrics())
+    engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=2, max_overflow=0)
+    instrument_engine(engine)
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+        status = pool_status(engine)
+        assert status['pool'] == 'QueuePool'
+        assert status['size'] == 2 and status['in_use'] == 1
+    events = metrics.query_metrics.snapshot()['pool_events']
+    assert events['connect'] == 1 and events['checkout'] == 1 and events['checkin'] == 1
+    assert pool_status(engine)['in_use'] == 0
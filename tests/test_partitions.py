@@ -0,0 +1,89 @@
+import contextlib
+import datetime
+
+import pytest
+from sqlalchemy import text
+
+import model.DataRetention as DataRetention
+from model.DataManager import DataManager
+from orchard.database import _add_months, _month_start, _to_days
+
+
+class RecordingEngine:
+    """
+    Stands for the MySQL engine of ensure_partitions(), recording the
+    statements instead of executing them.
+    """
+
+    def __init__(self):
+        self.statements = []
+
+    @contextlib.contextmanager
+    def begin(self):
+        engine = self
+
+        class Conn:
+            def execute(self, sql):
+                engine.statements.append(str(sql))
+
+        yield Conn()
+
+
+@pytest.fixture
+def data_man():
+    man = DataManager()
+    with man.db_engine.begin() as conn:
+        conn.execute(man.table.delete())
+    return man
+
+
+def test_partition_table_sql(data_man):
+    sqls = data_man.partition_table_sql(datetime.date(2026, 1, 15), months_ahead=1)
+    assert len(sqls) == 2
+    # one ALTER for the column and the primary key
+    assert "MODIFY `data_time`" in sqls[0] and "NOT NULL" in sqls[0]
+    assert "DROP PRIMARY KEY, ADD PRIMARY KEY (`data_id`, `data_time`)" in sqls[0]
+    assert sqls[1].startswith("ALTER TABLE `data` PARTITION BY RANGE (TO_DAYS(`data_time`))")
+    assert "PARTITION p202601 VALUES LESS THAN (TO_DAYS('2026-02-01'))" in sqls[1]
+    assert sqls[1].rstrip(")\n").endswith("PARTITION p_future VALUES LESS THAN MAXVALUE")
+
+
+def test_partition_table_rejects_null_times(data_man):
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.insert().values(data_time=None, UV=1.0))
+    with pytest.raises(ValueError, match="NULL data_time"):
+        data_man.partition_table(datetime.date(2026, 1, 1))
+    # nothing was altered
+    with data_man.db_engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM data WHERE data_time IS NULL")).scalar() == 1
+
+
+def test_ensure_partitions_splits_p_future(data_man, monkeypatch):
+    this_month = _month_start(datetime.date.today())
+    last = _add_months(this_month, -1)
+    monkeypatch.setattr(data_man, 'list_partitions',
+                        lambda: [(f"p{last.strftime('%Y%m')}", _to_days(this_month)), ('p_future', None)])
+    engine = RecordingEngine()
+    monkeypatch.setattr(data_man, 'db_engine', engine)
+    created = data_man.ensure_partitions(months_ahead=2)
+    assert created == [f"p{_add_months(this_month, i).strftime('%Y%m')}" for i in range(3)]
+    assert len(engine.statements) == 1
+    assert engine.statements[0].startswith("ALTER TABLE `data` REORGANIZE PARTITION p_future INTO")
+
+
+def test_ensure_partitions_unpartitioned(data_man):
+    # SQLite tables are never partitioned
+    assert data_man.ensure_partitions() == []
+
+
+def test_partition_loop_runs_without_retention(monkeypatch):
+    calls = []
+    monkeypatch.setattr(DataRetention, 'DATA_RETENTION_DAYS', 0)
+    monkeypatch.setattr(DataRetention, 'maintain_partitions', lambda: calls.append('ensure') or [])
+
+    def sleep(seconds):
+        monkeypatch.setattr(DataRetention, 'stop', True)
+
+    monkeypatch.setattr(DataRetention.time, 'sleep', sleep)
+    DataRetention.partition_loop(interval=1)
+    assert calls == ['ensure']
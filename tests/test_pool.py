@@ -0,0 +1,101 @@
+import asyncio
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.pool import QueuePool
+
+from orchard import asyncdatabase, database, metrics
+from orchard.asyncdatabase import AsyncDbManager, async_pool_options
+from orchard.database import DbManager, PoolBusyError, connectivity, pool_options
+from orchard.metrics import QueryMetrics
+
+
+@pytest.fixture
+def fresh_metrics(monkeypatch):
+    qm = QueryMetrics()
+    monkeypatch.setattr(database, 'query_metrics', qm)
+    monkeypatch.setattr(metrics, 'query_metrics', qm)
+    monkeypatch.setattr(asyncdatabase, 'query_metrics', qm)
+    return qm
+
+
+def test_pool_options(monkeypatch):
+    monkeypatch.setattr(database, 'DB_POOL_ADMISSION', 'queue')
+    assert pool_options(3, 1)['pool_timeout'] == database.DB_POOL_TIMEOUT
+    assert (pool_options(3, 1)['pool_size'], pool_options(3, 1)['max_overflow']) == (3, 1)
+    monkeypatch.setattr(database, 'DB_POOL_ADMISSION', 'fail_fast')
+    assert pool_options()['pool_timeout'] == 0
+    assert async_pool_options()['pool_timeout'] == asyncdatabase.ASYNC_FAIL_FAST_TIMEOUT
+    monkeypatch.setattr(database, 'DB_POOL_ADMISSION', 'lifo')
+    with pytest.raises(ValueError):
+        pool_options()
+
+
+def test_pool_busy_is_not_an_sqlalchemy_error():
+    # the routes turn SQLAlchemyError into 400, this one must reach the 503 handler
+    assert not issubclass(PoolBusyError, SQLAlchemyError)
+
+
+def test_exhausted_pool_raises_pool_busy(fresh_metrics):
+    engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=1, max_overflow=0, pool_timeout=0)
+    with connectivity(engine)() as conn:
+        conn.execute(text("SELECT 1"))
+        with pytest.raises(PoolBusyError):
+            with connectivity(engine)():
+                pass
+    assert fresh_metrics.snapshot()['pool_events']['timeouts'] == 1
+    # the connection is back in the pool
+    with connectivity(engine)() as conn:
+        assert conn.execute(text("SELECT 1")).scalar() == 1
+    assert fresh_metrics.snapshot()['pool_checkout']['count'] == 2
+
+
+def async_engine(pool_size, max_overflow):
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+    uri = 'sqlite+aiosqlite:///' + os.path.join(tempfile.mkdtemp(prefix='orchard-pool-'), 'pool.db')
+    return create_async_engine(uri, poolclass=AsyncAdaptedQueuePool, **async_pool_options(pool_size, max_overflow))
+
+
+@pytest.mark.parametrize('admission', ['queue', 'fail_fast'])
+def test_async_pool_checkout(monkeypatch, fresh_metrics, admission):
+    monkeypatch.setattr(database, 'DB_POOL_ADMISSION', admission)
+    monkeypatch.setattr(database, 'DB_POOL_TIMEOUT', 0.2)
+    engine = async_engine(1, 0)
+    man = AsyncDbManager(DbManager.__new__(DbManager), engine=engine)
+
+    async def scenario():
+        # an idle connection is handed out, also when failing fast
+        assert await man.run(lambda connector: 1) == 1
+        assert await man.run(lambda connector: 2) == 2
+        held = await engine.connect()
+        try:
+            with pytest.raises(PoolBusyError):
+                await man.run(lambda connector: None)
+        finally:
+            await held.close()
+        result = await man.run(lambda connector: 3)
+        await engine.dispose()
+        return result
+
+    assert asyncio.run(asyncio.wait_for(scenario(), 10)) == 3
+    assert fresh_metrics.snapshot()['pool_events']['timeouts'] == 1
+
+
+def test_pool_busy_answers_503():
+    pytest.importorskip('fastapi')
+    from fastapi.testclient import TestClient
+
+    import fastapihandler
+
+    @fastapihandler.app.get("/test/pool-busy")
+    async def busy():
+        raise PoolBusyError("QueuePool limit reached")
+
+    response = TestClient(fastapihandler.app).get("/test/pool-busy")
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
@@ -0,0 +1,71 @@
+import threading
+import time
+
+from sqlalchemy import create_engine
+
+from orchard.replica import ReplicaRouter
+
+
+def engines(n):
+    return [create_engine('sqlite://') for _ in range(n)]
+
+
+def test_pick_does_not_measure():
+    calls = []
+    router = ReplicaRouter(engines(2), lag_fn=lambda e: calls.append(e) or 0.0, background=False)
+    # not measured yet: the primary
+    assert router.pick() is None
+    assert calls == []
+    router.refresh()
+    assert len(calls) == 2
+    assert [router.pick() for _ in range(4)] == [1, 0, 1, 0]
+    assert len(calls) == 2
+
+
+def test_lagging_and_broken_replicas_are_skipped():
+    lags = {0: 60.0, 1: None}
+    es = engines(2)
+    router = ReplicaRouter(es, max_lag=5, lag_fn=lambda e: lags[es.index(e)], background=False)
+    router.refresh()
+    assert router.pick() is None
+    assert router.fallbacks == 1
+    lags[1] = 1.0
+    router.refresh()
+    assert router.pick() == 1
+
+
+def test_stale_measurements_are_not_trusted():
+    router = ReplicaRouter(engines(1), check_interval=10, lag_fn=lambda e: 0.0, background=False)
+    router.refresh()
+    assert router.pick() == 0
+    router.checked[0] -= 31
+    assert router.pick() is None
+
+
+def test_lags_are_measured_in_the_background():
+    measured = threading.Event()
+    release = threading.Event()
+    readers = []
+
+    def slow_lag(engine):
+        readers.append(threading.current_thread())
+        measured.set()
+        # a lag check that hangs must not hold up the readers
+        release.wait(5)
+        return 0.0
+
+    router = ReplicaRouter(engines(1), check_interval=0.01, lag_fn=slow_lag)
+    try:
+        assert router.pick() is None
+        assert measured.wait(5)
+        assert router.pick() is None
+        assert readers[0] is not threading.current_thread()
+        release.set()
+        for _ in range(500):
+            if router.pick() == 0:
+                break
+            time.sleep(0.01)
+        assert router.pick() == 0
+    finally:
+        router.stop()
+        release.set()
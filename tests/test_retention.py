@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+import model.DataRetention as DataRetention
+from model.DataManager import DataIn, DataManager
+from model.DataRollup import ROLLUP_LEVELS, DataRollupManager
+
+
+def reading(t, value):
+    return {'data_time': t, 'UV': value, 'light': value, 'temp': value,
+            'air_humidity': value, 'soil_humidity': value}
+
+
+@pytest.fixture
+def data_man():
+    man = DataManager()
+    with man.db_engine.begin() as conn:
+        conn.execute(man.table.delete())
+        for width in ROLLUP_LEVELS:
+            conn.execute(DataRollupManager(width).table.delete())
+    return man
+
+
+def test_retention_cutoff_is_a_day_start():
+    assert DataRetention.retention_cutoff(30, now=datetime(2026, 3, 31, 15, 20)) == datetime(2026, 3, 1)
+
+
+def test_compact_keeps_recent_readings_and_the_history(data_man):
+    today = DataRetention.retention_cutoff(0)
+    old = today - timedelta(days=100)
+    # old readings written before the rollups existed, not rolled up
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.insert(), [reading(old + timedelta(hours=h), h) for h in range(24)])
+    recent = [DataIn(**reading(today - timedelta(days=1, hours=-h), h)) for h in range(3)]
+    data_man.insert(recent)
+    start, end = old, today + timedelta(days=1)
+    history = data_man.aggregate_raw(start, end, 86400)
+
+    assert DataRetention.compact(days=30, dry_run=True) == 24
+    assert data_man.count() == 27
+    assert DataRetention.compact(days=30, pause=0) == 24
+    assert sorted(d.data_time for d in data_man.search("1")) == [d.data_time for d in recent]
+    # the compacted days are summarized in the rollups
+    assert data_man.aggregate(start, end, 86400) == history
+    # nothing left to compact
+    assert DataRetention.compact(days=30, pause=0) == 0
+
+
+def test_compact_disabled(data_man):
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.insert(), [reading(datetime(2000, 1, 1), 1)])
+    assert DataRetention.compact(days=0) == 0
+    assert data_man.count() == 1
+
+
+def test_expire_rollups(data_man, monkeypatch):
+    monkeypatch.setattr(DataRetention, 'ROLLUP_RETENTION_DAYS', {60: 10, 3600: 0, 86400: 0})
+    today = DataRetention.retention_cutoff(0)
+    for t in (today - timedelta(days=20), today - timedelta(days=5)):
+        data_man.insert(DataIn(**reading(t, 1)))
+    assert DataRetention.expire_rollups(pause=0) == 1
+    assert [r.bucket_time for r in DataRollupManager(60).search("1")] == [today - timedelta(days=5)]
+    # the levels without retention are kept
+    assert DataRollupManager(3600).count() == 2
@@ -0,0 +1,131 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from model.DataManager import DataIn, DataManager
+import model.DataRollup as DataRollup
+from model.DataRollup import ROLLUP_LEVELS, DataRollupManager
+
+
+def reading(t, value):
+    return {'data_time': t, 'UV': value, 'light': value, 'temp': value,
+            'air_humidity': value, 'soil_humidity': value}
+
+
+def summary(buckets):
+    return [(b.bucket_time, b.count, b.temp.min, b.temp.max, b.temp.avg) for b in buckets]
+
+
+@pytest.fixture
+def data_man():
+    man = DataManager()
+    with man.db_engine.begin() as conn:
+        conn.execute(man.table.delete())
+        for width in ROLLUP_LEVELS:
+            conn.execute(DataRollupManager(width).table.delete())
+    return man
+
+
+def test_history_before_the_rollups_uses_the_raw_readings(data_man):
+    # readings from before the rollups existed: in the raw table only
+    day = datetime(2026, 3, 1)
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.insert(), [reading(day + timedelta(hours=h, minutes=10), h) for h in range(5)])
+    # readings inserted since, also rolled up; the first one shares its
+    # hour with an older raw reading
+    for (h, m) in ((4, 40), (5, 10), (6, 10)):
+        data_man.insert(DataIn(**reading(day + timedelta(hours=h, minutes=m), 10 + h)))
+    start, end = day, day + timedelta(days=1)
+    expected = summary(data_man.aggregate_raw(start, end, 3600))
+    assert len(expected) == 7
+    assert summary(data_man.aggregate(start, end, 3600)) == expected
+    # the rollups alone miss the older readings
+    assert summary(DataRollupManager(3600).aggregate(start, end, 3600)) != expected
+    # a bucket spanning both sources is merged
+    assert summary(data_man.aggregate(start, end, 7200)) == summary(data_man.aggregate_raw(start, end, 7200))
+
+
+def test_rollups_answer_for_compacted_readings(data_man):
+    day = datetime(2026, 3, 1)
+    data_man.insert([DataIn(**reading(day + timedelta(hours=h), h)) for h in range(3)])
+    expected = summary(data_man.aggregate(day, day + timedelta(days=1), 3600))
+    # the raw readings are gone (see model.DataRetention.compact)
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.delete())
+    assert DataRollupManager(3600).covered_from() == day
+    assert summary(data_man.aggregate(day, day + timedelta(days=1), 3600)) == expected
+
+
+def test_empty_rollups_use_the_raw_readings(data_man):
+    day = datetime(2026, 3, 1)
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.insert(), [reading(day + timedelta(minutes=m), m) for m in range(3)])
+    assert DataRollupManager(3600).covered_from() is None
+    assert summary(data_man.aggregate(day, day + timedelta(days=1), 3600)) == \
+        [(day, 3, 0.0, 2.0, 1.0)]
+
+
+def test_inserts_maintain_every_level(data_man):
+    t = datetime(2026, 3, 2, 10, 0, 5)
+    data_man.insert([DataIn(**reading(t, 1.0)), DataIn(**reading(t + timedelta(seconds=20), 3.0))])
+    # a later insert into the same buckets is merged
+    data_man.insert(DataIn(**reading(t + timedelta(seconds=40), 8.0)))
+    data_man.insert(DataIn(**reading(t + timedelta(minutes=5), 4.0)))
+    expected = {
+        60: [(t.replace(second=0), 3, 1.0, 8.0, 12.0), (t.replace(minute=5, second=0), 1, 4.0, 4.0, 4.0)],
+        3600: [(t.replace(second=0), 4, 1.0, 8.0, 16.0)],
+        86400: [(t.replace(hour=0, second=0), 4, 1.0, 8.0, 16.0)],
+    }
+    for width in ROLLUP_LEVELS:
+        rows = DataRollupManager(width).search("1", order_by='bucket_time')
+        assert [(r.bucket_time, r.samples, r.temp_min, r.temp_max, r.temp_sum) for r in rows] == expected[width]
+
+
+def test_summarize_skips_missing_values():
+    rollup = DataRollupManager(60)
+    t = datetime(2026, 3, 2, 10, 0, 0)
+    rows = rollup.summarize([dict(reading(t, 2.0), temp=None), reading(t, 4.0), {'data_time': None}])
+    assert len(rows) == 1
+    assert rows[0]['samples'] == 2
+    assert (rows[0]['temp_min'], rows[0]['temp_max'], rows[0]['temp_sum']) == (4.0, 4.0, 4.0)
+    assert rows[0]['UV_sum'] == 6.0
+
+
+def test_backfill_matches_the_raw_readings(data_man):
+    day = datetime(2026, 3, 3)
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.insert(),
+                     [reading(day + timedelta(minutes=17 * i), i % 7) for i in range(200)])
+    end = day + timedelta(days=3)
+    DataRollup.backfill(day, end)
+    # rebuilding is idempotent
+    DataRollup.backfill(day, end)
+    for (width, bucket) in ((60, 60), (3600, 3600), (86400, 86400)):
+        assert summary(DataRollupManager(width).aggregate(day, end, bucket)) == \
+            summary(data_man.aggregate_raw(day, end, bucket))
+
+
+@pytest.mark.parametrize('start, end, bucket, width', [
+    (datetime(2026, 3, 1), datetime(2026, 3, 8), 86400, 86400),
+    (datetime(2026, 3, 1), datetime(2026, 3, 8), 3600, 3600),
+    (datetime(2026, 3, 1, 1), datetime(2026, 3, 2), 7200, 3600),
+    (datetime(2026, 3, 1, 0, 1), datetime(2026, 3, 1, 2), 120, 60),
+    (datetime(2026, 3, 1, 0, 0, 30), datetime(2026, 3, 1, 2), 60, None),
+    (datetime(2026, 3, 1), datetime(2026, 3, 2), 90, None),
+])
+def test_rollup_level(start, end, bucket, width):
+    assert DataRollup.rollup_level(start, end, bucket) == width
+
+
+def test_aligned_queries_use_the_rollups(data_man):
+    day = datetime(2026, 3, 5)
+    for h in range(4):
+        data_man.insert(DataIn(**reading(day + timedelta(hours=h, minutes=30), h)))
+    # a raw row the rollups do not know about tells which source answered
+    with data_man.db_engine.begin() as conn:
+        conn.execute(data_man.table.insert(), [reading(day + timedelta(hours=3, minutes=45), 100)])
+    rolled = summary(data_man.aggregate(day, day + timedelta(days=1), 3600))
+    assert rolled[-1] == (day + timedelta(hours=3), 1, 3.0, 3.0, 3.0)
+    # not aligned to a rollup: raw readings
+    raw = summary(data_man.aggregate(day + timedelta(seconds=30), day + timedelta(days=1), 1800))
+    assert raw[-1] == (day + timedelta(hours=3, minutes=30), 2, 3.0, 100.0, 51.5)
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import tempfile
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+from sqlalchemy import MetaData
+
+from orchard import asyncdatabase, database
+from orchard.asyncdatabase import AsyncDbManager
+from orchard.cache import LRUCache
+from orchard.database import DbManager, connectivity, create_db_engine
+from orchard.replica import ReplicaRouter
+
+
+class Item(BaseModel):
+    item_id: Optional[int] = None
+    name: str
+
+
+class ItemManager(DbManager):
+
+    sql_create_table = """
+CREATE TABLE `item` (
+  `item_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `name` varchar(64) NOT NULL,
+  PRIMARY KEY (`item_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__("item", Item, **kwargs)
+
+
+@pytest.fixture
+def lagging_replica(monkeypatch):
+    """
+    A replica which still has the old version of item 1, while the
+    primary has the new one.
+    """
+    uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='orchard-replica-'), 'replica.db')
+    replica = ItemManager(engine=create_db_engine(uri), meta=MetaData())
+    replica.insert(Item(item_id=1, name='old'))
+    router = ReplicaRouter([replica.db_engine], lag_fn=lambda e: 0.0, background=False)
+    router.refresh()
+    monkeypatch.setattr(database, 'replica_router', router)
+    monkeypatch.setattr(asyncdatabase, 'replica_router', database.replica_router)
+    monkeypatch.setattr(asyncdatabase, 'DB_REPLICA_URIS', [uri])
+    primary = ItemManager(cache=LRUCache(maxsize=16, ttl=None))
+    primary.delete_in_batches("1")
+    primary.insert(Item(item_id=1, name='new'))
+    return primary
+
+
+def test_plain_reads_use_the_replica(lagging_replica):
+    assert lagging_replica.get_with_key(1).name == 'old'
+
+
+def test_cacheable_reads_use_the_primary(lagging_replica):
+    assert lagging_replica.get_with_key(1, cacheable=True).name == 'new'
+    # served from the cache, which holds the primary's row
+    assert lagging_replica.get_with_key(1, cacheable=True).name == 'new'
+
+
+def test_async_cacheable_and_read_back_use_the_primary(lagging_replica):
+    man = AsyncDbManager(lagging_replica)
+    assert asyncio.run(man.get_with_key(1)).name == 'old'
+    assert asyncio.run(man.get_with_key(1, cacheable=True)).name == 'new'
+    assert asyncio.run(man.get_with_key(1, primary=True)).name == 'new'
+
+
+def test_update_invalidates_the_cache(lagging_replica):
+    assert lagging_replica.get_with_key(1, cacheable=True).name == 'new'
+    lagging_replica.update(Item(item_id=1, name='newer'), 1)
+    assert lagging_replica.get_with_key(1, cacheable=True).name == 'newer'
+
+
+def test_read_during_update_is_not_cached(lagging_replica):
+    connector = connectivity(lagging_replica.db_engine)
+    with connector():
+        lagging_replica.update(Item(item_id=1, name='newer'), 1, connector=connector)
+        # a concurrent reader still sees (and caches) the committed row
+        assert lagging_replica.get_with_key(1, cacheable=True).name == 'new'
+    assert lagging_replica.get_with_key(1, cacheable=True).name == 'newer'
+
+
+def test_async_update_invalidates_after_commit(lagging_replica):
+    man = AsyncDbManager(lagging_replica)
+    assert lagging_replica.get_with_key(1, cacheable=True).name == 'new'
+    asyncio.run(man.update_with_get(Item(item_id=1, name='newer'), 1))
+    assert lagging_replica.get_with_key(1, cacheable=True).name == 'newer'
@@ -0,0 +1,90 @@
+import binascii
+import struct
+
+from serialprotocol import CRC, FRAME_SAMPLES, FRAME_WINDOW, HEADER, PROTOCOL_VERSION, SYNC, FrameParser
+
+
+def frame(seq, samples, kind=FRAME_SAMPLES, count=None, chans=3):
+    fmt = 'H' if kind == FRAME_SAMPLES else 'HHHI'
+    body = HEADER.pack(SYNC, PROTOCOL_VERSION, kind, seq, seq * 500, 50,
+                       len(samples) if count is None else count, chans)[len(SYNC):]
+    body += b''.join(struct.pack('<' + fmt * chans, *s) for s in samples)
+    return SYNC + body + CRC.pack(binascii.crc32(body))
+
+
+def feed_in_chunks(parser, data, size):
+    frames = []
+    for i in range(0, len(data), size):
+        frames += parser.feed(data[i:i + size])
+    return frames
+
+
+def test_frames_in_chunks():
+    data = b''.join(frame(seq, [(seq, i, 4095) for i in range(10)]) for seq in range(20))
+    for size in (1, 7, 64, len(data)):
+        parser = FrameParser()
+        frames = feed_in_chunks(parser, b'noise' + data, size)
+        assert [f.seq for f in frames] == list(range(20))
+        assert frames[-1].samples[-1] == (19, 9, 4095)
+        assert parser.stats['skipped'] == len(b'noise')
+        assert len(parser.buf) == 0
+
+
+def test_window_frames():
+    sample = (2000, 1990, 2010, 40, 1000, 900, 1100, 3000, 4095, 4000, 4095, 100000)
+    frames = FrameParser().feed(frame(0, [sample] * 10, kind=FRAME_WINDOW))
+    assert len(frames) == 1
+    assert frames[0].samples == [sample] * 10
+
+
+def test_crc_error_and_lost_frames():
+    frames = [frame(seq, [(1, 2, 3)]) for seq in range(5)]
+    corrupted = bytearray(frames[1])
+    corrupted[-6] ^= 0xFF
+    parser = FrameParser()
+    out = parser.feed(frames[0] + bytes(corrupted) + frames[2] + frames[4])
+    assert [f.seq for f in out] == [0, 2, 4]
+    assert parser.stats['crc_errors'] == 1
+    assert parser.stats['lost'] == 2
+
+
+def test_corrupted_header_does_not_stall():
+    # a header announcing 255 samples of 255 channels must not make the
+    # parser wait for ~650 KB
+    bogus = SYNC + HEADER.pack(SYNC, PROTOCOL_VERSION, FRAME_WINDOW, 0, 0, 50, 255, 255)[len(SYNC):]
+    good = b''.join(frame(seq, [(seq, 0, 0)] * 10) for seq in range(34))
+    parser = FrameParser()
+    out = parser.feed(bogus + good)
+    assert len(out) == 34
+    assert len(parser.buf) == 0
+
+
+def test_rejects_unexpected_channels_and_counts():
+    parser = FrameParser()
+    assert parser.feed(frame(0, [(1, 2)], chans=2)) == []
+    assert parser.feed(frame(1, [], count=0)) == []
+    assert [f.seq for f in parser.feed(frame(2, [(1, 2, 3)]))] == [2]
+
+
+def test_partial_sync_at_end():
+    data = frame(0, [(1, 2, 3)])
+    parser = FrameParser()
+    # the frame ends exactly at the buffer end, then a lone 0xAA arrives
+    assert len(parser.feed(data)) == 1
+    assert parser.feed(SYNC[:1]) == []
+    assert parser.stats['skipped'] == 0
+    assert bytes(parser.buf) == SYNC[:1]
+    # the kept byte completes a sync marker
+    out = parser.feed(frame(1, [(4, 5, 6)])[1:])
+    assert [f.seq for f in out] == [1]
+    assert parser.stats['skipped'] == 0
+    assert len(parser.buf) == 0
+
+
+def test_frame_ending_in_sync_byte():
+    # a frame whose last CRC byte is 0xAA must not leave that byte behind
+    data = next(f for f in (frame(seq, [(seq, 0, 0)]) for seq in range(10000)) if f[-1:] == SYNC[:1])
+    parser = FrameParser()
+    assert len(parser.feed(data)) == 1
+    assert parser.stats['skipped'] == 0
+    assert len(parser.buf) == 0
@@ -0,0 +1,107 @@
+import os
+import tempfile
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from model.DataManager import DataManager
+from orchard.database import connectivity, create_db_engine, sqlite_create_table
+
+PRESET_TABLE = """
+CREATE TABLE `export_preset` (
+  `preset_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `preset_name` varchar(200) DEFAULT NULL COMMENT 'shown in the list, ''quoted''',
+  `kind` enum('csv','xlsx') NOT NULL DEFAULT 'csv',
+  `update_time` timestamp NOT NULL DEFAULT current_timestamp() ON UPDATE current_timestamp(),
+  `create_time` datetime DEFAULT current_timestamp(),
+  `label` varchar(20) CHARACTER SET latin1 COLLATE latin1_bin DEFAULT NULL,
+  PRIMARY KEY (`preset_id`),
+  UNIQUE KEY `preset_name` (`preset_name`),
+  KEY `kind_time` (`kind`, `create_time`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+"""
+
+
+def execute(sqls):
+    engine = create_engine('sqlite://')
+    with engine.begin() as conn:
+        for sql in sqls:
+            conn.execute(text(sql))
+    return engine
+
+
+def test_translation():
+    sqls = sqlite_create_table(PRESET_TABLE)
+    assert len(sqls) == 3
+    create = sqls[0]
+    assert create.startswith('CREATE TABLE IF NOT EXISTS "export_preset"')
+    assert '"preset_id" INTEGER PRIMARY KEY AUTOINCREMENT' in create
+    assert '"kind" text NOT NULL' in create
+    assert '"update_time" timestamp NOT NULL DEFAULT CURRENT_TIMESTAMP,' in create
+    for mysql_only in ('unsigned', 'COMMENT', 'ON UPDATE', 'CHARACTER SET', 'COLLATE', 'ENGINE', 'enum'):
+        assert mysql_only not in create
+    assert sqls[1] == 'CREATE UNIQUE INDEX IF NOT EXISTS "export_preset_preset_name" ON "export_preset" ("preset_name")'
+    assert sqls[2] == 'CREATE INDEX IF NOT EXISTS "export_preset_kind_time" ON "export_preset" ("kind", "create_time")'
+
+
+def test_translated_table_works():
+    engine = execute(sqlite_create_table(PRESET_TABLE))
+    insp = inspect(engine)
+    assert {i['name']: i['column_names'] for i in insp.get_indexes('export_preset')} == \
+        {'export_preset_preset_name': ['preset_name'], 'export_preset_kind_time': ['kind', 'create_time']}
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO export_preset (preset_name) VALUES ('a'), ('b')"))
+        rows = conn.execute(text("SELECT preset_id, kind, create_time FROM export_preset")).fetchall()
+    assert [r[0] for r in rows] == [1, 2]
+    assert rows[0][1] == 'csv' and rows[0][2] is not None
+
+
+def test_composite_primary_key():
+    sqls = sqlite_create_table("""
+CREATE TABLE `reading` (
+  `sensor_id` int(10) unsigned NOT NULL,
+  `t` datetime NOT NULL,
+  `value` float DEFAULT NULL,
+  PRIMARY KEY (`sensor_id`, `t`)
+) ENGINE=InnoDB
+""")
+    assert 'PRIMARY KEY ("sensor_id", "t")' in sqls[0]
+    engine = execute(sqls)
+    assert inspect(engine).get_pk_constraint('reading')['constrained_columns'] == ['sensor_id', 't']
+
+
+def test_untranslatable_statements():
+    with pytest.raises(ValueError):
+        sqlite_create_table("ALTER TABLE `x` ADD `y` int")
+    with pytest.raises(ValueError):
+        sqlite_create_table("""
+CREATE TABLE `x` (
+  `x_id` int NOT NULL AUTO_INCREMENT,
+  `y` int NOT NULL,
+  PRIMARY KEY (`x_id`, `y`)
+)
+""")
+
+
+def test_data_table_is_created_from_the_mysql_ddl():
+    man = DataManager()
+    assert man.db_engine.dialect.name == 'sqlite'
+    assert 'data_time' in [i['column_names'][0] for i in inspect(man.db_engine).get_indexes('data')]
+
+
+def test_engine_pragmas_and_transactions():
+    uri = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='orchard-sqlite-'), 'test.db')
+    engine = create_db_engine(uri)
+    with engine.connect() as conn:
+        assert conn.exec_driver_sql("PRAGMA journal_mode").scalar() == 'wal'
+        assert conn.exec_driver_sql("PRAGMA foreign_keys").scalar() == 1
+        assert conn.exec_driver_sql("PRAGMA busy_timeout").scalar() == 5000
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (x int)"))
+    # a connectivity() transaction is rolled back as a whole
+    with pytest.raises(RuntimeError):
+        with connectivity(engine)() as conn:
+            conn.execute(text("INSERT INTO t VALUES (1)"))
+            raise RuntimeError()
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT count(*) FROM t")).scalar() == 0
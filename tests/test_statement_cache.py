@@ -0,0 +1,102 @@
+from typing import Optional
+
+import pytest
+from pydantic import BaseModel
+
+from orchard import database
+from orchard.cache import LRUCache
+from orchard.database import DbManager, clear_table_registry
+
+
+class Fruit(BaseModel):
+    fruit_id: Optional[int] = None
+    kind: str
+
+
+class FruitManager(DbManager):
+
+    sql_create_table = """
+CREATE TABLE `fruit` (
+  `fruit_id` int(10) unsigned NOT NULL AUTO_INCREMENT,
+  `kind` varchar(32) NOT NULL,
+  PRIMARY KEY (`fruit_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+    """
+
+    def __init__(self):
+        super().__init__("fruit", Fruit)
+
+
+KINDS = ['apple', 'pear', 'apple', 'plum', 'apple', 'pear']
+
+
+@pytest.fixture
+def fruits(monkeypatch):
+    monkeypatch.setattr(database, 'statement_cache', LRUCache(maxsize=16, ttl=None))
+    man = FruitManager()
+    man.delete_in_batches("1")
+    for (i, kind) in enumerate(KINDS, start=1):
+        man.insert(Fruit(fruit_id=i, kind=kind))
+    return man
+
+
+def test_pages_share_one_statement(fruits):
+    (first, first_params) = fruits.build_search_sql("kind = 'apple'", page=0, page_size=2)
+    (second, second_params) = fruits.build_search_sql("kind = 'apple'", page=1, page_size=2)
+    assert first is second
+    assert (first_params, second_params) == ({'page_limit_': 2, 'page_offset_': 0},
+                                             {'page_limit_': 2, 'page_offset_': 2})
+    # the values are bound per call, not baked into the statement
+    assert [f.fruit_id for f in fruits.search("kind = 'apple'", page=0, page_size=2)] == [1, 3]
+    assert [f.fruit_id for f in fruits.search("kind = 'apple'", page=1, page_size=2)] == [5]
+    stats = database.statement_cache.stats()
+    assert (stats['size'], stats['misses']) == (1, 1)
+    assert stats['hits'] == 3
+
+
+def test_shapes_get_their_own_statements(fruits):
+    statements = [
+        fruits.build_search_sql("kind = 'apple'")[0],
+        fruits.build_search_sql("kind = 'pear'")[0],
+        fruits.build_search_sql("kind = 'apple'", order_by='fruit_id DESC')[0],
+        fruits.build_search_sql("kind = 'apple'", page_size=2)[0],
+        fruits.build_search_sql("kind = 'apple'", with_total=True)[0],
+    ]
+    assert len({id(s) for s in statements}) == len(statements)
+    assert database.statement_cache.stats()['size'] == len(statements)
+    assert [f.fruit_id for f in fruits.search("kind = 'pear'", order_by='fruit_id DESC')] == [6, 2]
+
+
+def test_lookups_by_key_bind_the_key(fruits):
+    assert [fruits.get_with_key(k).kind for k in (1, 2, 4)] == ['apple', 'pear', 'plum']
+    assert fruits.get_with_key(99) is None
+    stats = database.statement_cache.stats()
+    assert (stats['size'], stats['misses'], stats['hits']) == (1, 1, 3)
+
+
+def test_counts_are_cached_per_criteria(fruits):
+    assert fruits.count("kind = 'apple'") == 3
+    assert fruits.count("kind = 'apple'") == 3
+    assert fruits.count("kind = 'pear'") == 2
+    assert fruits.count() == len(KINDS)
+    assert database.statement_cache.stats()['size'] == 3
+
+
+def test_the_cache_is_bounded(fruits, monkeypatch):
+    monkeypatch.setattr(database, 'statement_cache', LRUCache(maxsize=2, ttl=None))
+    for kind in ('apple', 'pear', 'plum'):
+        fruits.search(f"kind = '{kind}'")
+    stats = database.statement_cache.stats()
+    assert (stats['size'], stats['evictions']) == (2, 1)
+    # the least recently used shape is built again
+    assert [f.fruit_id for f in fruits.search("kind = 'apple'")] == [1, 3, 5]
+    assert database.statement_cache.stats()['misses'] == 4
+
+
+def test_forgetting_the_table_drops_its_statements(fruits):
+    fruits.search("kind = 'apple'")
+    assert database.statement_cache.stats()['size'] == 1
+    clear_table_registry('fruit')
+    assert database.statement_cache.stats()['size'] == 0
+    # a manager reflecting the table again builds new statements
+    assert [f.fruit_id for f in FruitManager().search("kind = 'apple'")] == [1, 3, 5]
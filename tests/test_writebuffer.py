@@ -0,0 +1,124 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from model.DataManager import Data, DataIn, DataManager
+from orchard.writebuffer import WriteBuffer
+
+
+def reading(i, cls=DataIn, **kwargs):
+    return cls(data_time=datetime(2026, 1, 1, 0, 0, i), UV=i, light=i, temp=i, air_humidity=i, soil_humidity=i,
+               **kwargs)
+
+
+@pytest.fixture
+def data_man():
+    man = DataManager()
+    with man.db_engine.begin() as conn:
+        conn.execute(man.table.delete())
+    return man
+
+
+def buffer(man, **kwargs):
+    return WriteBuffer(man, flush_interval=None, flush_at_exit=False, **kwargs)
+
+
+def test_flush_writes_rows(data_man):
+    buf = buffer(data_man, max_rows=3)
+    for i in range(3):
+        buf.add(reading(i))
+    assert len(buf) == 0
+    assert data_man.count() == 3
+
+
+def test_transient_errors_back_off(data_man, monkeypatch):
+    calls = []
+    insert_bulk = data_man.insert_bulk
+
+    def failing(objs, **kwargs):
+        calls.append(len(objs))
+        raise OperationalError("INSERT", {}, Exception("server has gone away"))
+
+    monkeypatch.setattr(data_man, 'insert_bulk', failing)
+    buf = buffer(data_man, max_rows=2, retry_delay=60)
+    for i in range(6):
+        buf.add(reading(i))
+    # one attempt, the next adds wait for the retry delay
+    assert calls == [2]
+    assert len(buf) == 6
+    assert buf.failures == 1
+    # the delay doubles
+    buf.flush(force=True)
+    assert buf.failures == 2
+    assert buf.retry_at is not None
+    # the database is back
+    monkeypatch.setattr(data_man, 'insert_bulk', insert_bulk)
+    assert buf.flush(force=True) == 6
+    assert buf.failures == 0 and buf.retry_at is None
+    assert data_man.count() == 6
+
+
+def test_backoff_is_bounded(data_man, monkeypatch):
+    monkeypatch.setattr(data_man, 'insert_bulk', lambda objs, **kwargs: (_ for _ in ()).throw(
+        OperationalError("INSERT", {}, Exception("down"))))
+    buf = buffer(data_man, retry_delay=1, max_retry_delay=4, max_pending=3)
+    for i in range(5):
+        buf.add(reading(i))
+        buf.flush(force=True)
+    assert buf.retry_at is not None
+    assert len(buf) == 3
+    assert buf.dropped == 2
+
+
+def test_pending_rows_are_bounded_while_backing_off(data_man, monkeypatch):
+    monkeypatch.setattr(data_man, 'insert_bulk', lambda objs, **kwargs: (_ for _ in ()).throw(
+        OperationalError("INSERT", {}, Exception("down"))))
+    buf = buffer(data_man, max_rows=2, retry_delay=60, max_pending=5)
+    # the first flush fails, the next adds do not flush
+    for i in range(20):
+        buf.add(reading(i))
+    assert len(buf) == 5
+    assert buf.dropped == 15
+    # the newest rows are kept
+    assert [r.UV for r in buf.rows] == [15, 16, 17, 18, 19]
+
+
+def test_rejected_rows_are_dropped(data_man):
+    buf = buffer(data_man, max_rows=100)
+    buf.add(reading(1, Data, data_id=1))
+    buf.flush()
+    # a duplicate key cannot be written by retrying: only that row is
+    # dropped, the valid rows of the batch are written
+    buf.add(reading(2, Data, data_id=2))
+    buf.add(reading(3, Data, data_id=1))
+    buf.add(reading(4, Data, data_id=3))
+    assert buf.flush() == 2
+    assert len(buf) == 0
+    assert buf.dropped == 1
+    assert buf.retry_at is None
+    assert sorted(d.UV for d in data_man.search("1")) == [1, 2, 4]
+    # and does not block the following rows
+    buf.add(reading(5, Data, data_id=4))
+    assert buf.flush() == 1
+    assert data_man.count() == 4
+
+
+def test_transient_error_while_writing_one_by_one(data_man, monkeypatch):
+    insert_bulk = data_man.insert_bulk
+
+    def flaky(objs, **kwargs):
+        if len(objs) > 1:
+            raise IntegrityError("INSERT", {}, Exception("duplicate"))
+        if objs[0].data_id == 2:
+            raise OperationalError("INSERT", {}, Exception("down"))
+        return insert_bulk(objs, **kwargs)
+
+    monkeypatch.setattr(data_man, 'insert_bulk', flaky)
+    buf = buffer(data_man, max_rows=100, retry_delay=60)
+    for i in (1, 2, 3):
+        buf.add(reading(i, Data, data_id=i))
+    assert buf.flush() == 1
+    # the rows not written yet are kept for the retry
+    assert [r.data_id for r in buf.rows] == [2, 3]
+    assert buf.failures == 1 and buf.dropped == 0